@@ -0,0 +1,209 @@
+"""
+Журналы в JSON (запросы, медленные SQL): запись через буфер в памяти и отдельный поток, ротация по размеру
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:              # Windows: без блокировки файла, один процесс
+    fcntl = None
+
+import timing
+from metrics import route_template
+
+ACCESS_LOG = os.environ.get("ACCESS_LOG", "")    # пусто — журнал не пишется
+ACCESS_LOG_MAX_BYTES = int(os.environ.get("ACCESS_LOG_MAX_MB", "100")) * 1024 * 1024
+ACCESS_LOG_BACKUPS = int(os.environ.get("ACCESS_LOG_BACKUPS", "5"))
+ACCESS_LOG_BUFFER = 50000        # записей в памяти; при переполнении теряются самые старые
+ACCESS_LOG_FLUSH_INTERVAL = 0.5  # период записи буфера на диск, секунд
+
+
+class JsonLogWriter:
+    """
+    Запрос только кладёт запись (dict) в кольцевой буфер — без блокировок,
+    сериализации и обращения к диску. Поток записи раз в интервал забирает
+    всё накопленное, кодирует в JSON и пишет одним write; при превышении
+    max_bytes файл ротируется: access.jsonl → access.jsonl.1 → … → .N.
+    Если диск не успевает, буфер переполняется и теряет старые записи
+    (счётчик dropped), но запросы не ждут.
+
+    Файл пишет и ротирует только один процесс — тот, что взял блокировку
+    path.lock. Остальные процессы с тем же путём (uvicorn --workers) пишут
+    каждый в свой файл с pid: access.1234.jsonl.
+    """
+
+    def __init__(self, path: str = ACCESS_LOG, max_bytes: int = ACCESS_LOG_MAX_BYTES,
+                 backups: int = ACCESS_LOG_BACKUPS, buffer_size: int = ACCESS_LOG_BUFFER, name: str = "access-log"):
+        self.path = path
+        self.name = name
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._lock = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def write(self, record: Dict):
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(record)
+
+    # ─── Жизненный цикл ───
+
+    async def start(self):
+        if not self.path:
+            return
+        self._claim_path()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=5.0)
+        self._thread = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def _claim_path(self):
+        if fcntl is None:
+            return
+        lock = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            root, ext = os.path.splitext(self.path)
+            self.path = f"{root}.{os.getpid()}{ext}"
+            print(f"ℹ️ Журнал {self.name} уже пишет другой процесс — этот пишет в {self.path}")
+            return
+        self._lock = lock
+
+    def _run(self):
+        while not self._stopping.wait(ACCESS_LOG_FLUSH_INTERVAL):
+            self._flush()
+        self._flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _flush(self):
+        records: List[Dict] = []
+        while self._buffer:
+            records.append(self._buffer.popleft())
+        if not records:
+            return
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        try:
+            if self._file is None:
+                self._file = open(self.path, "ab")
+            self._file.write(data)
+            self._file.flush()
+            self.written += len(records)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            self.dropped += len(records)
+            print(f"⚠️ Ошибка записи журнала {self.name}: {e}")
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                source = f"{self.path}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+
+
+def cache_status(timings: Dict[str, List[float]]) -> Optional[str]:
+    """hit / miss / partial по обращениям к остаткам inventory; None — запрос к ним не обращался"""
+    hits = timings.get("cache_hit", (0.0, 0))[1]
+    misses = timings.get("cache_miss", (0.0, 0))[1]
+    if not hits and not misses:
+        return None
+    if not misses:
+        return "hit"
+    return "miss" if not hits else "partial"
+
+
+class AccessLogMiddleware:
+    """
+    ASGI-middleware: строка журнала на каждый HTTP-запрос — маршрут, статус,
+    время, пользователь, число SQL-запросов, кэш остатков и размер ответа.
+    Стоит снаружи SessionMiddleware (пользователь из сессии) и внутри
+    ServerTimingMiddleware (время по составляющим берётся оттуда, для
+    запросов вне его выборки собирается здесь).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not access_log.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        timings = timing.current()
+        token = None
+        if timings is None:
+            timings, token = timing.begin()
+        ts = time.time()
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            latency = time.perf_counter() - started
+            if token is not None:
+                timing.end(token)
+            session = scope.get("session") or {}
+            db_seconds, queries = timings.get("db", (0.0, 0))
+            access_log.write({
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ts)) + f".{int(ts * 1000) % 1000:03d}",
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route_template(scope),
+                "status": status,
+                "latency_ms": round(latency * 1000, 3),
+                "user_id": session.get("user_id"),
+                "queries": queries,
+                "db_ms": round(db_seconds * 1000, 3),
+                "cache": cache_status(timings),
+                "bytes": size,
+            })
+
+
+access_log = JsonLogWriter()
@@ -0,0 +1,184 @@
+"""
+Контроль допуска к оформлению заказа при пиковой нагрузке
+"""
+
+import asyncio
+import bisect
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional
+
+CHECKOUT_CONCURRENCY = 4         # одновременных оформлений (SQLite пишет в один поток)
+CHECKOUT_QUEUE_SIZE = 100        # ожидающих слота внутри запроса
+CHECKOUT_QUEUE_TIMEOUT = 10.0    # секунд ожидания слота, потом — в очередь с талоном
+TICKET_TTL = 30.0                # талон сгорает, если клиент перестал опрашивать статус
+
+
+class AdmissionRejected(Exception):
+    """Слот не получен; ticket — талон в очереди ожидания"""
+
+    def __init__(self, ticket: str, position: int):
+        super().__init__(f"Очередь на оформление: талон {ticket}, позиция {position}")
+        self.ticket = ticket
+        self.position = position
+
+
+class AdmissionController:
+    """
+    Ограничивает число одновременно выполняемых запросов.
+
+    До limit запросов выполняются сразу, следующие до max_queue ждут слота
+    в порядке поступления не дольше timeout. Всё, что сверху, получает
+    талон в очереди ожидания: клиент опрашивает status() и повторяет
+    запрос с талоном, когда для него найдётся место. Места (свободные
+    слоты и места в ожидании) раздаются с головы очереди талонов; новый
+    запрос без талона проходит, только если место осталось после всех
+    стоящих в очереди. Талон, не дождавшийся слота, возвращается в очередь
+    на своё прежнее место.
+    """
+
+    def __init__(self, limit: int = CHECKOUT_CONCURRENCY, max_queue: int = CHECKOUT_QUEUE_SIZE,
+                 timeout: float = CHECKOUT_QUEUE_TIMEOUT, ticket_ttl: float = TICKET_TTL):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.ticket_ttl = ticket_ttl
+
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._tickets: Dict[str, List[float]] = {}   # талон -> [номер, последний опрос], по возрастанию номера
+        self._line: List[int] = []                   # номера талонов по возрастанию — для позиции
+        self._next_seq = 0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def in_line(self) -> int:
+        return len(self._tickets)
+
+    @asynccontextmanager
+    async def slot(self, ticket: str = None):
+        await self.acquire(ticket)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, ticket: str = None):
+        self._expire_tickets()
+
+        seq = None
+        if ticket in self._tickets:
+            if self._position(ticket) > self._room():
+                raise self._reject(ticket)
+            seq = self._take_ticket(ticket)
+        elif self._tickets and len(self._tickets) >= self._room():
+            raise self._reject()
+
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject(ticket, seq)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, self.timeout)
+        except asyncio.TimeoutError:
+            self._drop_waiter(fut)
+            self.timeouts += 1
+            raise self._reject(ticket, seq)
+        except asyncio.CancelledError:
+            self._drop_waiter(fut)
+            raise
+        self.admitted += 1
+
+    def release(self):
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)  # слот переходит следующему, _active не меняется
+                return
+        self._active -= 1
+
+    def status(self, ticket: str) -> Optional[Dict]:
+        """Позиция талона в очереди; None — талон неизвестен или сгорел"""
+        self._expire_tickets()
+        entry = self._tickets.get(ticket)
+        if entry is None:
+            return None
+
+        entry[1] = time.monotonic()
+        position = self._position(ticket)
+        return {"position": position, "ready": position <= self._room()}
+
+    def caches(self) -> Dict[str, object]:
+        return {"checkout.tickets": self._tickets, "checkout.line": self._line, "checkout.waiters": self._waiters}
+
+    def _drop_waiter(self, fut: asyncio.Future):
+        if fut.done() and not fut.cancelled():
+            self.release()  # слот уже передан нам, отдаём дальше
+        else:
+            try:
+                self._waiters.remove(fut)
+            except ValueError:
+                pass
+
+    def _reject(self, ticket: str = None, seq: int = None) -> AdmissionRejected:
+        """Талон в очереди: новый в конец, либо вернувшийся (seq) на прежнее место"""
+        self.rejected += 1
+        if ticket in self._tickets:
+            self._tickets[ticket][1] = time.monotonic()
+        else:
+            ticket = ticket or uuid.uuid4().hex
+            if seq is None:
+                seq = self._next_seq
+                self._next_seq += 1
+            self._put_ticket(ticket, seq)
+        return AdmissionRejected(ticket, self.status(ticket)["position"])
+
+    def _room(self) -> int:
+        """Сколько запросов можно впустить сейчас: свободные слоты и места в ожидании"""
+        return max(0, self.limit - self._active) + max(0, self.max_queue - len(self._waiters))
+
+    def _position(self, ticket: str) -> int:
+        return bisect.bisect_left(self._line, self._tickets[ticket][0]) + 1
+
+    def _put_ticket(self, ticket: str, seq: int):
+        self._tickets[ticket] = [seq, time.monotonic()]
+        if self._line and seq < self._line[-1]:
+            # Вернувшийся талон: порядок словаря восстанавливается (редко — только по таймауту)
+            self._tickets = dict(sorted(self._tickets.items(), key=lambda item: item[1][0]))
+        bisect.insort(self._line, seq)
+
+    def _take_ticket(self, ticket: str) -> int:
+        seq = int(self._tickets.pop(ticket)[0])
+        del self._line[bisect.bisect_left(self._line, seq)]
+        return seq
+
+    def _expire_tickets(self):
+        # Сгоревшие талоны вычищаются, когда доходят до головы очереди
+        deadline = time.monotonic() - self.ticket_ttl
+        while self._tickets:
+            head = next(iter(self._tickets))
+            if self._tickets[head][1] > deadline:
+                break
+            self._take_ticket(head)
+
+
+checkout_admission = AdmissionController()
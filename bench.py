@@ -0,0 +1,191 @@
+"""
+Микробенчмарки функций database.py на синтетических данных (см. datagen.py)
+"""
+
+import json
+import statistics
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import database
+from database import (
+    get_db, get_products, search_products, get_cart, add_to_cart, get_user_orders,
+    get_all_orders, create_order, get_stats
+)
+
+BENCH_ITERATIONS = 50
+BENCH_WARMUP = 3
+BENCH_BASELINE_MARGIN = 1.5      # порог при сохранении baseline: p50 × margin
+BENCH_SORTS = ["popular", "rating", "price_asc", "price_desc", "new"]
+BENCH_SEARCH = "смартфон"
+
+
+class BenchCase:
+    def __init__(self, name: str, run: Callable[[], Awaitable], setup: Callable[[], Awaitable] = None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+
+@asynccontextmanager
+async def _tracing(statements: List[str]):
+    """Подменяет database.get_db: все выполненные SQL (с подставленными параметрами) — в statements"""
+    original = database.get_db
+
+    @asynccontextmanager
+    async def traced_db():
+        async with original() as db:
+            await db.set_trace_callback(statements.append)
+            yield db
+
+    database.get_db = traced_db
+    try:
+        yield
+    finally:
+        database.get_db = original
+
+
+async def explain(statements: List[str]) -> List[Dict]:
+    """EXPLAIN QUERY PLAN для каждого различного запроса"""
+    plans = []
+    seen = set()
+    async with get_db() as db:
+        for sql in statements:
+            text = " ".join(sql.split())
+            if text in seen or not text.upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+                continue
+            seen.add(text)
+            cursor = await db.execute("EXPLAIN QUERY PLAN " + sql)
+            plan = [row[3] for row in await cursor.fetchall()]
+            plans.append({
+                "sql": text,
+                "plan": plan,
+                # SCAN без индекса — полный проход таблицы
+                "full_scan": any(line.startswith("SCAN ") and " INDEX " not in line for line in plan),
+                "temp_sort": any("TEMP B-TREE" in line for line in plan),
+            })
+    return plans
+
+
+async def build_cases(writes: bool = True) -> List[BenchCase]:
+    """Набор случаев с параметрами, подобранными по данным в БД"""
+    async with get_db() as db:
+        cursor = await db.execute("""
+            SELECT category_id FROM products WHERE is_active = 1 AND category_id IS NOT NULL
+            GROUP BY category_id ORDER BY COUNT(*) DESC LIMIT 1
+        """)
+        category_id = (await cursor.fetchone() or [None])[0]
+        cursor = await db.execute("SELECT user_id FROM orders GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+        heavy_user = (await cursor.fetchone() or [None])[0]
+        cursor = await db.execute("SELECT user_id FROM cart_items GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+        cart_user = (await cursor.fetchone() or [None])[0]
+        cursor = await db.execute("SELECT id FROM products WHERE is_active = 1 ORDER BY reviews_count DESC LIMIT 3")
+        popular = [row[0] for row in await cursor.fetchall()]
+        cursor = await db.execute("SELECT id FROM users WHERE is_admin = 0 ORDER BY id LIMIT 1")
+        buyer = (await cursor.fetchone() or [None])[0]
+
+    filters = {
+        "all": {},
+        "category": {"category_id": category_id},
+        "search": {"search": BENCH_SEARCH},
+        "price": {"min_price": 1000, "max_price": 20000},
+        "category+price": {"category_id": category_id, "min_price": 1000, "max_price": 20000},
+    }
+    cases = [
+        BenchCase(f"get_products[{name},{sort}]", lambda kw=kw, sort=sort: get_products(sort=sort, **kw))
+        for name, kw in filters.items() for sort in BENCH_SORTS
+    ]
+    cases += [
+        BenchCase("get_products[all,popular,page 20]", lambda: get_products(offset=20 * 50)),
+        BenchCase("search_products", lambda: search_products(BENCH_SEARCH)),
+        BenchCase("get_cart", lambda: get_cart(cart_user)),
+        BenchCase("get_user_orders", lambda: get_user_orders(heavy_user)),
+        BenchCase("get_all_orders", lambda: get_all_orders()),
+        BenchCase("get_all_orders[pending]", lambda: get_all_orders("pending")),
+        BenchCase("get_stats", get_stats),
+    ]
+
+    if writes and buyer and popular:
+        async def fill_cart():
+            for product_id in popular:
+                await add_to_cart(buyer, product_id, 1)
+
+        # Пишет заказы в БД: запускайте на отдельной БД для бенчмарков
+        cases.append(BenchCase(
+            "create_order",
+            lambda: create_order(buyer, "Бенчмарк", "bench@loadtest.local", "+7 900 000-00-00", "г. Москва"),
+            setup=fill_cart,
+        ))
+    return cases
+
+
+async def run_case(case: BenchCase, iterations: int = BENCH_ITERATIONS) -> Dict:
+    timings = []
+    statements: List[str] = []
+    for i in range(BENCH_WARMUP + iterations):
+        if case.setup:
+            await case.setup()
+        if i == 0:
+            async with _tracing(statements):
+                await case.run()
+            continue
+        started = time.perf_counter()
+        await case.run()
+        if i >= BENCH_WARMUP:
+            timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    ms = lambda s: round(s * 1000, 3)
+    return {
+        "iterations": len(timings),
+        "queries": len(statements),
+        "min_ms": ms(timings[0]),
+        "p50_ms": ms(statistics.median(timings)),
+        "p95_ms": ms(timings[min(len(timings) - 1, int(len(timings) * 0.95))]),
+        "mean_ms": ms(statistics.fmean(timings)),
+        "plans": await explain(statements),
+    }
+
+
+async def dataset_size() -> Dict[str, int]:
+    sizes = {}
+    async with get_db() as db:
+        for table in ("products", "users", "orders", "order_items", "cart_items", "reviews"):
+            cursor = await db.execute(f"SELECT COUNT(*) FROM {table}")
+            sizes[table] = (await cursor.fetchone())[0]
+    return sizes
+
+
+async def run_benchmarks(iterations: int = BENCH_ITERATIONS, only: str = None,
+                         writes: bool = True, progress: Optional[Callable[[str, Dict], None]] = None) -> Dict:
+    results = {}
+    for case in await build_cases(writes):
+        if only and only not in case.name:
+            continue
+        results[case.name] = await run_case(case, iterations)
+        if progress:
+            progress(case.name, results[case.name])
+    return {"dataset": await dataset_size(), "results": results}
+
+
+def check_baseline(report: Dict, baseline: Dict) -> List[str]:
+    """Случаи, у которых p50 выше порога из baseline"""
+    failures = []
+    for name, threshold in baseline.get("thresholds", {}).items():
+        result = report["results"].get(name)
+        if result and result["p50_ms"] > threshold:
+            failures.append(f"{name}: p50 {result['p50_ms']} мс > порога {threshold} мс")
+    return failures
+
+
+def make_baseline(report: Dict, margin: float = BENCH_BASELINE_MARGIN) -> Dict:
+    return {
+        "dataset": report["dataset"],
+        "thresholds": {name: round(r["p50_ms"] * margin, 3) for name, r in report["results"].items()},
+    }
+
+
+def load_baseline(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
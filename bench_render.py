@@ -0,0 +1,168 @@
+"""
+Микробенчмарки построения HTML-страниц на фиктивных данных, без БД
+"""
+
+import gc
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import main
+
+RENDER_SIZES = (0, 10, 50, 500)
+RENDER_ROUNDS = 7
+RENDER_MIN_ROUND_SECONDS = 0.05  # один раунд — столько повторов, чтобы занять хотя бы столько времени
+
+STATUSES = ['pending', 'processing', 'shipped', 'delivered', 'cancelled']
+
+
+def make_products(n: int, seed: int = 1) -> List[Dict]:
+    rng = random.Random(seed)
+    products = []
+    for i in range(1, n + 1):
+        price = round(rng.uniform(200, 200_000), -1)
+        products.append({
+            "id": i, "name": f"Товар номер {i} с достаточно длинным названием", "slug": f"product-{i}",
+            "description": "Описание товара. " * 20, "price": price,
+            "old_price": round(price * 1.25, -1) if i % 4 == 0 else None,
+            "category_id": i % 10 + 1, "category_name": f"Категория {i % 10 + 1}", "image": "📦",
+            "stock": rng.randint(0, 100), "rating": round(rng.uniform(1, 5), 1), "reviews_count": rng.randint(0, 500),
+            "is_featured": int(i % 10 == 0), "is_active": 1,
+        })
+    return products
+
+
+def make_categories(n: int = 10) -> List[Dict]:
+    return [{"id": i, "name": f"Категория {i}", "slug": f"category-{i}", "icon": "📦", "products_count": 100 * i}
+            for i in range(1, n + 1)]
+
+
+def make_cart(n: int) -> List[Dict]:
+    return [{"product_id": p["id"], "name": p["name"], "price": p["price"], "old_price": p["old_price"],
+             "image": p["image"], "slug": p["slug"], "stock": p["stock"], "quantity": p["id"] % 3 + 1,
+             "rating": p["rating"]}
+            for p in make_products(n)]
+
+
+def make_orders(n: int, items_per_order: int = 4) -> List[Dict]:
+    orders = []
+    for i in range(1, n + 1):
+        orders.append({
+            "id": i, "user_id": i % 50 + 1, "status": STATUSES[i % len(STATUSES)], "total": 1000.0 * i,
+            "name": "Иван Петров", "email": f"user{i}@example.com", "user_name": "Иван Петров",
+            "user_email": f"user{i}@example.com", "created_at": "2026-01-15 12:30:00",
+            "items": [{"product_id": j, "name": f"Товар {j}", "image": "📦", "quantity": 1, "price": 1000.0}
+                      for j in range(items_per_order)],
+        })
+    return orders
+
+
+def make_users(n: int) -> List[Dict]:
+    return [{"id": i, "name": f"Пользователь {i}", "email": f"user{i}@example.com", "phone": "+7 900 000-00-00",
+             "is_admin": int(i == 1), "created_at": "2026-01-15 12:30:00"}
+            for i in range(1, n + 1)]
+
+
+def make_stats() -> Dict:
+    return {"total_orders": 123456, "total_revenue": 98765432.0, "total_users": 5000, "total_products": 20000,
+            "low_stock": 42, "orders_by_status": {s: 1000 for s in STATUSES}}
+
+
+def make_revenue_days(n: int) -> List[Dict]:
+    return [{"period": f"2026-01-{i % 28 + 1:02d}", "orders": i, "revenue": 1000.0 * i, "by_status": {}}
+            for i in range(n)]
+
+
+def build_cases(sizes=RENDER_SIZES) -> Dict[str, Callable[[], str]]:
+    """Имя случая -> функция без аргументов, строящая HTML"""
+    user = {"id": 1, "name": "Иван Петров", "is_admin": 0}
+    categories = make_categories()
+    product = make_products(1)[0]
+    stats = make_stats()
+    revenue_days = make_revenue_days(90)
+    page = lambda items: {"items": items, "next_cursor": "eyJ2IjogMX0" if items else None}
+
+    cases: Dict[str, Callable[[], str]] = {
+        "base_template": lambda: main.base_template("", "Главная", None, user, 3, 2),
+        "render_product": lambda: main.render_product(product, categories[0], False),
+        "render_admin_dashboard": lambda: main.render_admin_dashboard(stats, revenue_days),
+    }
+    for n in sizes:
+        products = make_products(n)
+        favorites = {p["id"] for p in products[::3]}
+        cart = make_cart(n)
+        orders = make_orders(n)
+        cases.update({
+            f"product_card[{n}]": lambda products=products, favorites=favorites:
+                "".join(main.product_card(p, favorites) for p in products),
+            f"render_home[{n}]": lambda products=products, favorites=favorites:
+                main.render_home(categories, products, favorites),
+            f"render_catalog[{n}]": lambda products=products, favorites=favorites:
+                main.render_catalog(categories, products, favorites, categories[0], 1, "price_asc", 100, 5000),
+            f"render_cart[{n}]": lambda cart=cart: main.render_cart(cart),
+            f"render_favorites[{n}]": lambda cart=cart: main.render_favorites(cart),
+            f"render_orders[{n}]": lambda orders=orders: main.render_orders(orders),
+            f"render_admin_orders[{n}]": lambda orders=orders: main.render_admin_orders(page(orders)),
+            f"render_admin_products[{n}]": lambda products=products: main.render_admin_products(page(products), categories),
+            f"render_admin_users[{n}]": lambda users=make_users(n): main.render_admin_users(page(users)),
+            f"full_page[catalog,{n}]": lambda products=products, favorites=favorites: main.base_template(
+                main.render_catalog(categories, products, favorites), "Каталог", None, user, 3, 2),
+        })
+    return cases
+
+
+def measure(render: Callable[[], str], rounds: int = RENDER_ROUNDS) -> Dict:
+    """Время на один рендер (медиана по раундам) и пик выделенной памяти за рендер"""
+    render()  # прогрев
+
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            render()
+        if time.perf_counter() - started >= RENDER_MIN_ROUND_SECONDS or loops >= 1_000_000:
+            break
+        loops *= 2
+
+    per_render = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for _ in range(loops):
+                render()
+            per_render.append((time.perf_counter() - started) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        html = render()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "us_per_render": round(statistics.median(per_render) * 1e6, 2),
+        "us_min": round(min(per_render) * 1e6, 2),
+        "peak_bytes": peak,
+        "html_bytes": len(html.encode("utf-8")),
+    }
+
+
+def run_render_benchmarks(only: str = None, rounds: int = RENDER_ROUNDS,
+                          progress: Optional[Callable[[str, Dict], None]] = None) -> Dict:
+    results = {}
+    for name, render in build_cases().items():
+        if only and only not in name:
+            continue
+        results[name] = measure(render, rounds)
+        if progress:
+            progress(name, results[name])
+    return {"results": results}
@@ -0,0 +1,121 @@
+"""
+Запись выборки реальных запросов в JSONL для последующего воспроизведения (см. replay.py)
+"""
+
+import json
+import os
+import random
+import time
+from typing import Dict, List
+from urllib.parse import parse_qsl
+
+from accesslog import JsonLogWriter
+from metrics import route_template
+
+CAPTURE_PATH = os.environ.get("CAPTURE_PATH", "")                     # пусто — запись выключена
+CAPTURE_SAMPLE_RATE = float(os.environ.get("CAPTURE_SAMPLE_RATE", "0.01"))
+CAPTURE_MAX_BODY = 64 * 1024     # тела больше не сохраняются, запрос помечается body_skipped
+
+# Значения этих полей формы/JSON заменяются на REDACTED
+REDACT_FIELDS = {"password", "password_confirm", "new_password", "old_password", "token", "secret",
+                 "card_number", "cvv", "csrf_token"}
+REDACTED = "***"
+
+
+def redact(value):
+    """Копия значения JSON с заменёнными секретами (по имени ключа, на любой глубине)"""
+    if isinstance(value, dict):
+        return {k: REDACTED if k.lower() in REDACT_FIELDS else redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    return value
+
+
+def redact_pairs(pairs: List[List[str]]) -> List[List[str]]:
+    return [[k, REDACTED if k.lower() in REDACT_FIELDS else v] for k, v in pairs]
+
+
+def parse_body(content_type: str, body: bytes) -> Dict:
+    """Поля записи для тела запроса: form (пары ключ-значение), json или body_skipped"""
+    if not body:
+        return {}
+    if len(body) > CAPTURE_MAX_BODY:
+        return {"body_skipped": "too_large"}
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        pairs = parse_qsl(body.decode("utf-8", "replace"), keep_blank_values=True)
+        return {"form": redact_pairs([[k, v] for k, v in pairs])}
+    if content_type.startswith("application/json"):
+        try:
+            return {"json": redact(json.loads(body))}
+        except ValueError:
+            return {"body_skipped": "invalid_json"}
+    # multipart (загрузка файлов) и прочее не воспроизводим
+    return {"body_skipped": content_type.split(";")[0] or "unknown"}
+
+
+class TrafficCaptureMiddleware:
+    """
+    ASGI-middleware: с вероятностью sample_rate записывает запрос в JSONL.
+
+    Запись: время прихода, метод, путь, шаблон маршрута, query, тело
+    (форма или JSON, секреты вырезаны), id пользователя из сессии, статус
+    ответа и длительность. Сама сессия не сохраняется: replay собирает
+    сессию с этим user_id и подписывает её сам. Должна стоять внутри
+    SessionMiddleware, чтобы видеть расшифрованную сессию. Файл пишет
+    поток JsonLogWriter — запрос только кладёт запись в буфер.
+    """
+
+    def __init__(self, app, log: JsonLogWriter = None, sample_rate: float = CAPTURE_SAMPLE_RATE):
+        self.app = app
+        self.log = log or traffic_log
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        ts = time.time()
+        started = time.perf_counter()
+        user_id = (scope.get("session") or {}).get("user_id")
+        chunks: List[bytes] = []
+        size = 0
+        status = None
+
+        async def receive_wrapper():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request" and size <= CAPTURE_MAX_BODY:
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size <= CAPTURE_MAX_BODY:
+                    chunks.append(chunk)
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+            body = parse_body(headers.get("content-type", ""), b"".join(chunks))
+            if size > CAPTURE_MAX_BODY:
+                body = {"body_skipped": "too_large"}
+            self.log.write({
+                "ts": round(ts, 6),
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route_template(scope),
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                **body,
+                "user_id": user_id,
+                "status": status or 500,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+traffic_log = JsonLogWriter(CAPTURE_PATH, name="traffic-capture")
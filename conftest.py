@@ -0,0 +1,57 @@
+"""
+Фикстуры тестов: приложение на временной БД с тестовыми данными и вход под покупателем или админом
+"""
+
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+pytest_plugins = ["nplusone"]
+
+USER = ("user@test.com", "123456")
+ADMIN = ("admin@shop.com", "admin123")
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    """Один клиент на все тесты: приложение и его фоновые задачи стартуют один раз"""
+    workdir = tmp_path_factory.mktemp("shop")
+    cwd = os.getcwd()
+    os.chdir(workdir)  # файлы, которые пишет приложение, — во временном каталоге
+
+    import database
+    database.DATABASE_PATH = str(workdir / "shop.db")
+    import main
+
+    try:
+        with TestClient(main.app) as test_client:
+            yield test_client
+    finally:
+        os.chdir(cwd)
+
+
+def login(client: TestClient, credentials: tuple) -> TestClient:
+    client.get("/logout")
+    email, password = credentials
+    response = client.post("/login", data={"email": email, "password": password}, follow_redirects=False)
+    assert response.status_code == 302, f"Вход {email}: {response.status_code}"
+    return client
+
+
+@pytest.fixture
+def guest_client(client):
+    client.get("/logout")
+    return client
+
+
+@pytest.fixture
+def user_client(client):
+    yield login(client, USER)
+    client.get("/logout")
+
+
+@pytest.fixture
+def admin_client(client):
+    yield login(client, ADMIN)
+    client.get("/logout")
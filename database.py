@@ -3,26 +3,62 @@
 """
 
 import aiosqlite
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+import base64
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable
 from contextlib import asynccontextmanager
 
+from querystats import query_stats, caller_name, InstrumentedConnection
+from tracing import tracer
+
 DATABASE_PATH = "shop.db"
 
+# Режим журнала хранится в файле БД — ставится один раз в init_database; пусто — не менять
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "")
+
+# PRAGMA уровня соединения (launcher.py задаёт их воркерам через set_pragmas); пусто — настройки SQLite по умолчанию
+SQLITE_PRAGMAS: Dict[str, Any] = {}
+_pragma_script = ""              # SQLITE_PRAGMAS одной строкой — собирается в set_pragmas, а не на каждое соединение
+
+
+def set_pragmas(pragmas: Dict[str, Any]):
+    global _pragma_script
+    SQLITE_PRAGMAS.update(pragmas)
+    _pragma_script = "".join(f"PRAGMA {k} = {v};" for k, v in SQLITE_PRAGMAS.items())
+
 
 @asynccontextmanager
 async def get_db():
-    db = await aiosqlite.connect(DATABASE_PATH)
-    db.row_factory = aiosqlite.Row
-    try:
-        yield db
-    finally:
-        await db.close()
+    """
+    Соединение с БД; запросы через него учитываются в query_stats под именем
+    вызывающей функции, в трассе — спаном этой функции
+    """
+    function = caller_name(sys._getframe(1))
+    with tracer.span(function or "get_db", attributes={"db.system": "sqlite"}):
+        started = time.perf_counter()
+        connection = await aiosqlite.connect(DATABASE_PATH)
+        connection.row_factory = aiosqlite.Row
+        if _pragma_script:
+            await connection.executescript(_pragma_script)
+        query_stats.connection_opened(time.perf_counter() - started)
+        try:
+            yield InstrumentedConnection(connection, query_stats, function)
+        finally:
+            started = time.perf_counter()
+            await connection.close()
+            query_stats.connection_closed(time.perf_counter() - started)
 
 
 async def init_database():
     """Инициализация БД и добавление тестовых данных"""
     async with get_db() as db:
+        if SQLITE_JOURNAL_MODE:
+            await db.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+
         # Пользователи
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -141,6 +177,84 @@ async def init_database():
             )
         """)
 
+        # Индексы для админ-списков с постраничным выводом и выборок по пользователю
+        for sql in ADMIN_LIST_INDEXES:
+            await db.execute(sql)
+
+        # Журнал складских списаний (см. inventory.py): пишется в транзакции заказа, удаляется при сбросе
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS inventory_journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                deltas TEXT NOT NULL
+            )
+        """)
+
+        # Фоновые задачи (см. jobs.py)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 5,
+                run_at REAL NOT NULL,
+                leased_until REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                finished_at REAL
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs(status, run_at)")
+
+        # Исходящие уведомления (см. notifications.py)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                payload TEXT NOT NULL DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                claimed_until REAL,
+                next_attempt_at REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP
+            )
+        """)
+        cursor = await db.execute("SELECT 1 FROM pragma_table_info('outbox') WHERE name = 'next_attempt_at'")
+        if not await cursor.fetchone():
+            await db.execute("ALTER TABLE outbox ADD COLUMN next_attempt_at REAL")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, id)")
+
+        # Счётчики для админ-панели, поддерживаются триггерами
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value REAL NOT NULL DEFAULT 0
+            )
+        """)
+
+        # Почасовые и суточные итоги по заказам (время в UTC, как created_at)
+        for table in ("order_rollups_hourly", "order_rollups_daily"):
+            await db.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    orders INTEGER NOT NULL DEFAULT 0,
+                    revenue REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (bucket, status)
+                ) WITHOUT ROWID
+            """)
+
+        await create_stats_triggers(db)
+
+        cursor = await db.execute("SELECT COUNT(*) FROM stats_counters")
+        if (await cursor.fetchone())[0] == 0:
+            await rebuild_stats_counters(db)
+            await rebuild_order_rollups(db)
+
         await db.commit()
 
         # Добавляем тестовые данные если БД пустая
@@ -271,12 +385,6 @@ async def update_user(user_id: int, **kwargs):
         await db.commit()
 
 
-async def get_all_users() -> List[Dict]:
-    async with get_db() as db:
-        cursor = await db.execute("SELECT * FROM users ORDER BY created_at DESC")
-        return [dict(row) for row in await cursor.fetchall()]
-
-
 # ═══════════════════════════════════════════════════════════════
 # КАТЕГОРИИ
 # ═══════════════════════════════════════════════════════════════
@@ -362,17 +470,6 @@ async def get_products(
         return [dict(row) for row in await cursor.fetchall()]
 
 
-async def get_all_products_admin() -> List[Dict]:
-    async with get_db() as db:
-        cursor = await db.execute("""
-            SELECT p.*, c.name as category_name
-            FROM products p
-            LEFT JOIN categories c ON p.category_id = c.id
-            ORDER BY p.created_at DESC
-        """)
-        return [dict(row) for row in await cursor.fetchall()]
-
-
 async def get_product_by_slug(slug: str) -> Optional[Dict]:
     async with get_db() as db:
         cursor = await db.execute("""
@@ -559,7 +656,13 @@ async def toggle_favorite(user_id: int, product_id: int) -> bool:
 # ЗАКАЗЫ
 # ═══════════════════════════════════════════════════════════════
 
-async def create_order(user_id: int, name: str, email: str, phone: str, address: str, comment: str = None) -> int:
+async def create_order(user_id: int, name: str, email: str, phone: str, address: str, comment: str = None,
+                       update_stock: bool = True,
+                       before_commit: Callable[[aiosqlite.Connection], Awaitable[Any]] = None) -> int:
+    """
+    update_stock=False — остаток списывает складской сервис (inventory.py).
+    before_commit(db) выполняется в транзакции заказа (например, постановка фоновой задачи)
+    """
     async with get_db() as db:
         # Получаем корзину
         cart = await get_cart(user_id)
@@ -576,47 +679,66 @@ async def create_order(user_id: int, name: str, email: str, phone: str, address:
         """, (user_id, total, name, email, phone, address, comment))
         order_id = cursor.lastrowid
 
-        # Добавляем товары
-        for item in cart:
-            await db.execute("""
-                INSERT INTO order_items (order_id, product_id, quantity, price)
-                VALUES (?, ?, ?, ?)
-            """, (order_id, item['product_id'], item['quantity'], item['price']))
+        # Добавляем товары — одним executemany на корзину, а не запросом на позицию
+        await db.executemany("""
+            INSERT INTO order_items (order_id, product_id, quantity, price)
+            VALUES (?, ?, ?, ?)
+        """, [(order_id, item['product_id'], item['quantity'], item['price']) for item in cart])
 
-            # Уменьшаем остаток
-            await db.execute(
+        # Уменьшаем остаток
+        if update_stock:
+            await db.executemany(
                 "UPDATE products SET stock = stock - ? WHERE id = ?",
-                (item['quantity'], item['product_id'])
+                [(item['quantity'], item['product_id']) for item in cart]
             )
 
         # Очищаем корзину
         await db.execute("DELETE FROM cart_items WHERE user_id = ?", (user_id,))
 
+        # Письмо о заказе уходит только вместе с заказом
+        await add_outbox_message(db, "order_created", email, {
+            "order_id": order_id, "name": name, "total": total, "items_count": len(cart)
+        })
+
+        if before_commit is not None:
+            await before_commit(db)
+
         await db.commit()
         return order_id
 
 
+ORDER_ITEMS_BATCH_SIZE = 500
+
+
+async def _attach_order_items(db, orders: List[Dict]):
+    """Позиции всех заказов — одним запросом на пачку заказов, а не запросом на каждый"""
+    by_id = {}
+    for order in orders:
+        order['items'] = []
+        by_id[order['id']] = order
+
+    ids = list(by_id)
+    for i in range(0, len(ids), ORDER_ITEMS_BATCH_SIZE):
+        chunk = ids[i:i + ORDER_ITEMS_BATCH_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        cursor = await db.execute(f"""
+            SELECT oi.*, p.name, p.image, p.slug
+            FROM order_items oi
+            JOIN products p ON oi.product_id = p.id
+            WHERE oi.order_id IN ({placeholders})
+            ORDER BY oi.id
+        """, chunk)
+        for item in await cursor.fetchall():
+            by_id[item['order_id']]['items'].append(dict(item))
+
+
 async def get_user_orders(user_id: int) -> List[Dict]:
     async with get_db() as db:
         cursor = await db.execute("""
             SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC
         """, (user_id,))
-
-        orders = []
-        for row in await cursor.fetchall():
-            order = dict(row)
-
-            # Получаем товары заказа
-            items_cursor = await db.execute("""
-                SELECT oi.*, p.name, p.image, p.slug
-                FROM order_items oi
-                JOIN products p ON oi.product_id = p.id
-                WHERE oi.order_id = ?
-            """, (order['id'],))
-            order['items'] = [dict(item) for item in await items_cursor.fetchall()]
-
-            orders.append(order)
-
+        orders = [dict(row) for row in await cursor.fetchall()]
+        await _attach_order_items(db, orders)
         return orders
 
 
@@ -660,30 +782,40 @@ async def get_all_orders(status: str = None, limit: int = 50) -> List[Dict]:
         params.append(limit)
 
         cursor = await db.execute(sql, params)
-        orders = []
-        for row in await cursor.fetchall():
-            order = dict(row)
-            # Получаем товары заказа
-            items_cursor = await db.execute("""
-                SELECT oi.*, p.name, p.image
-                FROM order_items oi
-                JOIN products p ON oi.product_id = p.id
-                WHERE oi.order_id = ?
-            """, (order['id'],))
-            order['items'] = [dict(item) for item in await items_cursor.fetchall()]
-            orders.append(order)
+        orders = [dict(row) for row in await cursor.fetchall()]
+        await _attach_order_items(db, orders)
         return orders
 
 
 async def update_order_status(order_id: int, status: str):
     async with get_db() as db:
+        cursor = await db.execute("SELECT status, email, name FROM orders WHERE id = ?", (order_id,))
+        order = await cursor.fetchone()
+        if not order or order['status'] == status:
+            return
+
         await db.execute(
             "UPDATE orders SET status = ? WHERE id = ?",
             (status, order_id)
         )
+        await add_outbox_message(db, "order_status", order['email'], {
+            "order_id": order_id, "name": order['name'], "status": status
+        })
         await db.commit()
 
 
+# ═══════════════════════════════════════════════════════════════
+# УВЕДОМЛЕНИЯ
+# ═══════════════════════════════════════════════════════════════
+
+async def add_outbox_message(db, kind: str, recipient: str, payload: Dict):
+    """Добавляет письмо в outbox в рамках транзакции вызывающего (без commit)"""
+    await db.execute(
+        "INSERT INTO outbox (kind, recipient, payload) VALUES (?, ?, ?)",
+        (kind, recipient, json.dumps(payload, ensure_ascii=False))
+    )
+
+
 # ═══════════════════════════════════════════════════════════════
 # АДМИН - ТОВАРЫ
 # ═══════════════════════════════════════════════════════════════
@@ -702,6 +834,21 @@ async def create_product(data: Dict) -> int:
         return cursor.lastrowid
 
 
+PRODUCT_UPSERT_COLUMNS = ["name", "slug", "description", "price", "old_price", "category_id",
+                          "image", "stock", "is_featured", "is_active"]
+
+
+async def upsert_products(db, rows: List[tuple]):
+    """Вставка или обновление по slug; значения в порядке PRODUCT_UPSERT_COLUMNS (без commit)"""
+    columns = ", ".join(PRODUCT_UPSERT_COLUMNS)
+    placeholders = ", ".join("?" * len(PRODUCT_UPSERT_COLUMNS))
+    updates = ", ".join(f"{c} = excluded.{c}" for c in PRODUCT_UPSERT_COLUMNS if c != "slug")
+    await db.executemany(f"""
+        INSERT INTO products ({columns}) VALUES ({placeholders})
+        ON CONFLICT(slug) DO UPDATE SET {updates}
+    """, rows)
+
+
 async def update_product(product_id: int, data: Dict):
     async with get_db() as db:
         fields = ', '.join([f"{k} = ?" for k in data.keys()])
@@ -710,6 +857,80 @@ async def update_product(product_id: int, data: Dict):
         await db.commit()
 
 
+BULK_UPDATE_CHUNK_SIZE = 5000
+
+
+async def bulk_update_products(updates: List[Dict]) -> Dict:
+    """
+    Массовое обновление цен и остатков. Каждая запись — id или slug и любые
+    из полей price, old_price, stock; отсутствующие поля не меняются,
+    old_price: null сбрасывает старую цену. Все записи применяются одной
+    транзакцией через временную таблицу и один UPDATE ... FROM.
+    Для повторяющегося товара действует последняя запись.
+    Возвращает {"updated": [id, ...], "not_found": [id или slug, ...]}
+    """
+    rows = [
+        (u.get('id'), u.get('slug'), u.get('price'), u.get('old_price'),
+         1 if 'old_price' in u else 0, u.get('stock'))
+        for u in updates
+    ]
+
+    async with get_db() as db:
+        await db.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS product_updates (
+                id INTEGER,
+                slug TEXT,
+                price REAL,
+                old_price REAL,
+                set_old_price INTEGER,
+                stock INTEGER
+            )
+        """)
+        await db.execute("DELETE FROM product_updates")
+        try:
+            for i in range(0, len(rows), BULK_UPDATE_CHUNK_SIZE):
+                await db.executemany(
+                    "INSERT INTO product_updates VALUES (?, ?, ?, ?, ?, ?)",
+                    rows[i:i + BULK_UPDATE_CHUNK_SIZE]
+                )
+
+            await db.execute("""
+                UPDATE product_updates
+                SET id = (SELECT p.id FROM products p WHERE p.slug = product_updates.slug)
+                WHERE id IS NULL
+            """)
+            await db.execute("""
+                DELETE FROM product_updates
+                WHERE id IS NOT NULL
+                  AND rowid NOT IN (SELECT MAX(rowid) FROM product_updates GROUP BY id)
+            """)
+
+            cursor = await db.execute("""
+                UPDATE products
+                SET price = COALESCE(u.price, products.price),
+                    old_price = CASE WHEN u.set_old_price THEN u.old_price ELSE products.old_price END,
+                    stock = COALESCE(u.stock, products.stock)
+                FROM product_updates u
+                WHERE products.id = u.id
+                RETURNING products.id
+            """)
+            updated = [row[0] for row in await cursor.fetchall()]
+
+            cursor = await db.execute("""
+                SELECT COALESCE(u.slug, u.id) FROM product_updates u
+                WHERE u.id IS NULL OR NOT EXISTS (SELECT 1 FROM products p WHERE p.id = u.id)
+            """)
+            not_found = [row[0] for row in await cursor.fetchall()]
+
+            await db.execute("DELETE FROM product_updates")
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+
+    return {"updated": updated, "not_found": not_found}
+
+
 async def delete_product(product_id: int):
     async with get_db() as db:
         await db.execute("DELETE FROM products WHERE id = ?", (product_id,))
@@ -717,36 +938,430 @@ async def delete_product(product_id: int):
 
 
 # ═══════════════════════════════════════════════════════════════
-# СТАТИСТИКА
+# АДМИН - СПИСКИ С ПАГИНАЦИЕЙ
 # ═══════════════════════════════════════════════════════════════
 
-async def get_stats() -> Dict:
-    """Статистика для админ-панели"""
+ADMIN_PAGE_SIZES = (25, 50, 100, 200)
+
+ADMIN_LIST_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_total ON orders(total, id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_products_created ON products(created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_products_category_created ON products(category_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_products_price ON products(price, id)",
+    "CREATE INDEX IF NOT EXISTS idx_products_stock ON products(stock, id)",
+    "CREATE INDEX IF NOT EXISTS idx_products_name ON products(name, id)",
+    "CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_users_name ON users(name, id)",
+]
+
+# Сортировки: ключ -> (колонка, поле строки, по убыванию)
+ORDER_SORTS = {
+    "new": ("o.created_at", "created_at", True),
+    "old": ("o.created_at", "created_at", False),
+    "total_desc": ("o.total", "total", True),
+    "total_asc": ("o.total", "total", False),
+}
+
+PRODUCT_SORTS = {
+    "new": ("p.created_at", "created_at", True),
+    "price_asc": ("p.price", "price", False),
+    "price_desc": ("p.price", "price", True),
+    "stock_asc": ("p.stock", "stock", False),
+    "name": ("p.name", "name", False),
+}
+
+USER_SORTS = {
+    "new": ("u.created_at", "created_at", True),
+    "old": ("u.created_at", "created_at", False),
+    "name": ("u.name", "name", False),
+}
+
+
+def encode_cursor(value, row_id: int) -> str:
+    raw = json.dumps([value, row_id], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """ValueError — курсор испорчен или не той формы"""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    decoded = json.loads(raw)
+    if not isinstance(decoded, list) or len(decoded) != 2 \
+            or not all(v is None or isinstance(v, (str, int, float)) for v in decoded):
+        raise ValueError(f"Неверный курсор: {cursor}")
+    value, row_id = decoded
+    return value, row_id
+
+
+async def _keyset_page(select_sql: str, id_column: str, where: List[str], params: List,
+                       sort: tuple, cursor: str = None, limit: int = 50) -> Dict:
+    """
+    Страница выборки по ключу (колонка сортировки, id): следующая страница
+    начинается строго после последней строки предыдущей, без OFFSET.
+    """
+    column, key, descending = sort
+    direction = "DESC" if descending else "ASC"
+
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError):
+        after = None  # испорченный курсор — с первой страницы
+
+    if after:
+        where = where + [f"({column}, {id_column}) {'<' if descending else '>'} (?, ?)"]
+        params = params + list(after)
+
+    sql = select_sql
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {column} {direction}, {id_column} {direction} LIMIT ?"
+
     async with get_db() as db:
-        stats = {}
+        result = await db.execute(sql, params + [limit + 1])
+        rows = [dict(row) for row in await result.fetchall()]
+
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(items[-1][key], items[-1]['id'])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def get_orders_page(status: str = None, date_from: str = None, date_to: str = None,
+                          sort: str = "new", cursor: str = None, limit: int = 50) -> Dict:
+    """Заказы для админ-панели; date_from/date_to — даты YYYY-MM-DD включительно"""
+    where, params = [], []
+    if status:
+        where.append("o.status = ?")
+        params.append(status)
+    if date_from:
+        where.append("o.created_at >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("o.created_at < date(?, '+1 day')")
+        params.append(date_to)
+
+    return await _keyset_page("""
+        SELECT o.*, u.name as user_name, u.email as user_email
+        FROM orders o
+        JOIN users u ON o.user_id = u.id
+    """, "o.id", where, params, ORDER_SORTS.get(sort, ORDER_SORTS["new"]), cursor, limit)
+
+
+async def get_products_page(category_id: int = None, low_stock: bool = False, search: str = None,
+                            sort: str = "new", cursor: str = None, limit: int = 50) -> Dict:
+    where, params = [], []
+    if category_id:
+        where.append("p.category_id = ?")
+        params.append(category_id)
+    if low_stock:
+        where.append(f"p.stock < {LOW_STOCK_THRESHOLD} AND p.is_active = 1")
+    if search:
+        where.append("(p.name LIKE ? OR p.slug LIKE ?)")
+        params.extend([f"%{search}%", f"%{search}%"])
+
+    return await _keyset_page("""
+        SELECT p.*, c.name as category_name
+        FROM products p
+        LEFT JOIN categories c ON p.category_id = c.id
+    """, "p.id", where, params, PRODUCT_SORTS.get(sort, PRODUCT_SORTS["new"]), cursor, limit)
+
+
+async def get_users_page(registered_from: str = None, registered_to: str = None, search: str = None,
+                         sort: str = "new", cursor: str = None, limit: int = 50) -> Dict:
+    where, params = [], []
+    if registered_from:
+        where.append("u.created_at >= ?")
+        params.append(registered_from)
+    if registered_to:
+        where.append("u.created_at < date(?, '+1 day')")
+        params.append(registered_to)
+    if search:
+        where.append("(u.name LIKE ? OR u.email LIKE ?)")
+        params.extend([f"%{search}%", f"%{search}%"])
+
+    return await _keyset_page(
+        "SELECT u.* FROM users u", "u.id", where, params,
+        USER_SORTS.get(sort, USER_SORTS["new"]), cursor, limit
+    )
 
-        # Общее количество заказов и сумма
-        cursor = await db.execute("SELECT COUNT(*), COALESCE(SUM(total), 0) FROM orders")
-        row = await cursor.fetchone()
-        stats['total_orders'] = row[0]
-        stats['total_revenue'] = row[1]
 
-        # Заказы по статусам
-        cursor = await db.execute("""
-            SELECT status, COUNT(*) as cnt FROM orders GROUP BY status
+# ═══════════════════════════════════════════════════════════════
+# ВЫГРУЗКИ
+# ═══════════════════════════════════════════════════════════════
+
+EXPORT_CHUNK_SIZE = 500
+
+ORDER_EXPORT_COLUMNS = ["id", "created_at", "status", "total", "user_id", "name", "email", "phone",
+                        "address", "comment", "items_count"]
+PRODUCT_EXPORT_COLUMNS = ["id", "slug", "name", "category_slug", "price", "old_price", "stock",
+                          "rating", "reviews_count", "is_featured", "is_active", "created_at"]
+
+
+async def _iter_rows(sql: str, params: List) -> AsyncIterator[tuple]:
+    """Строки выборки порциями по EXPORT_CHUNK_SIZE, не держа весь результат в памяти"""
+    async with get_db() as db:
+        db.row_factory = None
+        cursor = await db.execute(sql, params)
+        cursor.iter_chunk_size = EXPORT_CHUNK_SIZE
+        async for row in cursor:
+            yield row
+
+
+def iter_orders_export(status: str = None, date_from: str = None, date_to: str = None) -> AsyncIterator[tuple]:
+    """Заказы в порядке id; значения в порядке ORDER_EXPORT_COLUMNS"""
+    where, params = [], []
+    if status:
+        where.append("o.status = ?")
+        params.append(status)
+    if date_from:
+        where.append("o.created_at >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("o.created_at < date(?, '+1 day')")
+        params.append(date_to)
+
+    sql = """
+        SELECT o.id, o.created_at, o.status, o.total, o.user_id, o.name, o.email, o.phone,
+               o.address, o.comment,
+               (SELECT COALESCE(SUM(quantity), 0) FROM order_items oi WHERE oi.order_id = o.id)
+        FROM orders o
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY o.id"
+    return _iter_rows(sql, params)
+
+
+def iter_products_export(category_id: int = None, low_stock: bool = False) -> AsyncIterator[tuple]:
+    """Товары в порядке id; значения в порядке PRODUCT_EXPORT_COLUMNS"""
+    where, params = [], []
+    if category_id:
+        where.append("p.category_id = ?")
+        params.append(category_id)
+    if low_stock:
+        where.append(f"p.stock < {LOW_STOCK_THRESHOLD} AND p.is_active = 1")
+
+    sql = """
+        SELECT p.id, p.slug, p.name, c.slug, p.price, p.old_price, p.stock,
+               p.rating, p.reviews_count, p.is_featured, p.is_active, p.created_at
+        FROM products p
+        LEFT JOIN categories c ON p.category_id = c.id
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY p.id"
+    return _iter_rows(sql, params)
+
+
+# ═══════════════════════════════════════════════════════════════
+# СТАТИСТИКА
+# ═══════════════════════════════════════════════════════════════
+
+LOW_STOCK_THRESHOLD = 10
+
+
+def _bump(name: str, delta: str) -> str:
+    return f"""
+        INSERT INTO stats_counters (name, value) VALUES ({name}, {delta})
+        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+    """
+
+
+ROLLUP_BUCKETS = {
+    "order_rollups_hourly": "strftime('%Y-%m-%d %H:00', {created_at})",
+    "order_rollups_daily": "date({created_at})",
+}
+
+
+def _rollup(row: str, sign: str) -> str:
+    """Добавляет заказ row (NEW/OLD) в итоги со знаком sign"""
+    sql = ""
+    for table, bucket in ROLLUP_BUCKETS.items():
+        sql += f"""
+            INSERT INTO {table} (bucket, status, orders, revenue)
+            VALUES ({bucket.format(created_at=row + '.created_at')}, IFNULL({row}.status, ''),
+                    {sign}1, {sign}{row}.total)
+            ON CONFLICT(bucket, status) DO UPDATE SET
+                orders = orders + excluded.orders, revenue = revenue + excluded.revenue;
+        """
+    return sql
+
+
+# Триггеры по таблицам: (имя, событие, тело). Булевы выражения вида
+# (x) IS 1 дают 0/1 и не превращают счётчик в NULL
+STATS_TRIGGERS = {
+    "orders": [
+        ("stats_orders_insert", "AFTER INSERT ON orders",
+         _bump("'orders'", "1") + _bump("'revenue'", "NEW.total")
+         + _bump("'orders:' || IFNULL(NEW.status, '')", "1") + _rollup("NEW", "+")),
+        ("stats_orders_delete", "AFTER DELETE ON orders",
+         _bump("'orders'", "-1") + _bump("'revenue'", "-OLD.total")
+         + _bump("'orders:' || IFNULL(OLD.status, '')", "-1") + _rollup("OLD", "-")),
+        ("stats_orders_update",
+         "AFTER UPDATE OF status, total ON orders "
+         "WHEN OLD.status IS NOT NEW.status OR OLD.total IS NOT NEW.total",
+         _bump("'revenue'", "NEW.total - OLD.total")
+         + _bump("'orders:' || IFNULL(OLD.status, '')", "-1")
+         + _bump("'orders:' || IFNULL(NEW.status, '')", "1")
+         + _rollup("OLD", "-") + _rollup("NEW", "+")),
+    ],
+    "users": [
+        ("stats_users_insert", "AFTER INSERT ON users",
+         _bump("'users'", "(NEW.is_admin = 0) IS 1")),
+        ("stats_users_delete", "AFTER DELETE ON users",
+         _bump("'users'", "-((OLD.is_admin = 0) IS 1)")),
+        ("stats_users_update", "AFTER UPDATE OF is_admin ON users",
+         _bump("'users'", "((NEW.is_admin = 0) IS 1) - ((OLD.is_admin = 0) IS 1)")),
+    ],
+    "products": [
+        ("stats_products_insert", "AFTER INSERT ON products",
+         _bump("'products'", "(NEW.is_active = 1) IS 1")
+         + _bump("'low_stock'", f"(NEW.is_active = 1 AND NEW.stock < {LOW_STOCK_THRESHOLD}) IS 1")),
+        ("stats_products_delete", "AFTER DELETE ON products",
+         _bump("'products'", "-((OLD.is_active = 1) IS 1)")
+         + _bump("'low_stock'", f"-((OLD.is_active = 1 AND OLD.stock < {LOW_STOCK_THRESHOLD}) IS 1)")),
+        ("stats_products_update", "AFTER UPDATE OF stock, is_active ON products",
+         _bump("'products'", "((NEW.is_active = 1) IS 1) - ((OLD.is_active = 1) IS 1)")
+         + _bump("'low_stock'", f"((NEW.is_active = 1 AND NEW.stock < {LOW_STOCK_THRESHOLD}) IS 1)"
+                                f" - ((OLD.is_active = 1 AND OLD.stock < {LOW_STOCK_THRESHOLD}) IS 1)")),
+    ],
+}
+
+
+async def create_stats_triggers(db, tables: List[str] = None):
+    for table in tables or STATS_TRIGGERS:
+        for name, event, body in STATS_TRIGGERS[table]:
+            await db.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+
+async def drop_stats_triggers(db, tables: List[str] = None):
+    """Для массовых загрузок: после загрузки — create_stats_triggers и reconcile_stats"""
+    for table in tables or STATS_TRIGGERS:
+        for name, _, _ in STATS_TRIGGERS[table]:
+            await db.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+async def rebuild_stats_counters(db) -> Dict[str, float]:
+    """Пересчитывает счётчики по таблицам (без commit)"""
+    counters = {}
+
+    cursor = await db.execute("SELECT COUNT(*), COALESCE(SUM(total), 0) FROM orders")
+    counters['orders'], counters['revenue'] = await cursor.fetchone()
+
+    cursor = await db.execute("SELECT IFNULL(status, ''), COUNT(*) FROM orders GROUP BY 1")
+    for status, cnt in await cursor.fetchall():
+        counters['orders:' + status] = cnt
+
+    cursor = await db.execute("SELECT COUNT(*) FROM users WHERE is_admin = 0")
+    counters['users'] = (await cursor.fetchone())[0]
+
+    cursor = await db.execute(f"""
+        SELECT COUNT(*), COALESCE(SUM(stock < {LOW_STOCK_THRESHOLD}), 0)
+        FROM products WHERE is_active = 1
+    """)
+    counters['products'], counters['low_stock'] = await cursor.fetchone()
+
+    await db.execute("DELETE FROM stats_counters")
+    await db.executemany("INSERT INTO stats_counters (name, value) VALUES (?, ?)", counters.items())
+    return counters
+
+
+async def reconcile_stats() -> Dict[str, float]:
+    """Сверка счётчиков с таблицами; запускается периодически фоновой задачей"""
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        counters = await rebuild_stats_counters(db)
+        await db.commit()
+        return counters
+
+
+async def rebuild_order_rollups(db):
+    """Заполняет итоги по заказам заново из таблицы orders (без commit)"""
+    for table, bucket in ROLLUP_BUCKETS.items():
+        await db.execute(f"DELETE FROM {table}")
+        await db.execute(f"""
+            INSERT INTO {table} (bucket, status, orders, revenue)
+            SELECT {bucket.format(created_at='created_at')}, IFNULL(status, ''), COUNT(*), SUM(total)
+            FROM orders
+            GROUP BY 1, 2
         """)
-        stats['orders_by_status'] = {row[0]: row[1] for row in await cursor.fetchall()}
 
-        # Пользователи
-        cursor = await db.execute("SELECT COUNT(*) FROM users WHERE is_admin = 0")
-        stats['total_users'] = (await cursor.fetchone())[0]
 
-        # Товары
-        cursor = await db.execute("SELECT COUNT(*) FROM products WHERE is_active = 1")
-        stats['total_products'] = (await cursor.fetchone())[0]
+async def backfill_order_rollups():
+    async with get_db() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        await rebuild_order_rollups(db)
+        await db.commit()
+
 
-        # Товары с низким остатком
-        cursor = await db.execute("SELECT COUNT(*) FROM products WHERE stock < 10 AND is_active = 1")
-        stats['low_stock'] = (await cursor.fetchone())[0]
+ROLLUP_GRANULARITIES = {
+    # гранулярность: (таблица, выражение периода, шаг, формат ключа)
+    "hour": ("order_rollups_hourly", "bucket", timedelta(hours=1), "%Y-%m-%d %H:00"),
+    "day": ("order_rollups_daily", "bucket", timedelta(days=1), "%Y-%m-%d"),
+    "week": ("order_rollups_daily", "date(bucket, '-6 days', 'weekday 1')", timedelta(weeks=1), "%Y-%m-%d"),
+}
+ROLLUP_MAX_POINTS = 5000         # периодов в одном ответе (5000 часов — около 7 месяцев)
+
+
+async def get_order_rollups(granularity: str = "day", start: datetime = None,
+                            end: datetime = None) -> List[Dict]:
+    """
+    Заказы и выручка по периодам за [start, end) в UTC, включая пустые
+    периоды. Неделя начинается с понедельника.
+    """
+    table, period, step, fmt = ROLLUP_GRANULARITIES[granularity]
+    end = end or datetime.utcnow()
+    start = start or end - 30 * step
+    if granularity == "week":
+        start -= timedelta(days=start.weekday())
+    start = datetime.strptime(start.strftime(fmt), fmt)
+
+    points = {}
+    current = start
+    while current < end:
+        key = current.strftime(fmt)
+        points[key] = {"period": key, "orders": 0, "revenue": 0, "by_status": {}}
+        current += step
 
-        return stats
\ No newline at end of file
+    async with get_db() as db:
+        cursor = await db.execute(f"""
+            SELECT {period} AS period, status, SUM(orders), SUM(revenue)
+            FROM {table}
+            WHERE bucket >= ? AND bucket < ?
+            GROUP BY 1, 2
+        """, (start.strftime(fmt), current.strftime(fmt)))
+        rows = await cursor.fetchall()
+
+    for period_key, status, orders, revenue in rows:
+        point = points.get(period_key)
+        if point is None:
+            continue
+        point["by_status"][status] = orders
+        point["orders"] += orders
+        point["revenue"] += revenue
+
+    return list(points.values())
+
+
+async def get_stats() -> Dict:
+    """Статистика для админ-панели"""
+    async with get_db() as db:
+        cursor = await db.execute("SELECT name, value FROM stats_counters")
+        counters = {row[0]: row[1] for row in await cursor.fetchall()}
+
+    return {
+        'total_orders': int(counters.get('orders', 0)),
+        'total_revenue': counters.get('revenue', 0),
+        'orders_by_status': {
+            name[len('orders:'):]: int(value)
+            for name, value in counters.items() if name.startswith('orders:') and value
+        },
+        'total_users': int(counters.get('users', 0)),
+        'total_products': int(counters.get('products', 0)),
+        'low_stock': int(counters.get('low_stock', 0)),
+    }
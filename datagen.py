@@ -0,0 +1,344 @@
+"""
+Генератор синтетических данных для нагрузочного тестирования
+"""
+
+import math
+import random
+import time
+from array import array
+from datetime import date, datetime
+from typing import Callable, Dict, Iterator, List, Optional
+
+from database import (
+    get_db, drop_stats_triggers, create_stats_triggers, rebuild_stats_counters, rebuild_order_rollups
+)
+
+DATAGEN_CHUNK_SIZE = 50_000
+DATAGEN_PASSWORD = "loadtest"        # пароль всех сгенерированных пользователей
+POPULARITY_SKEW = 3.0                # rank = n * random() ** skew: ~10% товаров дают ~половину продаж
+CATEGORY_FANOUT = 6                  # подкатегорий у каждой категории
+CATEGORY_DEPTH = 3
+
+DATAGEN_DEFAULTS = {
+    "products": 100_000,
+    "users": 50_000,
+    "orders": 200_000,
+    "reviews": 100_000,
+    "favorites": 100_000,
+    "carts": 10_000,                 # пользователей с непустой корзиной
+    "days": 365,                     # глубина истории
+    "description_words": 60,
+}
+
+ROOT_CATEGORIES = [
+    ("Электроника", "📱"), ("Одежда", "👕"), ("Дом и сад", "🏠"), ("Спорт", "⚽"),
+    ("Книги", "📚"), ("Красота", "💄"), ("Детям", "🧸"), ("Авто", "🚗"),
+    ("Продукты", "🍎"), ("Зоотовары", "🐾"),
+]
+BRANDS = ["Nova", "Aurum", "Polar", "Vega", "Orion", "Zenit", "Altai", "Baikal", "Sever", "Terra",
+          "Lumen", "Vostok", "Atlas", "Kedr", "Ural", "Sigma", "Delta", "Omega", "Astra", "Kvant"]
+NOUNS = ["Смартфон", "Ноутбук", "Куртка", "Кроссовки", "Лампа", "Кресло", "Рюкзак", "Часы",
+         "Наушники", "Чайник", "Книга", "Набор", "Плед", "Коврик", "Термос", "Сумка", "Мяч",
+         "Конструктор", "Крем", "Шампунь", "Корм", "Фонарь", "Колонка", "Планшет"]
+ADJECTIVES = ["Классический", "Компактный", "Премиальный", "Лёгкий", "Надёжный", "Новый",
+              "Универсальный", "Детский", "Профессиональный", "Складной", "Беспроводной"]
+WORDS = ("качество материал удобство гарантия доставка комплект размер цвет модель серия "
+         "защита корпус покрытие упаковка надёжность дизайн функция режим зарядка ткань "
+         "уход подарок сезон стиль вес объём мощность батарея экран звук").split()
+FIRST_NAMES = ["Иван", "Анна", "Пётр", "Мария", "Алексей", "Елена", "Дмитрий", "Ольга",
+               "Сергей", "Наталья", "Андрей", "Татьяна", "Михаил", "Ирина", "Никита", "Дарья"]
+LAST_NAMES = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов",
+              "Михайлов", "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев"]
+CITIES = ["Москва", "Санкт-Петербург", "Новосибирск", "Екатеринбург", "Казань",
+          "Нижний Новгород", "Самара", "Омск", "Ростов-на-Дону", "Уфа", "Пермь", "Воронеж"]
+STREETS = ["Ленина", "Мира", "Садовая", "Советская", "Лесная", "Школьная", "Центральная", "Новая"]
+REVIEW_TEXTS = ["Отличный товар", "Рекомендую", "Соответствует описанию", "Быстрая доставка",
+                "Качество могло быть лучше", "Не подошёл размер", "Брал в подарок, все довольны", None]
+
+
+class Skewed:
+    """
+    Индексы 0..n-1 со степенным распределением популярности. Популярные
+    индексы разбросаны по диапазону шагом, взаимно простым с n, — иначе
+    все «хиты» оказались бы самыми старыми записями.
+    """
+
+    def __init__(self, rng: random.Random, n: int, skew: float = POPULARITY_SKEW):
+        self.rng = rng
+        self.n = n
+        self.skew = skew
+        self.stride = max(1, int(n * 0.618)) | 1
+        while math.gcd(self.stride, n) != 1:
+            self.stride += 2
+
+    def pick(self) -> int:
+        rank = int(self.n * self.rng.random() ** self.skew)
+        return rank * self.stride % self.n
+
+
+def _rng(seed: int, table: str) -> random.Random:
+    # Свой генератор на таблицу: объём одной таблицы не меняет содержимое других
+    return random.Random(f"{seed}:{table}")
+
+
+def _moment(start: float, span: float, i: int, n: int) -> float:
+    """i-й из n возрастающих моментов; плотность растёт к концу периода (рост магазина)"""
+    return start + span * math.sqrt((i + 0.5) / n)
+
+
+def _timestamp(t: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t))
+
+
+def _timestamps(start: float, span: float, n: int) -> Iterator[str]:
+    for i in range(n):
+        yield _timestamp(_moment(start, span, i, n))
+
+
+def _user_name(i: int) -> str:
+    return f"{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]}"
+
+
+def _user_address(i: int) -> str:
+    return f"г. {CITIES[i % len(CITIES)]}, ул. {STREETS[i // 7 % len(STREETS)]}, д. {i % 150 + 1}"
+
+
+async def _write(db, sql: str, rows: Iterator, table: str, report: Dict,
+                 progress: Optional[Callable[[str, int], None]]):
+    """executemany пачками по DATAGEN_CHUNK_SIZE строк из генератора"""
+    chunk: List[tuple] = []
+    written = 0
+    changes = db.total_changes
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= DATAGEN_CHUNK_SIZE:
+            await db.executemany(sql, chunk)
+            written += len(chunk)
+            chunk = []
+            if progress:
+                progress(table, written)
+    if chunk:
+        await db.executemany(sql, chunk)
+        written += len(chunk)
+    await db.commit()
+    report[table] = db.total_changes - changes   # INSERT OR IGNORE пропускает повторы
+    if progress:
+        progress(table, written)
+
+
+async def generate_dataset(seed: int = 42, until: date = None,
+                           progress: Optional[Callable[[str, int], None]] = None, **volumes) -> Dict:
+    """
+    Добавляет в БД синтетический каталог, пользователей, корзины, избранное,
+    заказы и отзывы. Объёмы — ключи DATAGEN_DEFAULTS. При одинаковых seed,
+    until и объёмах получается одна и та же БД. Популярность товаров и
+    активность покупателей распределены степенным законом.
+    Возвращает число строк по таблицам и время генерации.
+    """
+    options = {**DATAGEN_DEFAULTS, **{k: v for k, v in volumes.items() if v is not None}}
+    unknown = set(options) - set(DATAGEN_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Неизвестные параметры: {', '.join(sorted(unknown))}")
+
+    until = until or date.today()
+    end = (datetime(until.year, until.month, until.day) - datetime(1970, 1, 1)).total_seconds()
+    span = options['days'] * 86400
+    start = end - span
+    report: Dict = {}
+    started = time.perf_counter()
+
+    async with get_db() as db:
+        cursor = await db.execute("SELECT 1 FROM categories WHERE slug LIKE 'gen-%' LIMIT 1")
+        if await cursor.fetchone():
+            raise ValueError("В БД уже есть сгенерированные данные — используйте новый файл БД")
+
+        await db.execute("PRAGMA synchronous = OFF")
+        await db.execute("PRAGMA cache_size = -500000")
+        await drop_stats_triggers(db)
+        await db.commit()
+
+        try:
+            async def next_id(table: str) -> int:
+                cursor = await db.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+                return (await cursor.fetchone())[0]
+
+            # ─── Категории: дерево ROOT_CATEGORIES × CATEGORY_FANOUT^depth ───
+
+            category_base = await next_id("categories")
+            categories = []
+            level = []
+            for name, icon in ROOT_CATEGORIES:
+                cid = category_base + len(categories)
+                categories.append((cid, name, f"gen-{cid}", icon, None))
+                level.append((cid, name, icon))
+            for _ in range(1, CATEGORY_DEPTH):
+                children = []
+                for parent_id, parent_name, icon in level:
+                    for k in range(CATEGORY_FANOUT):
+                        cid = category_base + len(categories)
+                        categories.append((cid, f"{parent_name} {k + 1}", f"gen-{cid}", icon, parent_id))
+                        children.append((cid, f"{parent_name} {k + 1}", icon))
+                level = children
+            leaves = [cid for cid, _, _ in level]
+
+            await _write(db, "INSERT INTO categories (id, name, slug, icon, parent_id) VALUES (?, ?, ?, ?, ?)",
+                         iter(categories), "categories", report, progress)
+
+            # ─── Товары ───
+
+            n_products = options['products']
+            product_base = await next_id("products")
+            prices = array('d')
+            rng = _rng(seed, "products")
+            leaf_pick = Skewed(rng, len(leaves), skew=2.0)
+
+            def products():
+                for i, created_at in enumerate(_timestamps(start, span, n_products)):
+                    pid = product_base + i
+                    price = round(math.exp(rng.uniform(math.log(200), math.log(300_000))), -1)
+                    prices.append(price)
+                    old_price = round(price * rng.uniform(1.1, 1.4), -1) if rng.random() < 0.2 else None
+                    stock = 0 if rng.random() < 0.05 else int(rng.expovariate(1 / 40))
+                    words = " ".join(rng.choices(WORDS, k=rng.randint(10, options['description_words'])))
+                    yield (
+                        pid, f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS).lower()} {rng.choice(BRANDS)} {i % 1000}",
+                        f"gen-{pid}", words.capitalize() + ".", price, old_price,
+                        leaves[leaf_pick.pick()], "📦", stock, 1 if rng.random() < 0.01 else 0,
+                        1 if rng.random() < 0.98 else 0, created_at,
+                    )
+
+            await _write(db, """
+                INSERT INTO products (id, name, slug, description, price, old_price, category_id,
+                                      image, stock, is_featured, is_active, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, products(), "products", report, progress)
+
+            # ─── Пользователи ───
+
+            n_users = options['users']
+            user_base = await next_id("users")
+
+            def users():
+                for i, created_at in enumerate(_timestamps(start, span, n_users)):
+                    yield (
+                        user_base + i, f"user{i}@loadtest.local", DATAGEN_PASSWORD, _user_name(i),
+                        f"+7 9{i % 10 ** 9:09d}", _user_address(i), created_at,
+                    )
+
+            await _write(db, """
+                INSERT INTO users (id, email, password, name, phone, address, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, users(), "users", report, progress)
+
+            if not n_products or not n_users:
+                options.update(orders=0, reviews=0, favorites=0, carts=0)
+
+            # ─── Корзины и избранное ───
+
+            rng = _rng(seed, "cart_items")
+            product_pick = Skewed(rng, n_products)
+
+            def cart_items():
+                for _ in range(options['carts']):
+                    user_id = user_base + rng.randrange(n_users)
+                    for _ in range(1 + int(rng.expovariate(0.7)) % 5):
+                        yield user_id, product_base + product_pick.pick(), 1 + int(rng.random() ** 4 * 3)
+
+            await _write(db, "INSERT OR IGNORE INTO cart_items (user_id, product_id, quantity) VALUES (?, ?, ?)",
+                         cart_items(), "cart_items", report, progress)
+
+            rng = _rng(seed, "favorites")
+            product_pick = Skewed(rng, n_products)
+            user_pick = Skewed(rng, n_users, skew=2.0)
+
+            def favorites():
+                for _ in range(options['favorites']):
+                    yield user_base + user_pick.pick(), product_base + product_pick.pick()
+
+            await _write(db, "INSERT OR IGNORE INTO favorites (user_id, product_id) VALUES (?, ?)",
+                         favorites(), "favorites", report, progress)
+
+            # ─── Заказы и позиции ───
+
+            n_orders = options['orders']
+            order_base = await next_id("orders")
+            rng = _rng(seed, "orders")
+            product_pick = Skewed(rng, n_products)
+            user_pick = Skewed(rng, n_users, skew=2.0)
+            order_sql = """
+                INSERT INTO orders (id, user_id, status, total, name, email, phone, address, comment, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """
+            item_sql = "INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)"
+            report["orders"] = report["order_items"] = 0
+
+            for chunk_start in range(0, n_orders, DATAGEN_CHUNK_SIZE):
+                order_rows = []
+                item_rows = []
+                for i in range(chunk_start, min(chunk_start + DATAGEN_CHUNK_SIZE, n_orders)):
+                    order_id = order_base + i
+                    created = _moment(start, span, i, n_orders)
+                    u = user_pick.pick()
+                    total = 0.0
+                    chosen = set()
+                    for _ in range(1 + min(int(rng.expovariate(0.8)), 9)):
+                        p = product_pick.pick()
+                        if p in chosen:
+                            continue
+                        chosen.add(p)
+                        quantity = 1 + int(rng.random() ** 4 * 3)
+                        item_rows.append((order_id, product_base + p, quantity, prices[p]))
+                        total += quantity * prices[p]
+
+                    if end - created > 14 * 86400:
+                        status = 'cancelled' if rng.random() < 0.08 else 'delivered'
+                    else:
+                        status = rng.choice(('pending', 'processing', 'processing', 'shipped', 'shipped', 'cancelled'))
+
+                    order_rows.append((
+                        order_id, user_base + u, status, total, _user_name(u), f"user{u}@loadtest.local",
+                        f"+7 9{u % 10 ** 9:09d}", _user_address(u), None, _timestamp(created),
+                    ))
+
+                await db.executemany(order_sql, order_rows)
+                await db.executemany(item_sql, item_rows)
+                report["orders"] += len(order_rows)
+                report["order_items"] += len(item_rows)
+                if progress:
+                    progress("orders", report["orders"])
+            await db.commit()
+
+            # ─── Отзывы и рейтинги ───
+
+            rng = _rng(seed, "reviews")
+            product_pick = Skewed(rng, n_products)
+
+            def reviews():
+                for created_at in _timestamps(start, span, options['reviews']):
+                    rating = rng.choices((1, 2, 3, 4, 5), weights=(5, 5, 10, 30, 50))[0]
+                    yield (
+                        user_base + rng.randrange(n_users), product_base + product_pick.pick(),
+                        rating, rng.choice(REVIEW_TEXTS), created_at,
+                    )
+
+            await _write(db, """
+                INSERT INTO reviews (user_id, product_id, rating, text, created_at) VALUES (?, ?, ?, ?, ?)
+            """, reviews(), "reviews", report, progress)
+
+            await db.execute("""
+                UPDATE products
+                SET rating = r.rating, reviews_count = r.cnt
+                FROM (SELECT product_id, ROUND(AVG(rating), 1) AS rating, COUNT(*) AS cnt
+                      FROM reviews GROUP BY product_id) r
+                WHERE products.id = r.product_id AND products.id >= ?
+            """, (product_base,))
+        finally:
+            # Счётчики и итоги пересчитываются и после ошибки — загруженное остаётся в БД
+            await create_stats_triggers(db)
+            await rebuild_stats_counters(db)
+            await rebuild_order_rollups(db)
+            await db.commit()
+        await db.execute("ANALYZE")
+
+    report["seconds"] = round(time.perf_counter() - started, 1)
+    return report
@@ -0,0 +1,163 @@
+"""
+Массовая загрузка товаров из CSV/JSONL
+"""
+
+import csv
+import json
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from database import (
+    get_db, upsert_products, drop_stats_triggers, create_stats_triggers, rebuild_stats_counters
+)
+
+IMPORT_CHUNK_SIZE = 5000             # строк на один executemany
+IMPORT_TRANSACTION_ROWS = 200_000    # commit раз в столько строк
+IMPORT_MAX_ERROR_SAMPLES = 20
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def detect_format(filename: str) -> str:
+    return "jsonl" if filename.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def read_records(lines: Iterable[str], fmt: str) -> Iterator[Dict]:
+    """Записи файла по одной; битая строка JSONL отдаётся как исключение"""
+    if fmt == "csv":
+        yield from csv.DictReader(lines)
+        return
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ImportRowError(f"некорректный JSON: {e}")
+
+
+def _number(value, cast, field: str, default=None):
+    if value is None or value == "":
+        return default
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise ImportRowError(f"{field}: ожидается число, получено {value!r}")
+
+
+def _flag(value, default: int) -> int:
+    if value is None or value == "":
+        return default
+    return 1 if str(value).strip().lower() in ("1", "true", "yes", "да") else 0
+
+
+def parse_product(record: Dict, categories: Dict[str, int]) -> Tuple:
+    """Проверяет запись и возвращает кортеж для upsert_products"""
+    if not isinstance(record, dict):
+        raise ImportRowError("ожидается объект с полями товара")
+
+    name = (record.get("name") or "").strip()
+    slug = (record.get("slug") or "").strip()
+    if not name or not slug:
+        raise ImportRowError("name и slug обязательны")
+
+    price = _number(record.get("price"), float, "price")
+    if price is None or price < 0:
+        raise ImportRowError("price: обязательна и не может быть отрицательной")
+    old_price = _number(record.get("old_price"), float, "old_price")
+
+    category_id = _number(record.get("category_id"), int, "category_id")
+    category_slug = record.get("category") or record.get("category_slug")
+    if category_id is None and category_slug:
+        category_id = categories.get(category_slug)
+        if category_id is None:
+            raise ImportRowError(f"неизвестная категория {category_slug!r}")
+
+    stock = _number(record.get("stock"), int, "stock", 0)
+
+    return (
+        name, slug, record.get("description") or None, price, old_price, category_id,
+        record.get("image") or "📦", stock,
+        _flag(record.get("is_featured"), 0), _flag(record.get("is_active"), 1),
+    )
+
+
+async def import_products(lines: Iterable[str], fmt: str = "csv",
+                          progress: Optional[Callable[[Dict], None]] = None,
+                          chunk_size: int = IMPORT_CHUNK_SIZE) -> Dict:
+    """
+    Загружает товары с upsert по slug. Строки с ошибками пропускаются и
+    попадают в отчёт. Триггеры счётчиков на products на время загрузки
+    снимаются, счётчики пересчитываются один раз в конце. В product_ids
+    отчёта — id загруженных товаров (для перечитывания остатков).
+    """
+    report = {"rows": 0, "imported": 0, "errors": 0, "error_samples": [],
+              "seconds": 0.0, "rows_per_second": 0.0, "product_ids": []}
+    started = time.perf_counter()
+
+    def error(row_number: int, message: str):
+        report["errors"] += 1
+        if len(report["error_samples"]) < IMPORT_MAX_ERROR_SAMPLES:
+            report["error_samples"].append({"row": row_number, "error": message})
+
+    def tick():
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        report["rows_per_second"] = round(report["rows"] / report["seconds"], 1) if report["seconds"] else 0.0
+        if progress:
+            progress(report)
+
+    async def upsert(chunk: List[Tuple]):
+        await upsert_products(db, chunk)
+        slugs = [row[1] for row in chunk]
+        cursor = await db.execute(f"SELECT id FROM products WHERE slug IN ({','.join('?' * len(slugs))})", slugs)
+        report["product_ids"].extend(row[0] for row in await cursor.fetchall())
+        report["imported"] += len(chunk)
+
+    async with get_db() as db:
+        await db.execute("PRAGMA synchronous = NORMAL")
+        await db.execute("PRAGMA cache_size = -200000")
+
+        cursor = await db.execute("SELECT slug, id FROM categories")
+        categories = {slug: cid for slug, cid in await cursor.fetchall()}
+
+        await drop_stats_triggers(db, ["products"])
+        await db.commit()
+
+        try:
+            chunk: List[Tuple] = []
+            since_commit = 0
+            for record in read_records(lines, fmt):
+                report["rows"] += 1
+                try:
+                    if isinstance(record, Exception):
+                        raise record
+                    chunk.append(parse_product(record, categories))
+                except ImportRowError as e:
+                    error(report["rows"], str(e))
+
+                if len(chunk) >= chunk_size:
+                    await upsert(chunk)
+                    since_commit += len(chunk)
+                    chunk = []
+                    if since_commit >= IMPORT_TRANSACTION_ROWS:
+                        await db.commit()
+                        since_commit = 0
+                    tick()
+
+            if chunk:
+                await upsert(chunk)
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+        finally:
+            await create_stats_triggers(db, ["products"])
+            await rebuild_stats_counters(db)
+            await db.commit()
+
+    tick()
+    return report
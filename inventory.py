@@ -0,0 +1,305 @@
+"""
+Складской учёт в памяти: резервирование остатков для оформления заказа
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import timing
+from database import get_db
+
+LEGACY_JOURNAL_PATH = "inventory.journal"   # журнал-файл прежних версий, переносится в БД при старте
+RESERVATION_TTL = 15 * 60        # секунд до снятия неподтверждённого резерва
+FLUSH_INTERVAL = 1.0             # период сброса изменений остатков в БД
+FLUSH_BATCH_SIZE = 500
+REFRESH_INTERVAL = 60.0          # счётчики без резервов перечитываются из БД
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id: int, requested: int, available: int):
+        super().__init__(f"Товар {product_id}: запрошено {requested}, доступно {available}")
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+
+
+class InventoryService:
+    """
+    Остатки товаров в памяти процесса.
+
+    Счётчики подгружаются из БД при первом обращении к товару. Резерв —
+    синхронная O(1) операция без обращения к SQLite. Списание при
+    оформлении записывается в inventory_journal в транзакции заказа
+    (journal), после коммита попадает в счётчики (confirm) и пачками
+    сбрасывается в products.stock фоновой задачей — вместе с удалением
+    сброшенных записей журнала. Заказ и его списание фиксируются вместе,
+    поэтому после падения процесса при старте дозаписывается весь
+    оставшийся журнал.
+    """
+
+    def __init__(self, ttl: float = RESERVATION_TTL, flush_interval: float = FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+
+        self._on_hand: Dict[int, int] = {}
+        self._reserved: Dict[int, int] = {}
+        self._reservations: Dict[str, Tuple[float, Dict[int, int]]] = {}
+        self._journaled: Dict[str, Tuple[int, Dict[int, int]]] = {}   # записано в транзакции, ждёт коммита
+        self._pending: Dict[int, int] = {}
+        self._unflushed: List[int] = []   # записи журнала, ещё не сброшенные в products.stock
+        self._task: Optional[asyncio.Task] = None
+
+        self.hits = 0                # обращения к ensure_loaded: товар уже в памяти
+        self.misses = 0              # ... и подгрузка из БД
+
+    # ─── Жизненный цикл ───
+
+    async def start(self):
+        await self._import_legacy_journal()
+        await self._recover()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        last_refresh = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.expire()
+            # Остатки могли поменять в обход сервиса (импорт, другой процесс)
+            if time.monotonic() - last_refresh >= REFRESH_INTERVAL:
+                self.invalidate()
+                last_refresh = time.monotonic()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Ошибка сброса остатков: {e}")
+
+    # ─── Чтение ───
+
+    async def ensure_loaded(self, product_ids: Iterable[int]):
+        """Подгружает из БД счётчики товаров, которых ещё нет в памяти"""
+        ids = set(product_ids)
+        missing = [pid for pid in ids if pid not in self._on_hand]
+        self.hits += len(ids) - len(missing)
+        self.misses += len(missing)
+        if ids:
+            timing.add("cache_hit", 0.0, len(ids) - len(missing))
+            timing.add("cache_miss", 0.0, len(missing))
+        if missing:
+            await self.refresh(missing)
+
+    async def refresh(self, product_ids: Iterable[int]):
+        """Перечитывает остатки из БД (после изменения товаров в обход сервиса)"""
+        ids = list(product_ids)
+        async with get_db() as db:
+            for i in range(0, len(ids), FLUSH_BATCH_SIZE):
+                chunk = ids[i:i + FLUSH_BATCH_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = await db.execute(
+                    f"SELECT id, stock FROM products WHERE id IN ({placeholders})", chunk
+                )
+                for pid, stock in await cursor.fetchall():
+                    self._on_hand[pid] = stock + self._pending.get(pid, 0)
+
+    def invalidate(self, product_ids: Iterable[int] = None):
+        """Сбрасывает счётчики без резервов — они подгрузятся заново при обращении"""
+        ids = list(self._on_hand) if product_ids is None else product_ids
+        for pid in ids:
+            if not self._reserved.get(pid) and not self._pending.get(pid):
+                self._on_hand.pop(pid, None)
+
+    async def reload(self, product_ids: Iterable[int]):
+        """Как invalidate, но товары с резервами сразу перечитываются из БД"""
+        ids = list(product_ids)
+        self.invalidate(ids)
+        await self.refresh([pid for pid in ids if pid in self._on_hand])
+
+    def available(self, product_id: int, default: int = None) -> Optional[int]:
+        if product_id not in self._on_hand:
+            return default
+        return self._on_hand[product_id] - self._reserved.get(product_id, 0)
+
+    async def get_available(self, product_id: int) -> Optional[int]:
+        await self.ensure_loaded([product_id])
+        return self.available(product_id)
+
+    def caches(self) -> Dict[str, object]:
+        return {
+            "inventory.on_hand": self._on_hand,
+            "inventory.reserved": self._reserved,
+            "inventory.reservations": self._reservations,
+            "inventory.pending": self._pending,
+        }
+
+    # ─── Резервирование ───
+
+    def reserve(self, key: str, items: Dict[int, int]):
+        """
+        Резервирует товары под ключом (например, корзиной пользователя).
+        Предыдущий резерв с тем же ключом заменяется. Товары должны быть
+        подгружены через ensure_loaded.
+        """
+        self.release(key)
+
+        for pid, qty in items.items():
+            available = self.available(pid, 0)
+            if qty > available:
+                raise InsufficientStock(pid, qty, available)
+
+        for pid, qty in items.items():
+            self._reserved[pid] = self._reserved.get(pid, 0) + qty
+        self._reservations[key] = (time.monotonic() + self.ttl, dict(items))
+
+    def release(self, key: str) -> bool:
+        self._journaled.pop(key, None)
+        reservation = self._reservations.pop(key, None)
+        if not reservation:
+            return False
+
+        for pid, qty in reservation[1].items():
+            left = self._reserved.get(pid, 0) - qty
+            if left > 0:
+                self._reserved[pid] = left
+            else:
+                self._reserved.pop(pid, None)
+        return True
+
+    async def journal(self, db, key: str) -> bool:
+        """
+        Записывает списание резерва в inventory_journal. Вызывается в
+        транзакции заказа (before_commit), после коммита — confirm(key).
+        False если резерв истёк.
+        """
+        reservation = self._reservations.get(key)
+        if not reservation:
+            return False
+
+        items = dict(reservation[1])
+        cursor = await db.execute(
+            "INSERT INTO inventory_journal (deltas) VALUES (?)",
+            (json.dumps({str(pid): -qty for pid, qty in items.items()}),)
+        )
+        self._journaled[key] = (cursor.lastrowid, items)
+        return True
+
+    def confirm(self, key: str) -> bool:
+        """Превращает записанный в журнал резерв в списание со склада. False если записи не было"""
+        journaled = self._journaled.pop(key, None)
+        self.release(key)
+        if not journaled:
+            return False
+
+        seq, items = journaled
+        self._unflushed.append(seq)
+        for pid, qty in items.items():
+            self._on_hand[pid] = self._on_hand.get(pid, 0) - qty
+            self._pending[pid] = self._pending.get(pid, 0) - qty
+        return True
+
+    def expire(self, now: float = None) -> int:
+        now = time.monotonic() if now is None else now
+        # Записанный в журнал резерв ждёт коммита заказа — его не снимаем
+        expired = [key for key, (expires_at, _) in self._reservations.items()
+                   if expires_at <= now and key not in self._journaled]
+        for key in expired:
+            self.release(key)
+        return len(expired)
+
+    # ─── Сброс в БД ───
+
+    async def flush(self):
+        """Записывает накопленные списания в products.stock и удаляет их из журнала одной транзакцией"""
+        if not self._pending and not self._unflushed:
+            return
+
+        pending, self._pending = self._pending, {}
+        seqs, self._unflushed = self._unflushed, []
+        try:
+            await self._apply(pending, seqs)
+        except Exception:
+            for pid, delta in pending.items():
+                self._pending[pid] = self._pending.get(pid, 0) + delta
+            self._unflushed = seqs + self._unflushed
+            raise
+
+    async def _apply(self, deltas: Dict[int, int], seqs: List[int]):
+        rows = [(delta, pid) for pid, delta in deltas.items() if delta]
+        async with get_db() as db:
+            for i in range(0, len(rows), FLUSH_BATCH_SIZE):
+                await db.executemany(
+                    "UPDATE products SET stock = stock + ? WHERE id = ?",
+                    rows[i:i + FLUSH_BATCH_SIZE]
+                )
+            for i in range(0, len(seqs), FLUSH_BATCH_SIZE):
+                chunk = seqs[i:i + FLUSH_BATCH_SIZE]
+                await db.execute(
+                    f"DELETE FROM inventory_journal WHERE seq IN ({','.join('?' * len(chunk))})", chunk
+                )
+            await db.commit()
+
+    async def _recover(self):
+        """Дозаписывает журнал, оставшийся после остановки или падения процесса"""
+        async with get_db() as db:
+            cursor = await db.execute("SELECT seq, deltas FROM inventory_journal ORDER BY seq")
+            rows = await cursor.fetchall()
+        if not rows:
+            return
+
+        deltas: Dict[int, int] = {}
+        for _, record in rows:
+            for pid, delta in json.loads(record).items():
+                deltas[int(pid)] = deltas.get(int(pid), 0) + delta
+        await self._apply(deltas, [seq for seq, _ in rows])
+        print(f"✅ Восстановлено списаний из журнала остатков: {len(rows)}")
+
+    async def _import_legacy_journal(self, path: str = LEGACY_JOURNAL_PATH):
+        """
+        Журнал-файл прежних версий: несброшенные записи переносятся в
+        inventory_journal одной транзакцией с удалением таблицы позиции
+        журнала. Если таблицы уже нет, файл перенесён до падения — остаётся
+        его удалить.
+        """
+        async with get_db() as db:
+            cursor = await db.execute("""
+                SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('inventory_slots', 'inventory_state')
+            """)
+            tables = [row[0] for row in await cursor.fetchall()]
+            if tables:
+                records = []
+                if os.path.exists(path):
+                    last_seq = 0
+                    for table in tables:
+                        key = "slot = 0" if table == "inventory_slots" else "id = 1"
+                        row = await (await db.execute(f"SELECT last_seq FROM {table} WHERE {key}")).fetchone()
+                        last_seq = max(last_seq, row[0] if row else 0)
+                    with open(path, encoding="utf-8") as f:
+                        for line in f:
+                            try:
+                                record = json.loads(line)
+                            except ValueError:
+                                break  # недописанная последняя строка
+                            if record["seq"] > last_seq:
+                                records.append((json.dumps(record["deltas"]),))
+
+                await db.executemany("INSERT INTO inventory_journal (deltas) VALUES (?)", records)
+                for table in tables:
+                    await db.execute(f"DROP TABLE {table}")
+                await db.commit()
+
+        if os.path.exists(path):
+            os.remove(path)
+
+
+inventory = InventoryService()
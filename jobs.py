@@ -0,0 +1,248 @@
+"""
+Очередь фоновых задач в SQLite с пулом асинхронных обработчиков
+"""
+
+import asyncio
+import json
+import time
+import traceback
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from database import get_db
+from tracing import tracer, KIND_CONSUMER
+
+JOB_WORKERS = 4
+JOB_MAX_ATTEMPTS = 5
+JOB_LEASE_SECONDS = 60.0         # задача возвращается в очередь, если обработчик завис
+JOB_POLL_INTERVAL = 1.0
+JOB_RETRY_BASE = 2.0             # задержка повтора: base * 2^(attempt-1) секунд
+JOB_RETRY_MAX = 600.0
+
+Handler = Callable[[Dict], Awaitable[None]]
+
+
+class JobQueue:
+    """
+    Задачи хранятся в таблице jobs: queued -> leased -> удаляется при успехе.
+    Ошибка возвращает задачу в queued с экспоненциальной задержкой, после
+    max_attempts попыток задача остаётся в таблице со статусом dead — как
+    и задача, аренда которой истекла на последней попытке (обработчик
+    завис или процесс упал).
+    Аренда — атомарный UPDATE, поэтому очередь можно разбирать из
+    нескольких процессов.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_INTERVAL,
+                 lease_seconds: float = JOB_LEASE_SECONDS):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+
+        self._handlers: Dict[str, Handler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+        self.enqueued = 0
+        self.completed = 0
+        self.retried = 0
+        self.dead = 0
+        self._completions: Deque[float] = deque(maxlen=10000)
+
+    def handler(self, kind: str):
+        """Декоратор: регистрирует обработчик задач вида kind"""
+        def decorator(func: Handler) -> Handler:
+            self._handlers[kind] = func
+            return func
+        return decorator
+
+    # ─── Постановка ───
+
+    async def enqueue(self, kind: str, payload: Dict = None, delay: float = 0,
+                      max_attempts: int = JOB_MAX_ATTEMPTS, db=None) -> int:
+        """Ставит задачу в очередь. С db — в рамках чужой транзакции, без commit"""
+        now = time.time()
+        params = (kind, json.dumps(payload or {}, ensure_ascii=False), max_attempts, now + delay, now)
+        sql = """
+            INSERT INTO jobs (kind, payload, max_attempts, run_at, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """
+        if db is not None:
+            cursor = await db.execute(sql, params)
+        else:
+            async with get_db() as conn:
+                cursor = await conn.execute(sql, params)
+                await conn.commit()
+
+        self.enqueued += 1
+        if self._wakeup and not delay:
+            self._wakeup.set()
+        return cursor.lastrowid
+
+    async def ensure_scheduled(self, kind: str, delay: float = 0) -> bool:
+        """Ставит задачу, если такой ещё нет в очереди — для периодических задач"""
+        async with get_db() as db:
+            cursor = await db.execute(
+                "SELECT 1 FROM jobs WHERE kind = ? AND status IN ('queued', 'leased') LIMIT 1", (kind,)
+            )
+            if await cursor.fetchone():
+                return False
+        await self.enqueue(kind, delay=delay)
+        return True
+
+    # ─── Жизненный цикл ───
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.workers)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._dispatch())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _dispatch(self):
+        while True:
+            free = self._queue.maxsize - self._queue.qsize()
+            try:
+                jobs = await self._lease(free) if free else []
+            except Exception as e:
+                print(f"⚠️ Ошибка выборки фоновых задач: {e}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+            for job in jobs:
+                await self._queue.put(job)
+
+            if len(jobs) < free or not free:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except Exception as e:
+                # Задача остаётся в аренде и вернётся в очередь по её истечении
+                print(f"⚠️ Ошибка обработки задачи #{job['id']} ({job['kind']}): {e}")
+                await asyncio.sleep(self.poll_interval)
+            finally:
+                self._queue.task_done()
+
+    async def _lease(self, limit: int) -> List[Dict]:
+        now = time.time()
+        async with get_db() as db:
+            # Аренда истекла на последней попытке — обработчик завис или ронял процесс: в dead-letter
+            cursor = await db.execute("""
+                UPDATE jobs
+                SET status = 'dead', last_error = ?, finished_at = ?
+                WHERE status = 'leased' AND leased_until <= ? AND attempts >= max_attempts
+                RETURNING id, kind
+            """, ("Аренда истекла на последней попытке", now, now))
+            for job_id, kind in await cursor.fetchall():
+                self.dead += 1
+                print(f"⚠️ Задача #{job_id} ({kind}) перемещена в dead-letter")
+
+            cursor = await db.execute("""
+                UPDATE jobs
+                SET status = 'leased', leased_until = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM jobs
+                    WHERE (status = 'queued' AND run_at <= ?)
+                       OR (status = 'leased' AND leased_until <= ?)
+                    ORDER BY run_at
+                    LIMIT ?
+                )
+                RETURNING id, kind, payload, attempts, max_attempts, run_at
+            """, (now + self.lease_seconds, now, now, limit))
+            jobs = [dict(row) for row in await cursor.fetchall()]
+            await db.commit()
+        return jobs
+
+    async def _run(self, job: Dict):
+        with tracer.trace(f"job {job['kind']}", KIND_CONSUMER, attributes={
+            "job.id": job['id'], "job.kind": job['kind'], "job.attempt": job['attempts'],
+        }) as span:
+            handler = self._handlers.get(job['kind'])
+            try:
+                if handler is None:
+                    raise LookupError(f"Нет обработчика для задачи {job['kind']}")
+                await handler(json.loads(job['payload']))
+            except Exception as e:
+                if span is not None:
+                    span.error = f"{type(e).__name__}: {e}"
+                await self._fail(job, traceback.format_exc(limit=5))
+                return
+
+            async with get_db() as db:
+                await db.execute("DELETE FROM jobs WHERE id = ?", (job['id'],))
+                await db.commit()
+            self.completed += 1
+            self._completions.append(time.time())
+
+    async def _fail(self, job: Dict, error: str):
+        async with get_db() as db:
+            if job['attempts'] >= job['max_attempts']:
+                await db.execute(
+                    "UPDATE jobs SET status = 'dead', last_error = ?, finished_at = ? WHERE id = ?",
+                    (error, time.time(), job['id'])
+                )
+                self.dead += 1
+                print(f"⚠️ Задача #{job['id']} ({job['kind']}) перемещена в dead-letter")
+            else:
+                delay = min(JOB_RETRY_BASE * 2 ** (job['attempts'] - 1), JOB_RETRY_MAX)
+                await db.execute(
+                    "UPDATE jobs SET status = 'queued', run_at = ?, last_error = ? WHERE id = ?",
+                    (time.time() + delay, error, job['id'])
+                )
+                self.retried += 1
+            await db.commit()
+
+    # ─── Dead-letter и метрики ───
+
+    async def retry_dead(self, job_id: int = None) -> int:
+        """Возвращает задачи из dead-letter в очередь"""
+        sql = "UPDATE jobs SET status = 'queued', attempts = 0, run_at = ? WHERE status = 'dead'"
+        params = [time.time()]
+        if job_id:
+            sql += " AND id = ?"
+            params.append(job_id)
+        async with get_db() as db:
+            cursor = await db.execute(sql, params)
+            await db.commit()
+            return cursor.rowcount
+
+    def caches(self) -> Dict[str, object]:
+        return {"jobs.completions": self._completions}
+
+    async def stats(self) -> Dict:
+        now = time.time()
+        async with get_db() as db:
+            cursor = await db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            by_status = {row[0]: row[1] for row in await cursor.fetchall()}
+            cursor = await db.execute(
+                "SELECT MIN(run_at) FROM jobs WHERE status = 'queued' AND run_at <= ?", (now,)
+            )
+            oldest = (await cursor.fetchone())[0]
+
+        return {
+            "queued": by_status.get('queued', 0),
+            "leased": by_status.get('leased', 0),
+            "dead": by_status.get('dead', 0),
+            "lag_seconds": round(now - oldest, 3) if oldest else 0.0,
+            "enqueued_total": self.enqueued,
+            "completed_total": self.completed,
+            "retried_total": self.retried,
+            "dead_total": self.dead,
+            "completed_last_minute": sum(1 for t in self._completions if t > now - 60),
+        }
+
+
+job_queue = JobQueue()
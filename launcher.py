@@ -0,0 +1,299 @@
+"""
+Запуск в production: один воркер под надзором мастера, предзагрузка и плавный перезапуск
+"""
+
+import asyncio
+import gc
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Callable, Optional
+
+import database
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+WORKER_START_TIMEOUT = 30.0      # секунд до готовности нового воркера
+WORKER_GRACEFUL_TIMEOUT = 30.0   # на завершение запросов в работе при остановке воркера
+WORKER_KILL_GRACE = 5.0          # сверх этого — SIGKILL
+WORKER_MIN_UPTIME = 10.0         # упавший раньше перезапускается с растущей паузой
+WORKER_RESTART_DELAY_MAX = 30.0
+SUPERVISE_INTERVAL = 0.2
+LISTEN_BACKLOG = 2048
+
+# Для каждого соединения воркера (см. database.set_pragmas); journal_mode=WAL ставится один раз в init_database
+WORKER_SQLITE_PRAGMAS = {
+    "synchronous": "NORMAL",          # в WAL коммит не ждёт fsync; база при сбое не портится
+    "temp_store": "MEMORY",           # сортировки и GROUP BY без временных файлов
+    "mmap_size": 256 * 1024 * 1024,   # страницы читаются из page cache ОС без копий
+}
+
+
+class Worker:
+    def __init__(self, pid: int, ready_fd: int):
+        self.pid = pid
+        self.ready_fd: Optional[int] = ready_fd
+        self.started = time.monotonic()
+        self.ready = False
+        self.retiring = False        # остановлен намеренно — не перезапускать
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+async def _serve(server, sock: socket.socket, ready_fd: int):
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started and not task.done():
+        await asyncio.sleep(0.05)
+    if server.started:
+        os.write(ready_fd, b"1")
+    os.close(ready_fd)
+    await task
+
+
+def serve_worker(app, sock: socket.socket, ready_fd: int) -> int:
+    import uvicorn
+    from accesslog import ACCESS_LOG
+
+    database.set_pragmas(WORKER_SQLITE_PRAGMAS)
+    config = uvicorn.Config(app, lifespan="on", access_log=not ACCESS_LOG,
+                            timeout_graceful_shutdown=int(WORKER_GRACEFUL_TIMEOUT))
+    server = uvicorn.Server(config)
+    asyncio.run(_serve(server, sock, ready_fd))
+    return 0 if server.started else 3
+
+
+def run_worker(fd: int, ready_fd: int) -> int:
+    """Воркер, запущенный заново через exec (плавный перезапуск): код приложения читается с диска"""
+    from main import app
+
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    return serve_worker(app, socket.socket(fileno=fd), ready_fd)
+
+
+async def prepare_database():
+    """Один раз до запуска воркера: схема и режим WAL"""
+    database.SQLITE_JOURNAL_MODE = database.SQLITE_JOURNAL_MODE or "WAL"
+    await database.init_database()
+
+
+class Launcher:
+    """
+    Мастер-процесс с одним воркером. Воркер один намеренно: резервы
+    остатков (inventory.py) и талоны очереди оформления (admission.py)
+    живут в памяти процесса, и несколько процессов продавали бы каждый
+    по своим счётчикам. Масштабирование на несколько ядер — только после
+    переноса этого состояния в SQLite.
+
+    Мастер импортирует приложение и готовит БД до fork, поэтому воркер
+    после падения поднимается сразу. Сокет держит мастер: пока воркер
+    перезапускается, соединения ждут в очереди сокета, а не получают
+    отказ. Упавший воркер перезапускается (быстро падающий — с растущей
+    паузой). SIGHUP — плавный перезапуск: воркер завершает запросы в
+    работе, новый запускается через exec с кодом с диска; если новый код
+    не поднялся, воркер запускается на прежнем. SIGTERM/SIGINT — остановка.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8000):
+        self.host = host
+        self.port = port
+        self.app = None
+        self.sock: Optional[socket.socket] = None
+        self.worker: Optional[Worker] = None
+        self.restart_at: Optional[float] = None
+        self.restart_delay = 0.0
+        self.fresh_code = False      # после плавного перезапуска воркер запускается через exec
+        self.stopping = False
+        self.reload_requested = False
+
+    # ─── Запуск ───
+
+    def run(self) -> int:
+        self.preload()
+        self.sock = bind_socket(self.host, self.port)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        print(f"🚀 Мастер {os.getpid()}: http://{self.host}:{self.port}")
+        self.spawn()
+        try:
+            while not self.stopping:
+                if self.reload_requested:
+                    self.reload_requested = False
+                    self.restart()
+                self._tick()
+                time.sleep(SUPERVISE_INTERVAL)
+        finally:
+            self.shutdown()
+        return 0
+
+    def preload(self):
+        from main import app
+
+        asyncio.run(prepare_database())
+        # Стек middleware строится при первом запросе — пусть один раз, до fork
+        app.middleware_stack = app.build_middleware_stack()
+        gc.collect()
+        gc.freeze()
+        self.app = app
+
+    # ─── Воркер ───
+
+    def spawn(self):
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.close(ready_r)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                if self.fresh_code:
+                    os.set_inheritable(ready_w, True)
+                    os.execv(sys.executable, [
+                        sys.executable, os.path.join(APP_DIR, "manage.py"), "--db", database.DATABASE_PATH,
+                        "serve", "--worker-fd", str(self.sock.fileno()), "--ready-fd", str(ready_w),
+                    ])
+                code = serve_worker(self.app, self.sock, ready_w)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+
+        os.close(ready_w)
+        self.worker = Worker(pid, ready_r)
+        self.restart_at = None
+
+    def _tick(self):
+        self._reap()
+        self._check_ready()
+        if self.restart_at is not None and self.restart_at <= time.monotonic() and not self.stopping:
+            self.spawn()
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.worker
+            if worker is None or worker.pid != pid:
+                continue
+            self.worker = None
+            self._close_ready(worker)
+            if worker.retiring or self.stopping:
+                continue
+
+            uptime = time.monotonic() - worker.started
+            delay = 0.0
+            if uptime < WORKER_MIN_UPTIME:
+                delay = min(max(1.0, self.restart_delay * 2), WORKER_RESTART_DELAY_MAX)
+            self.restart_delay = delay
+            self.restart_at = time.monotonic() + delay
+            print(f"⚠️ Воркер (pid {pid}) завершился с кодом {os.waitstatus_to_exitcode(status)}, "
+                  f"перезапуск через {delay:.0f} с")
+
+    def _check_ready(self):
+        worker = self.worker
+        if worker is None or worker.ready_fd is None:
+            return
+        readable, _, _ = select.select([worker.ready_fd], [], [], 0)
+        if readable:
+            if os.read(worker.ready_fd, 1):
+                worker.ready = True
+                print(f"✅ Воркер (pid {worker.pid}) готов")
+            self._close_ready(worker)
+
+    @staticmethod
+    def _close_ready(worker: Worker):
+        if worker.ready_fd is not None:
+            os.close(worker.ready_fd)
+            worker.ready_fd = None
+
+    def _wait(self, done: Callable[[], bool], timeout: float) -> bool:
+        """Ждёт условия, продолжая надзор за воркером"""
+        deadline = time.monotonic() + timeout
+        while not self.stopping:
+            self._tick()
+            if done():
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(SUPERVISE_INTERVAL / 2)
+        return False
+
+    def stop_worker(self, worker: Worker):
+        worker.retiring = True
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        if not self._wait(lambda: self.worker is not worker, WORKER_GRACEFUL_TIMEOUT + WORKER_KILL_GRACE) \
+                and not self.stopping:
+            print(f"⚠️ Воркер (pid {worker.pid}) не завершился, SIGKILL")
+            os.kill(worker.pid, signal.SIGKILL)
+            self._wait(lambda: self.worker is not worker, WORKER_KILL_GRACE)
+
+    # ─── Плавный перезапуск и остановка ───
+
+    def restart(self):
+        print("🔄 Плавный перезапуск воркера")
+        if self.worker is not None:
+            # Старый воркер завершается до запуска нового: остатки в памяти не должны быть у двух процессов сразу
+            self.stop_worker(self.worker)
+        if self.stopping:
+            return
+        self.fresh_code = True
+        self.spawn()
+        new = self.worker
+        if self._wait(lambda: new.ready or self.worker is not new, WORKER_START_TIMEOUT) and new.ready:
+            print("✅ Воркер перезапущен с новым кодом")
+            return
+
+        print("⚠️ Новый код не запустился — воркер запускается на прежнем")
+        if self.worker is new:
+            self.stop_worker(new)
+        self.fresh_code = False
+        if not self.stopping:
+            self.spawn()
+
+    def shutdown(self):
+        self.stopping = True
+        worker = self.worker
+        if worker is not None:
+            worker.retiring = True
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            deadline = time.monotonic() + WORKER_GRACEFUL_TIMEOUT + WORKER_KILL_GRACE
+            while self.worker is not None and time.monotonic() < deadline:
+                self._reap()
+                time.sleep(SUPERVISE_INTERVAL / 2)
+            if self.worker is not None:
+                print(f"⚠️ Воркер (pid {worker.pid}) не завершился, SIGKILL")
+                os.kill(worker.pid, signal.SIGKILL)
+                os.waitpid(worker.pid, 0)
+        if self.sock is not None:
+            self.sock.close()
+        print("👋 Мастер остановлен")
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def _on_reload(self, signum, frame):
+        self.reload_requested = True
@@ -0,0 +1,295 @@
+"""
+Нагрузочное тестирование: сценарии пользователей против main:app
+"""
+
+import asyncio
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+LOADTEST_CONCURRENCY = 20
+LOADTEST_DURATION = 30.0          # секунд
+LOADTEST_WARMUP = 3.0             # запросы первых секунд не попадают в статистику
+LOADTEST_USER_POOL = 1000         # user0..userN-1@loadtest.local из generate-data
+LOADTEST_PASSWORD = "loadtest"
+ADMIN_EMAIL = "admin@shop.com"
+ADMIN_PASSWORD = "admin123"
+
+# Доли сценариев среди виртуальных пользователей
+JOURNEY_WEIGHTS = {
+    "browse": 60,
+    "shop": 30,
+    "admin": 10,
+}
+
+PRODUCT_LINK = re.compile(r'href="/product/(\d+)"')
+CATEGORY_LINK = re.compile(r'href="/catalog\?category=(\d+)"')
+CATALOG_SORTS = ["popular", "price_asc", "price_desc", "new", "rating"]
+SEARCH_TERMS = ["смартфон", "куртка", "nova", "набор", "лампа", "iphone"]
+
+
+class Recorder:
+    """Время ответов по маршрутам; маршрут — шаблон пути, а не конкретный URL"""
+
+    def __init__(self, warmup_until: float):
+        self.warmup_until = warmup_until
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.started = None
+        self.finished = None
+
+    def record(self, route: str, seconds: float, ok: bool):
+        now = time.monotonic()
+        if now < self.warmup_until:
+            return
+        if self.started is None:
+            self.started = now
+        self.finished = now
+        self.samples.setdefault(route, []).append(seconds)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self) -> Dict:
+        elapsed = (self.finished - self.started) if self.started is not None else 0.0
+        routes = {route: summarize(samples, self.errors.get(route, 0), elapsed)
+                  for route, samples in sorted(self.samples.items())}
+        everything = [s for samples in self.samples.values() for s in samples]
+        return {
+            "seconds": round(elapsed, 3),
+            "total": summarize(everything, sum(self.errors.values()), elapsed),
+            "routes": routes,
+        }
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """Nearest-rank перцентиль отсортированного списка"""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples: List[float], errors: int, elapsed: float) -> Dict:
+    ordered = sorted(samples)
+    ms = lambda s: round(s * 1000, 2)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+class VirtualUser:
+    """Один клиент со своей сессией (cookie), выполняющий сценарии по кругу"""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, rng: random.Random, user_pool: int):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.user_pool = user_pool
+        self.products: List[str] = []
+        self.categories: List[str] = []
+
+    async def request(self, route: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(route, time.perf_counter() - started, False)
+            return None
+        self.recorder.record(route, time.perf_counter() - started, response.status_code < 400)
+        return response
+
+    def remember_links(self, response: Optional[httpx.Response]):
+        if response is None:
+            return
+        self.products = PRODUCT_LINK.findall(response.text) or self.products
+        self.categories = CATEGORY_LINK.findall(response.text) or self.categories
+
+    async def login(self, email: str, password: str) -> bool:
+        response = await self.request("POST /login", "POST", "/login",
+                                      data={"email": email, "password": password})
+        return response is not None and response.status_code == 302
+
+    # ─── Сценарии ───
+
+    async def browse(self):
+        """Главная → каталог → категория с сортировкой → поиск → карточки товаров"""
+        self.remember_links(await self.request("GET /", "GET", "/"))
+        self.remember_links(await self.request("GET /catalog", "GET", "/catalog"))
+        if self.categories:
+            params = {"category": self.rng.choice(self.categories), "sort": self.rng.choice(CATALOG_SORTS)}
+            self.remember_links(await self.request("GET /catalog?category", "GET", "/catalog", params=params))
+        self.remember_links(await self.request("GET /catalog?q", "GET", "/catalog",
+                                               params={"q": self.rng.choice(SEARCH_TERMS)}))
+        for product_id in self.rng.sample(self.products, min(3, len(self.products))):
+            await self.request("GET /product/{id}", "GET", f"/product/{product_id}")
+
+    async def shop(self):
+        """Просмотр → вход → корзина → оформление заказа → мои заказы"""
+        self.remember_links(await self.request("GET /catalog", "GET", "/catalog"))
+        if not self.products:
+            return
+
+        email = f"user{self.rng.randrange(self.user_pool)}@loadtest.local"
+        if not await self.login(email, LOADTEST_PASSWORD):
+            # В БД без generate-data заводим пользователя сами
+            email = f"lt-{uuid.uuid4().hex[:12]}@loadtest.local"
+            await self.request("POST /register", "POST", "/register",
+                               data={"name": "Нагрузка", "email": email, "password": LOADTEST_PASSWORD})
+
+        for product_id in self.rng.sample(self.products, min(self.rng.randint(1, 3), len(self.products))):
+            await self.request("GET /product/{id}", "GET", f"/product/{product_id}")
+            await self.request("POST /api/cart/add", "POST", "/api/cart/add",
+                               json={"product_id": int(product_id), "quantity": 1})
+        await self.request("GET /cart", "GET", "/cart")
+        await self.request("GET /checkout", "GET", "/checkout")
+        await self.request("POST /checkout", "POST", "/checkout", data={
+            "name": "Нагрузка", "email": email, "phone": "+7 900 000-00-00", "address": "г. Москва",
+        })
+        await self.request("GET /orders", "GET", "/orders")
+        await self.request("GET /logout", "GET", "/logout")
+
+    async def admin(self):
+        """Админ-панель: дашборд, списки, график"""
+        await self.login(ADMIN_EMAIL, ADMIN_PASSWORD)
+        await self.request("GET /admin", "GET", "/admin")
+        await self.request("GET /admin/orders", "GET", "/admin/orders",
+                           params={"status": self.rng.choice(["", "pending", "delivered"])})
+        await self.request("GET /admin/products", "GET", "/admin/products")
+        await self.request("GET /admin/users", "GET", "/admin/users")
+        await self.request("GET /api/admin/rollups", "GET", "/api/admin/rollups", params={"days": 90})
+        await self.request("GET /logout", "GET", "/logout")
+
+    async def run(self, deadline: float):
+        journeys = list(JOURNEY_WEIGHTS)
+        weights = list(JOURNEY_WEIGHTS.values())
+        while time.monotonic() < deadline:
+            journey = self.rng.choices(journeys, weights)[0]
+            await getattr(self, journey)()
+
+
+async def run_load(client_factory, concurrency: int = LOADTEST_CONCURRENCY,
+                   duration: float = LOADTEST_DURATION, warmup: float = LOADTEST_WARMUP,
+                   seed: int = 1, user_pool: int = LOADTEST_USER_POOL) -> Dict:
+    """Запускает concurrency виртуальных пользователей на duration секунд"""
+    now = time.monotonic()
+    recorder = Recorder(now + warmup)
+    clients = [client_factory() for _ in range(concurrency)]
+    users = [VirtualUser(client, recorder, random.Random(f"{seed}:{i}"), user_pool)
+             for i, client in enumerate(clients)]
+    try:
+        await asyncio.gather(*(user.run(now + warmup + duration) for user in users))
+    finally:
+        for client in clients:
+            await client.aclose()
+    return recorder.report()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def asgi_clients():
+    """Фабрика клиентов к main:app в процессе через ASGI-транспорт — без сети и сериализации HTTP"""
+    from main import app
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        yield lambda **kwargs: httpx.AsyncClient(transport=transport, base_url="http://loadtest", **kwargs)
+    finally:
+        await app.router.shutdown()
+
+
+@asynccontextmanager
+async def http_clients(url: str = None):
+    """Фабрика клиентов через сокет: по url или к uvicorn, поднятому в этом же процессе"""
+    server = None
+    if url is None:
+        import uvicorn
+
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config("main:app", host="127.0.0.1", port=port, log_level="warning"))
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            if serving.done():
+                serving.result()
+            await asyncio.sleep(0.05)
+        url = f"http://127.0.0.1:{port}"
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    try:
+        yield lambda **kwargs: httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0, **kwargs)
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await serving
+
+
+async def run_asgi(**options) -> Dict:
+    async with asgi_clients() as client_factory:
+        return await run_load(client_factory, **options)
+
+
+async def run_http(url: str = None, **options) -> Dict:
+    async with http_clients(url) as client_factory:
+        return await run_load(client_factory, **options)
+
+
+async def run(mode: str = "asgi", url: str = None, **options) -> Dict:
+    """Результат прогона в JSON-совместимом виде, с метаданными для сравнения коммитов"""
+    if mode == "asgi":
+        result = await run_asgi(**options)
+    elif mode == "http":
+        result = await run_http(url, **options)
+    else:
+        raise ValueError(f"Режим: asgi или http, получено {mode!r}")
+
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "mode": mode,
+        "options": options,
+        **result,
+    }
+
+
+def compare_reports(baseline: Dict, current: Dict) -> List[str]:
+    """Строки сравнения p50/p95/p99 и RPS по маршрутам с прошлым прогоном"""
+    def delta(old, new):
+        return f"{(new - old) / old * 100:+.0f}%" if old else "—"
+
+    lines = [f"{'маршрут':<28} {'rps':>14} {'p50, мс':>16} {'p95, мс':>16} {'p99, мс':>16}"]
+    routes = {"total": (baseline["total"], current["total"])}
+    routes.update((route, (baseline["routes"][route], stats))
+                  for route, stats in current["routes"].items() if route in baseline["routes"])
+    for route, (old, new) in routes.items():
+        cells = [f"{new[key]:>8} {delta(old[key], new[key]):>6}" for key in ("rps", "p50_ms", "p95_ms", "p99_ms")]
+        lines.append(f"{route:<28} " + " ".join(f"{c:>16}" for c in cells))
+    return lines
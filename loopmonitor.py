@@ -0,0 +1,134 @@
+"""
+Задержка event loop и поиск кода, который блокирует его синхронной работой
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, Optional
+
+from metrics import metrics_registry, loop_lag, loop_lag_quantiles, loop_blocks
+from stacks import app_frames, format_frame
+
+LOOP_MONITOR_INTERVAL = 0.05     # период пробуждения контрольной задачи и проверки сторожевого потока
+LOOP_BLOCK_THRESHOLD = float(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", "100")) / 1000
+LOOP_LAG_WINDOW = 1200           # замеров для перцентилей (~1 минута)
+LOOP_BLOCKS_RECENT = 50
+LOOP_LAG_QUANTILES = (0.5, 0.95, 0.99)
+LOOP_BLOCK_STACK_DEPTH = 12
+
+
+class LoopMonitor:
+    """
+    Контрольная задача просыпается каждые interval секунд и меряет, насколько
+    опоздала: это задержка event loop. Сторожевой поток следит за её
+    пульсом: если пульса нет дольше threshold, loop занят синхронным кодом —
+    поток снимает стек потока loop в этот момент. Когда loop освобождается,
+    задача дописывает длительность блокировки и публикует событие.
+    """
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples: deque = deque(maxlen=LOOP_LAG_WINDOW)
+        self.blocks: deque = deque(maxlen=LOOP_BLOCKS_RECENT)
+
+        self._beat = time.monotonic()
+        self._blocked: Optional[Dict] = None     # пишет сторожевой поток, забирает задача
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        metrics_registry.collector(self.collect)
+
+    # ─── Жизненный цикл ───
+
+    async def start(self):
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._stopping.set()
+        if self._watchdog:
+            self._watchdog.join(timeout=1.0)
+            self._watchdog = None
+
+    async def _run(self):
+        while True:
+            beat = self._beat
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self._beat = time.monotonic()
+            self.samples.append(lag)
+            loop_lag.observe(lag)
+
+            blocked, self._blocked = self._blocked, None
+            # Стек снят во время этого сна, а не сразу после предыдущего пробуждения
+            if blocked is not None and blocked.pop("beat") == beat:
+                blocked["ms"] = round(lag * 1000, 1)
+                self.blocks.append(blocked)
+                loop_blocks.inc(blocked["function"])
+                print(f"⚠️ Event loop заблокирован на {blocked['ms']} мс: {blocked['function']}")
+
+    def _watch(self):
+        """Сторожевой поток: стек потока loop, если тот не отвечает дольше threshold"""
+        while not self._stopping.wait(self.interval):
+            beat = self._beat
+            if self._blocked is not None or time.monotonic() - beat < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            frames = app_frames(stack) or list(stack)
+            innermost = frames[-1]
+            self._blocked = {
+                "beat": beat,
+                "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "function": f"{os.path.basename(innermost.filename)}:{innermost.name}",
+                # Где именно крутится loop (может быть библиотечный код под функцией приложения)
+                "top": f"{os.path.basename(stack[-1].filename)}:{stack[-1].lineno} {stack[-1].name}",
+                "stack": [format_frame(f) for f in frames[-LOOP_BLOCK_STACK_DEPTH:]],
+            }
+
+    # ─── Отчёт ───
+
+    def lag_quantiles(self) -> Dict[float, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in LOOP_LAG_QUANTILES}
+
+    def collect(self):
+        for q, lag in self.lag_quantiles().items():
+            loop_lag_quantiles.set(lag, str(q))
+
+    def caches(self) -> Dict[str, object]:
+        return {"loop_monitor.samples": self.samples, "loop_monitor.blocks": self.blocks}
+
+    def report(self) -> Dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "lag_ms": {f"p{int(q * 100)}": round(lag * 1000, 2) for q, lag in self.lag_quantiles().items()},
+            "lag_max_ms": round(max(self.samples, default=0.0) * 1000, 2),
+            "blocks": list(reversed(self.blocks)),
+        }
+
+
+loop_monitor = LoopMonitor()
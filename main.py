@@ -1,14 +1,53 @@
 
 
-from fastapi import FastAPI, Request, Form, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, Form, HTTPException, UploadFile, File
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, Response
 from starlette.middleware.sessions import SessionMiddleware
 from typing import Optional
+from datetime import datetime, timedelta, timezone
+import csv
+import html
+import io
+import json
+import math
+import os
+import secrets
+from urllib.parse import urlencode
 import uvicorn
 from database import *
+from inventory import inventory, InsufficientStock
+from admission import checkout_admission, AdmissionRejected
+from jobs import job_queue
+from notifications import notification_dispatcher
+from importer import import_products, detect_format
+from capture import traffic_log, TrafficCaptureMiddleware, CAPTURE_PATH
+from querystats import query_stats
+from timing import JSONResponse, ServerTimingMiddleware, timed
+from nplusone import QueryCounterMiddleware
+from loopmonitor import loop_monitor
+from profiler import stack_sampler, ProfilerBusy
+from tracing import tracer, TracingMiddleware
+from accesslog import access_log, AccessLogMiddleware, ACCESS_LOG
+from memprofile import memory_tracker, rss_bytes, MEMORY_GROUPS, MEMORY_TRACE_FRAMES
+from metrics import (
+    metrics_registry, MetricsMiddleware, METRICS_TOKEN, METRICS_PUBLIC, METRICS_CONTENT_TYPE,
+    db_queries, db_query_seconds, db_connections_open, db_connections, cache_requests, cache_entries,
+    process_resident_memory, access_log_records,
+    orders_created, cart_adds, checkout_active, checkout_waiting
+)
+
+SESSION_SECRET_KEY = "supersecretkey123shopmax"
 
 app = FastAPI(title="🛒 ShopMax - Маркетплейс")
-app.add_middleware(SessionMiddleware, secret_key="supersecretkey123shopmax")
+# Добавленная раньше middleware оказывается внутри: запись трафика видит сессию (user_id)
+if CAPTURE_PATH:
+    app.add_middleware(TrafficCaptureMiddleware)
+app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET_KEY)
+app.add_middleware(QueryCounterMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(AccessLogMiddleware)
+app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(TracingMiddleware)
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -18,6 +57,48 @@ app.add_middleware(SessionMiddleware, secret_key="supersecretkey123shopmax")
 @app.on_event("startup")
 async def startup():
     await init_database()
+    await inventory.start()
+    await job_queue.start()
+    await job_queue.ensure_scheduled("reconcile_stats", STATS_RECONCILE_INTERVAL)
+    await notification_dispatcher.start()
+    await metrics_registry.start()
+    await loop_monitor.start()
+    await tracer.start()
+    await access_log.start()
+    await query_stats.log.start()
+    await traffic_log.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await traffic_log.stop()
+    await query_stats.log.stop()
+    await access_log.stop()
+    await tracer.stop()
+    await loop_monitor.stop()
+    await metrics_registry.stop()
+    await notification_dispatcher.stop()
+    await job_queue.stop()
+    await inventory.stop()
+
+
+# ═══════════════════════════════════════════════════════════════
+# ФОНОВЫЕ ЗАДАЧИ
+# ═══════════════════════════════════════════════════════════════
+
+STATS_RECONCILE_INTERVAL = 3600
+
+
+@job_queue.handler("reconcile_stats")
+async def job_reconcile_stats(payload: dict):
+    # Счётчики ведут триггеры; сверка страхует от ручных правок БД
+    await reconcile_stats()
+    await job_queue.enqueue("reconcile_stats", delay=STATS_RECONCILE_INTERVAL)
+
+
+@job_queue.handler("update_user_contacts")
+async def job_update_user_contacts(payload: dict):
+    await update_user(payload['user_id'], phone=payload['phone'], address=payload['address'])
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -43,6 +124,7 @@ def format_price(price: float) -> str:
 # HTML ШАБЛОН
 # ═══════════════════════════════════════════════════════════════
 
+@timed("render")
 def base_template(content: str, title: str, request: Request, user: dict = None,
                   cart_count: int = 0, favorites_count: int = 0) -> str:
     return f"""
@@ -1076,22 +1158,50 @@ def base_template(content: str, title: str, request: Request, user: dict = None,
 # ГЛАВНАЯ СТРАНИЦА
 # ═══════════════════════════════════════════════════════════════
 
-@app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
-    user = await get_current_user(request)
-    user_id = get_user_id(request)
+def product_card(p: dict, favorites=()) -> str:
+    """Карточка товара в сетке; favorites — id товаров в избранном пользователя"""
+    discount = ""
+    if p.get('old_price') and p['old_price'] > p['price']:
+        percent = int((1 - p['price'] / p['old_price']) * 100)
+        discount = f'<span class="product-badge">-{percent}%</span>'
 
-    cart_count = await get_cart_count(user_id) if user_id else 0
-    favorites_count = await get_favorites_count(user_id) if user_id else 0
+    is_fav = p['id'] in favorites
+    fav_class = 'active' if is_fav else ''
+    fav_icon = '❤️' if is_fav else '🤍'
+    stars = '⭐' * int(p.get('rating', 0))
 
-    categories = await get_categories()
-    featured = await get_featured_products(8)
+    return f"""
+    <div class="product-card">
+        <div class="product-image">
+            {discount}
+            <button class="product-favorite {fav_class}" onclick="toggleFavorite({p['id']}, this)">
+                {fav_icon}
+            </button>
+            {p.get('image', '📦')}
+        </div>
+        <div class="product-info">
+            <div class="product-category">{p.get('category_name', '')}</div>
+            <h3 class="product-title">
+                <a href="/product/{p['id']}">{p['name']}</a>
+            </h3>
+            <div class="product-rating">
+                <span class="stars">{stars}</span>
+                <span>({p.get('reviews_count', 0)})</span>
+            </div>
+            <div class="product-price">
+                <span class="price-current">{format_price(p['price'])}</span>
+                {f'<span class="price-old">{format_price(p["old_price"])}</span>' if p.get('old_price') else ''}
+            </div>
+            <button class="btn btn-primary btn-block" onclick="addToCart({p['id']})">
+                🛒 В корзину
+            </button>
+        </div>
+    </div>
+    """
 
-    user_favorites = []
-    if user_id:
-        favs = await get_favorites(user_id)
-        user_favorites = [f['product_id'] for f in favs]
 
+@timed("render")
+def render_home(categories: list, featured: list, favorites=()) -> str:
     categories_html = "".join(f"""
         <a href="/catalog?category={c['id']}" class="category-card">
             <div class="icon">{c['icon']}</div>
@@ -1100,49 +1210,9 @@ async def home(request: Request):
         </a>
     """ for c in categories)
 
-    def product_card(p):
-        discount = ""
-        if p.get('old_price') and p['old_price'] > p['price']:
-            percent = int((1 - p['price'] / p['old_price']) * 100)
-            discount = f'<span class="product-badge">-{percent}%</span>'
-
-        is_fav = p['id'] in user_favorites
-        fav_class = 'active' if is_fav else ''
-        fav_icon = '❤️' if is_fav else '🤍'
-        stars = '⭐' * int(p.get('rating', 0))
-
-        return f"""
-        <div class="product-card">
-            <div class="product-image">
-                {discount}
-                <button class="product-favorite {fav_class}" onclick="toggleFavorite({p['id']}, this)">
-                    {fav_icon}
-                </button>
-                {p.get('image', '📦')}
-            </div>
-            <div class="product-info">
-                <div class="product-category">{p.get('category_name', '')}</div>
-                <h3 class="product-title">
-                    <a href="/product/{p['id']}">{p['name']}</a>
-                </h3>
-                <div class="product-rating">
-                    <span class="stars">{stars}</span>
-                    <span>({p.get('reviews_count', 0)})</span>
-                </div>
-                <div class="product-price">
-                    <span class="price-current">{format_price(p['price'])}</span>
-                    {f'<span class="price-old">{format_price(p["old_price"])}</span>' if p.get('old_price') else ''}
-                </div>
-                <button class="btn btn-primary btn-block" onclick="addToCart({p['id']})">
-                    🛒 В корзину
-                </button>
-            </div>
-        </div>
-        """
-
-    products_html = "".join(product_card(p) for p in featured)
+    products_html = "".join(product_card(p, favorites) for p in featured)
 
-    content = f"""
+    return f"""
     <div class="hero">
         <div class="hero-content">
             <h1>Летняя распродажа!</h1>
@@ -1175,22 +1245,9 @@ async def home(request: Request):
     </section>
     """
 
-    return HTMLResponse(base_template(content, "Главная", request, user, cart_count, favorites_count))
-
-
-# ═══════════════════════════════════════════════════════════════
-# КАТАЛОГ
-# ═══════════════════════════════════════════════════════════════
 
-@app.get("/catalog", response_class=HTMLResponse)
-async def catalog(
-        request: Request,
-        category: int = None,
-        sort: str = "popular",
-        min_price: float = None,
-        max_price: float = None,
-        q: str = None
-):
+@app.get("/", response_class=HTMLResponse)
+async def home(request: Request):
     user = await get_current_user(request)
     user_id = get_user_id(request)
 
@@ -1198,23 +1255,26 @@ async def catalog(
     favorites_count = await get_favorites_count(user_id) if user_id else 0
 
     categories = await get_categories()
-    current_category = None
-    if category:
-        current_category = await get_category_by_id(category)
-
-    products = await get_products(
-        category_id=category,
-        search=q,
-        min_price=min_price,
-        max_price=max_price,
-        sort=sort
-    )
+    featured = await get_featured_products(8)
 
-    user_favorites = []
+    user_favorites = set()
     if user_id:
         favs = await get_favorites(user_id)
-        user_favorites = [f['product_id'] for f in favs]
+        user_favorites = {f['product_id'] for f in favs}
 
+    content = render_home(categories, featured, user_favorites)
+
+    return HTMLResponse(base_template(content, "Главная", request, user, cart_count, favorites_count))
+
+
+# ═══════════════════════════════════════════════════════════════
+# КАТАЛОГ
+# ═══════════════════════════════════════════════════════════════
+
+@timed("render")
+def render_catalog(categories: list, products: list, favorites=(), current_category: dict = None,
+                   category: int = None, sort: str = "popular", min_price: float = None,
+                   max_price: float = None) -> str:
     categories_html = "".join(f"""
         <a href="/catalog?category={c['id']}" style="display: flex; justify-content: space-between; padding: 10px 0; text-decoration: none; color: {'var(--primary); font-weight: 600' if category == c['id'] else 'var(--dark)'};">
             <span>{c['icon']} {c['name']}</span>
@@ -1222,47 +1282,7 @@ async def catalog(
         </a>
     """ for c in categories)
 
-    def product_card(p):
-        discount = ""
-        if p.get('old_price') and p['old_price'] > p['price']:
-            percent = int((1 - p['price'] / p['old_price']) * 100)
-            discount = f'<span class="product-badge">-{percent}%</span>'
-
-        is_fav = p['id'] in user_favorites
-        fav_class = 'active' if is_fav else ''
-        fav_icon = '❤️' if is_fav else '🤍'
-        stars = '⭐' * int(p.get('rating', 0))
-
-        return f"""
-        <div class="product-card">
-            <div class="product-image">
-                {discount}
-                <button class="product-favorite {fav_class}" onclick="toggleFavorite({p['id']}, this)">
-                    {fav_icon}
-                </button>
-                {p.get('image', '📦')}
-            </div>
-            <div class="product-info">
-                <div class="product-category">{p.get('category_name', '')}</div>
-                <h3 class="product-title">
-                    <a href="/product/{p['id']}">{p['name']}</a>
-                </h3>
-                <div class="product-rating">
-                    <span class="stars">{stars}</span>
-                    <span>({p.get('reviews_count', 0)})</span>
-                </div>
-                <div class="product-price">
-                    <span class="price-current">{format_price(p['price'])}</span>
-                    {f'<span class="price-old">{format_price(p["old_price"])}</span>' if p.get('old_price') else ''}
-                </div>
-                <button class="btn btn-primary btn-block" onclick="addToCart({p['id']})">
-                    🛒 В корзину
-                </button>
-            </div>
-        </div>
-        """
-
-    products_html = "".join(product_card(p) for p in products) if products else """
+    products_html = "".join(product_card(p, favorites) for p in products) if products else """
         <div class="empty-state" style="grid-column: 1/-1;">
             <div class="icon">🔍</div>
             <h3>Товары не найдены</h3>
@@ -1270,7 +1290,7 @@ async def catalog(
         </div>
     """
 
-    content = f"""
+    return f"""
         <div class="breadcrumb">
             <a href="/">Главная</a> <span>/</span>
             <a href="/catalog">Каталог</a>
@@ -1332,31 +1352,54 @@ async def catalog(
         </div>
         """
 
-    return HTMLResponse(
-        base_template(content, current_category['name'] if current_category else "Каталог", request, user, cart_count,
-                      favorites_count))
-
-
-# ═══════════════════════════════════════════════════════════════
-# СТРАНИЦА ТОВАРА
-# ═══════════════════════════════════════════════════════════════
 
-@app.get("/product/{product_id}", response_class=HTMLResponse)
-async def product_detail(request: Request, product_id: int):
+@app.get("/catalog", response_class=HTMLResponse)
+async def catalog(
+        request: Request,
+        category: int = None,
+        sort: str = "popular",
+        min_price: float = None,
+        max_price: float = None,
+        q: str = None
+):
     user = await get_current_user(request)
     user_id = get_user_id(request)
 
     cart_count = await get_cart_count(user_id) if user_id else 0
     favorites_count = await get_favorites_count(user_id) if user_id else 0
 
-    product = await get_product_by_id(product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Товар не найден")
+    categories = await get_categories()
+    current_category = None
+    if category:
+        current_category = await get_category_by_id(category)
 
-    is_fav = False
+    products = await get_products(
+        category_id=category,
+        search=q,
+        min_price=min_price,
+        max_price=max_price,
+        sort=sort
+    )
+
+    user_favorites = set()
     if user_id:
-        is_fav = await is_favorite(user_id, product['id'])
+        favs = await get_favorites(user_id)
+        user_favorites = {f['product_id'] for f in favs}
+
+    content = render_catalog(categories, products, user_favorites, current_category,
+                             category, sort, min_price, max_price)
+
+    return HTMLResponse(
+        base_template(content, current_category['name'] if current_category else "Каталог", request, user, cart_count,
+                      favorites_count))
+
+
+# ═══════════════════════════════════════════════════════════════
+# СТРАНИЦА ТОВАРА
+# ═══════════════════════════════════════════════════════════════
 
+@timed("render")
+def render_product(product: dict, category: dict = None, is_fav: bool = False) -> str:
     # Статус остатка
     if product['stock'] > 10:
         stock_html = '<div class="product-stock stock-in">✅ В наличии</div>'
@@ -1367,9 +1410,7 @@ async def product_detail(request: Request, product_id: int):
 
     stars = '⭐' * int(product.get('rating', 0))
 
-    category = await get_category_by_id(product['category_id']) if product.get('category_id') else None
-
-    content = f"""
+    return f"""
         <div class="breadcrumb">
             <a href="/">Главная</a> <span>/</span>
             <a href="/catalog">Каталог</a> <span>/</span>
@@ -1433,6 +1474,32 @@ async def product_detail(request: Request, product_id: int):
         </div>
         """
 
+
+@app.get("/product/{product_id}", response_class=HTMLResponse)
+async def product_detail(request: Request, product_id: int):
+    user = await get_current_user(request)
+    user_id = get_user_id(request)
+
+    cart_count = await get_cart_count(user_id) if user_id else 0
+    favorites_count = await get_favorites_count(user_id) if user_id else 0
+
+    product = await get_product_by_id(product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Товар не найден")
+
+    is_fav = False
+    if user_id:
+        is_fav = await is_favorite(user_id, product['id'])
+
+    # Остаток с учётом резервов берём из складского сервиса; None — товар удалён параллельно
+    available = await inventory.get_available(product['id'])
+    if available is not None:
+        product['stock'] = available
+
+    category = await get_category_by_id(product['category_id']) if product.get('category_id') else None
+
+    content = render_product(product, category, is_fav)
+
     return HTMLResponse(base_template(content, product['name'], request, user, cart_count, favorites_count))
 
 
@@ -1440,20 +1507,10 @@ async def product_detail(request: Request, product_id: int):
 # КОРЗИНА
 # ═══════════════════════════════════════════════════════════════
 
-@app.get("/cart", response_class=HTMLResponse)
-async def cart_page(request: Request):
-    user = await get_current_user(request)
-    user_id = get_user_id(request)
-
-    if not user_id:
-        return RedirectResponse("/login?next=/cart", status_code=302)
-
-    cart = await get_cart(user_id)
-    cart_count = sum(item['quantity'] for item in cart)
-    favorites_count = await get_favorites_count(user_id)
-
+@timed("render")
+def render_cart(cart: list) -> str:
     if not cart:
-        content = """
+        return """
             <div class="page-header">
                 <h1 class="page-title">🛒 Корзина</h1>
             </div>
@@ -1466,8 +1523,8 @@ async def cart_page(request: Request):
                 </div>
             </div>
             """
-        return HTMLResponse(base_template(content, "Корзина", request, user, 0, favorites_count))
 
+    cart_count = sum(item['quantity'] for item in cart)
     subtotal = sum(item['price'] * item['quantity'] for item in cart)
     delivery = 0 if subtotal >= 5000 else 299
     total = subtotal + delivery
@@ -1500,7 +1557,7 @@ async def cart_page(request: Request):
             </div>
             """
 
-    content = f"""
+    return f"""
         <div class="page-header">
             <h1 class="page-title">🛒 Корзина</h1>
             <p class="page-subtitle">{cart_count} товаров</p>
@@ -1544,26 +1601,32 @@ async def cart_page(request: Request):
         </div>
         """
 
-    return HTMLResponse(base_template(content, "Корзина", request, user, cart_count, favorites_count))
-
-
-# ═══════════════════════════════════════════════════════════════
-# ИЗБРАННОЕ
-# ═══════════════════════════════════════════════════════════════
 
-@app.get("/favorites", response_class=HTMLResponse)
-async def favorites_page(request: Request):
+@app.get("/cart", response_class=HTMLResponse)
+async def cart_page(request: Request):
     user = await get_current_user(request)
     user_id = get_user_id(request)
 
     if not user_id:
-        return RedirectResponse("/login?next=/favorites", status_code=302)
+        return RedirectResponse("/login?next=/cart", status_code=302)
 
-    favorites = await get_favorites(user_id)
-    cart_count = await get_cart_count(user_id)
+    cart = await get_cart(user_id)
+    cart_count = sum(item['quantity'] for item in cart)
+    favorites_count = await get_favorites_count(user_id)
+
+    content = render_cart(cart)
+
+    return HTMLResponse(base_template(content, "Корзина", request, user, cart_count, favorites_count))
+
+
+# ═══════════════════════════════════════════════════════════════
+# ИЗБРАННОЕ
+# ═══════════════════════════════════════════════════════════════
 
+@timed("render")
+def render_favorites(favorites: list) -> str:
     if not favorites:
-        content = """
+        return """
             <div class="page-header">
                 <h1 class="page-title">❤️ Избранное</h1>
             </div>
@@ -1576,7 +1639,6 @@ async def favorites_page(request: Request):
                 </div>
             </div>
             """
-        return HTMLResponse(base_template(content, "Избранное", request, user, cart_count, 0))
 
     products_html = ""
     for item in favorites:
@@ -1607,7 +1669,7 @@ async def favorites_page(request: Request):
             </div>
             """
 
-    content = f"""
+    return f"""
         <div class="page-header">
             <h1 class="page-title">❤️ Избранное</h1>
             <p class="page-subtitle">{len(favorites)} товаров</p>
@@ -1618,6 +1680,20 @@ async def favorites_page(request: Request):
         </div>
         """
 
+
+@app.get("/favorites", response_class=HTMLResponse)
+async def favorites_page(request: Request):
+    user = await get_current_user(request)
+    user_id = get_user_id(request)
+
+    if not user_id:
+        return RedirectResponse("/login?next=/favorites", status_code=302)
+
+    favorites = await get_favorites(user_id)
+    cart_count = await get_cart_count(user_id)
+
+    content = render_favorites(favorites)
+
     return HTMLResponse(base_template(content, "Избранное", request, user, cart_count, len(favorites)))
 
 
@@ -1625,6 +1701,27 @@ async def favorites_page(request: Request):
 # ОФОРМЛЕНИЕ ЗАКАЗА
 # ═══════════════════════════════════════════════════════════════
 
+async def reserve_cart(user_id: int, cart: list):
+    """Резервирует содержимое корзины; повторный вызов заменяет прежний резерв"""
+    await inventory.ensure_loaded(item['product_id'] for item in cart)
+    inventory.reserve(f"user:{user_id}", {item['product_id']: item['quantity'] for item in cart})
+
+
+def stock_error_response(request: Request, user: dict, cart: list, error: InsufficientStock,
+                         cart_count: int, favorites_count: int) -> HTMLResponse:
+    name = next((item['name'] for item in cart if item['product_id'] == error.product_id), "Товар")
+    content = f"""
+        <div class="page-header">
+            <h1 class="page-title">📝 Оформление заказа</h1>
+        </div>
+        <div class="alert alert-error">
+            ❌ {name}: в наличии только {max(error.available, 0)} шт. Измените количество в корзине.
+        </div>
+        <a href="/cart" class="btn btn-primary">← Вернуться в корзину</a>
+        """
+    return HTMLResponse(base_template(content, "Оформление заказа", request, user, cart_count, favorites_count))
+
+
 @app.get("/checkout", response_class=HTMLResponse)
 async def checkout_page(request: Request):
     user = await get_current_user(request)
@@ -1640,6 +1737,12 @@ async def checkout_page(request: Request):
     cart_count = sum(item['quantity'] for item in cart)
     favorites_count = await get_favorites_count(user_id)
 
+    # Держим товары за покупателем, пока он заполняет форму
+    try:
+        await reserve_cart(user_id, cart)
+    except InsufficientStock as e:
+        return stock_error_response(request, user, cart, e, cart_count, favorites_count)
+
     subtotal = sum(item['price'] * item['quantity'] for item in cart)
     delivery = 0 if subtotal >= 5000 else 299
     total = subtotal + delivery
@@ -1767,12 +1870,73 @@ async def checkout_submit(
         phone: str = Form(...),
         address: str = Form(...),
         comment: str = Form(""),
-        payment: str = Form("card")
+        payment: str = Form("card"),
+        ticket: str = Form("")
 ):
     user_id = get_user_id(request)
     if not user_id:
         return RedirectResponse("/login", status_code=302)
 
+    # Ограничиваем число одновременных оформлений, остальных ставим в очередь
+    try:
+        async with checkout_admission.slot(ticket or None):
+            return await process_checkout(request, user_id, name, email, phone, address, comment)
+    except AdmissionRejected as e:
+        fields = {"name": name, "email": email, "phone": phone, "address": address,
+                  "comment": comment, "payment": payment}
+        return await checkout_queue_response(request, user_id, e, fields)
+
+
+async def checkout_queue_response(request: Request, user_id: int, rejected: AdmissionRejected,
+                                  fields: dict) -> HTMLResponse:
+    user = await get_current_user(request)
+    cart_count = await get_cart_count(user_id)
+    favorites_count = await get_favorites_count(user_id)
+
+    hidden_html = "".join(
+        f'<input type="hidden" name="{k}" value="{html.escape(v or "")}">' for k, v in fields.items()
+    )
+
+    content = f"""
+        <div style="max-width: 600px; margin: 50px auto; text-align: center;">
+            <div class="card">
+                <div class="card-body" style="padding: 60px 40px;">
+                    <div style="font-size: 80px; margin-bottom: 24px;">⏳</div>
+                    <h1 style="font-size: 28px; margin-bottom: 16px;">Вы в очереди на оформление</h1>
+                    <p style="font-size: 20px; margin-bottom: 8px;">
+                        Позиция: <strong id="queue-position" style="color: var(--primary);">{rejected.position}</strong>
+                    </p>
+                    <p style="color: var(--gray);">
+                        Сейчас много заказов. Не закрывайте страницу — заказ отправится автоматически.
+                    </p>
+                    <form id="queue-form" method="post" action="/checkout">
+                        {hidden_html}
+                        <input type="hidden" name="ticket" value="{rejected.ticket}">
+                    </form>
+                </div>
+            </div>
+        </div>
+
+        <script>
+            async function pollQueue() {{
+                const response = await fetch('/api/checkout/queue?ticket={rejected.ticket}');
+                const data = await response.json();
+                if (!data.success || data.ready) {{
+                    document.getElementById('queue-form').submit();
+                    return;
+                }}
+                document.getElementById('queue-position').textContent = data.position;
+                setTimeout(pollQueue, 2000);
+            }}
+            setTimeout(pollQueue, 2000);
+        </script>
+        """
+
+    return HTMLResponse(base_template(content, "Очередь на оформление", request, user, cart_count, favorites_count))
+
+
+async def process_checkout(request: Request, user_id: int, name: str, email: str, phone: str,
+                           address: str, comment: str):
     user = await get_current_user(request)
     cart = await get_cart(user_id)
 
@@ -1783,12 +1947,32 @@ async def checkout_submit(
     delivery = 0 if subtotal >= 5000 else 299
     total = subtotal + delivery
 
-    order_id = await create_order(user_id, name, email, phone, address, comment)
+    try:
+        await reserve_cart(user_id, cart)
+    except InsufficientStock as e:
+        return stock_error_response(request, user, cart, e, sum(item['quantity'] for item in cart), 0)
+
+    reservation = f"user:{user_id}"
+
+    # В транзакции заказа: списание остатков в журнал склада и задача сохранить контакты в профиль
+    async def before_commit(db):
+        await inventory.journal(db, reservation)
+        await job_queue.enqueue("update_user_contacts", {"user_id": user_id, "phone": phone, "address": address},
+                                db=db)
+
+    try:
+        order_id = await create_order(user_id, name, email, phone, address, comment, update_stock=False,
+                                      before_commit=before_commit)
+    except Exception:
+        inventory.release(reservation)
+        raise
 
     if not order_id:
+        inventory.release(reservation)
         return RedirectResponse("/cart", status_code=302)
 
-    await update_user(user_id, phone=phone, address=address)
+    inventory.confirm(reservation)
+    orders_created.inc()
 
     content = f"""
         <div style="max-width: 600px; margin: 50px auto; text-align: center;">
@@ -1841,19 +2025,10 @@ async def checkout_submit(
 # ЗАКАЗЫ ПОЛЬЗОВАТЕЛЯ
 # ═══════════════════════════════════════════════════════════════
 
-@app.get("/orders", response_class=HTMLResponse)
-async def orders_page(request: Request):
-    user = await get_current_user(request)
-    if not user:
-        return RedirectResponse("/login?next=/orders", status_code=302)
-
-    user_id = get_user_id(request)
-    cart_count = await get_cart_count(user_id)
-    favorites_count = await get_favorites_count(user_id)
-    orders = await get_user_orders(user_id)
-
+@timed("render")
+def render_orders(orders: list) -> str:
     if not orders:
-        content = """
+        return """
             <div class="page-header">
                 <h1 class="page-title">📦 Мои заказы</h1>
             </div>
@@ -1866,7 +2041,6 @@ async def orders_page(request: Request):
                 </div>
             </div>
             """
-        return HTMLResponse(base_template(content, "Мои заказы", request, user, cart_count, favorites_count))
 
     status_labels = {
         'pending': ('⏳ Ожидает оплаты', 'status-pending'),
@@ -1909,7 +2083,7 @@ async def orders_page(request: Request):
             </div>
             """
 
-    content = f"""
+    return f"""
         <div class="page-header">
             <h1 class="page-title">📦 Мои заказы</h1>
             <p class="page-subtitle">{len(orders)} заказов</p>
@@ -1918,6 +2092,20 @@ async def orders_page(request: Request):
         {orders_html}
         """
 
+
+@app.get("/orders", response_class=HTMLResponse)
+async def orders_page(request: Request):
+    user = await get_current_user(request)
+    if not user:
+        return RedirectResponse("/login?next=/orders", status_code=302)
+
+    user_id = get_user_id(request)
+    cart_count = await get_cart_count(user_id)
+    favorites_count = await get_favorites_count(user_id)
+    orders = await get_user_orders(user_id)
+
+    content = render_orders(orders)
+
     return HTMLResponse(base_template(content, "Мои заказы", request, user, cart_count, favorites_count))
 
 
@@ -2155,6 +2343,7 @@ async def api_add_to_cart(request: Request):
     quantity = data.get("quantity", 1)
 
     await add_to_cart(user_id, product_id, quantity)
+    cart_adds.inc()
     cart_count = await get_cart_count(user_id)
 
     return JSONResponse({"success": True, "cart_count": cart_count})
@@ -2189,6 +2378,14 @@ async def api_remove_from_cart(request: Request):
     return JSONResponse({"success": True})
 
 
+@app.get("/api/checkout/queue")
+async def api_checkout_queue(ticket: str):
+    status = checkout_admission.status(ticket)
+    if status is None:
+        return JSONResponse({"success": False})
+    return JSONResponse({"success": True, **status})
+
+
 @app.post("/api/favorites/toggle")
 async def api_toggle_favorite(request: Request):
     user_id = get_user_id(request)
@@ -2219,15 +2416,74 @@ async def require_admin(request: Request):
     return user
 
 
-@app.get("/admin", response_class=HTMLResponse)
-async def admin_dashboard(request: Request):
-    user = await get_current_user(request)
-    if not user or not user.get('is_admin'):
-        return RedirectResponse("/login", status_code=302)
+def admin_page_size(request: Request, per_page: Optional[int]) -> int:
+    """Размер страницы админ-списков запоминается в сессии"""
+    if per_page in ADMIN_PAGE_SIZES:
+        request.session["admin_per_page"] = per_page
+    return request.session.get("admin_per_page", 50)
 
-    stats = await get_stats()
 
-    content = f"""
+def select_options(options: list, selected) -> str:
+    return "".join(
+        f'<option value="{value}" {"selected" if str(value) == str(selected) else ""}>{label}</option>'
+        for value, label in options
+    )
+
+
+def admin_filters_form(action: str, fields_html: str, sort_options: list, sort: str, per_page: int) -> str:
+    return f"""
+        <form method="get" action="{action}" class="card" style="margin-bottom: 24px;">
+            <div class="card-body" style="display: flex; gap: 12px; flex-wrap: wrap; align-items: flex-end;">
+                {fields_html}
+                <div>
+                    <label class="form-label">Сортировка</label>
+                    <select name="sort" class="form-control" style="padding: 10px;">{select_options(sort_options, sort)}</select>
+                </div>
+                <div>
+                    <label class="form-label">На странице</label>
+                    <select name="per_page" class="form-control" style="padding: 10px;">
+                        {select_options([(n, n) for n in ADMIN_PAGE_SIZES], per_page)}
+                    </select>
+                </div>
+                <button type="submit" class="btn btn-primary">Применить</button>
+                <a href="{action}" class="btn btn-secondary">Сбросить</a>
+            </div>
+        </form>
+        """
+
+
+def admin_pager(action: str, filters: dict, cursor: Optional[str], next_cursor: Optional[str]) -> str:
+    query = {k: v for k, v in filters.items() if v not in (None, "", False)}
+    first_link = f'<a href="{action}?{urlencode(query)}" class="btn btn-secondary">← В начало</a>' if cursor else ""
+    next_link = (f'<a href="{action}?{urlencode({**query, "cursor": next_cursor})}" class="btn btn-primary">Далее →</a>'
+                 if next_cursor else "")
+    return f"""
+        <div style="display: flex; justify-content: space-between; margin-top: 24px;">
+            <div>{first_link}</div>
+            <div>{next_link}</div>
+        </div>
+        """
+
+
+def export_links(action: str, filters: dict) -> str:
+    query = {k: v for k, v in filters.items() if v not in (None, "", False)}
+    return f"""
+        <div style="display: flex; gap: 8px; justify-content: flex-end; margin-top: 16px;">
+            <a href="{action}?{urlencode({**query, "format": "csv"})}" class="btn btn-sm btn-secondary">⬇️ CSV</a>
+            <a href="{action}?{urlencode({**query, "format": "jsonl"})}" class="btn btn-sm btn-secondary">⬇️ JSONL</a>
+        </div>
+        """
+
+
+@timed("render")
+def render_admin_dashboard(stats: dict, revenue_days: list) -> str:
+    max_revenue = max((p['revenue'] for p in revenue_days), default=0) or 1
+    chart_html = "".join(f"""
+            <div title="{p['period']}: {format_price(p['revenue'])}, заказов: {p['orders']}"
+                 style="flex: 1; height: {max(p['revenue'] / max_revenue * 100, 1):.1f}%; background: var(--primary); border-radius: 2px 2px 0 0;"></div>
+        """ for p in revenue_days)
+
+    return f"""
         <div class="page-header">
             <h1 class="page-title">⚙️ Админ-панель</h1>
         </div>
@@ -2237,6 +2493,8 @@ async def admin_dashboard(request: Request):
             <a href="/admin/orders">📦 Заказы</a>
             <a href="/admin/products">🏷️ Товары</a>
             <a href="/admin/users">👥 Пользователи</a>
+            <a href="/admin/queries">🐢 Запросы</a>
+            <a href="/admin/memory">🧠 Память</a>
         </div>
 
         <div class="stats-grid">
@@ -2262,6 +2520,19 @@ async def admin_dashboard(request: Request):
             </div>
         </div>
 
+        <div class="card" style="margin-bottom: 30px;">
+            <div class="card-header">📈 Выручка за 90 дней</div>
+            <div class="card-body">
+                <div style="display: flex; align-items: flex-end; gap: 2px; height: 160px;">
+                    {chart_html}
+                </div>
+                <div style="display: flex; justify-content: space-between; font-size: 12px; color: var(--gray); margin-top: 8px;">
+                    <span>{revenue_days[0]['period'] if revenue_days else ''}</span>
+                    <span>{revenue_days[-1]['period'] if revenue_days else ''}</span>
+                </div>
+            </div>
+        </div>
+
         <div class="grid grid-2">
             <div class="card">
                 <div class="card-header">📊 Заказы по статусам</div>
@@ -2301,16 +2572,65 @@ async def admin_dashboard(request: Request):
         </div>
         """
 
+
+@app.get("/admin", response_class=HTMLResponse)
+async def admin_dashboard(request: Request):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    stats = await get_stats()
+    revenue_days = await get_order_rollups("day", datetime.utcnow() - timedelta(days=90))
+
+    content = render_admin_dashboard(stats, revenue_days)
+
     return HTMLResponse(base_template(content, "Админ-панель", request, user, 0, 0))
 
 
-@app.get("/admin/orders", response_class=HTMLResponse)
-async def admin_orders(request: Request):
+def parse_utc(value: str) -> datetime:
+    """Дата ISO 8601 → naive UTC, как created_at в БД; без смещения считается UTC"""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+@app.get("/api/admin/rollups")
+async def api_admin_rollups(request: Request, granularity: str = "day", days: int = 90,
+                            start: str = None, end: str = None):
     user = await get_current_user(request)
     if not user or not user.get('is_admin'):
-        return RedirectResponse("/login", status_code=302)
+        return JSONResponse({"success": False}, status_code=403)
+
+    if granularity not in ROLLUP_GRANULARITIES:
+        return JSONResponse({"success": False, "error": "granularity: hour, day или week"}, status_code=400)
+
+    try:
+        end_dt = parse_utc(end) if end else datetime.utcnow()
+        start_dt = parse_utc(start) if start else None
+    except ValueError:
+        return JSONResponse({"success": False, "error": "Даты в формате ISO 8601"}, status_code=400)
+    except OverflowError:
+        return JSONResponse({"success": False, "error": "Дата за пределами календаря"}, status_code=400)
+    if start_dt is None:
+        try:
+            start_dt = end_dt - timedelta(days=days)
+        except OverflowError:
+            start_dt = datetime.min  # days за пределами календаря — заведомо больше лимита
+
+    step = ROLLUP_GRANULARITIES[granularity][2]
+    if (end_dt - start_dt) / step > ROLLUP_MAX_POINTS:
+        return JSONResponse({"success": False, "error": f"Не больше {ROLLUP_MAX_POINTS} периодов за запрос"},
+                            status_code=400)
 
-    orders = await get_all_orders()
+    points = await get_order_rollups(granularity, start_dt, end_dt)
+    return JSONResponse({"success": True, "granularity": granularity, "points": points})
+
+
+@timed("render")
+def render_admin_orders(page: dict, status: str = None, date_from: str = None, date_to: str = None,
+                        sort: str = "new", cursor: str = None, limit: int = ADMIN_PAGE_SIZES[0]) -> str:
+    orders = page['items']
 
     status_labels = {
         'pending': ('⏳ Ожидает', 'status-pending'),
@@ -2342,7 +2662,7 @@ async def admin_orders(request: Request):
             </tr>
             """
 
-    content = f"""
+    return f"""
         <div class="page-header">
             <h1 class="page-title">📦 Управление заказами</h1>
         </div>
@@ -2352,8 +2672,28 @@ async def admin_orders(request: Request):
             <a href="/admin/orders" class="active">📦 Заказы</a>
             <a href="/admin/products">🏷️ Товары</a>
             <a href="/admin/users">👥 Пользователи</a>
+            <a href="/admin/queries">🐢 Запросы</a>
+            <a href="/admin/memory">🧠 Память</a>
         </div>
 
+        {admin_filters_form("/admin/orders", f'''
+            <div>
+                <label class="form-label">Статус</label>
+                <select name="status" class="form-control" style="padding: 10px;">
+                    {select_options([("", "Все")] + [(k, v[0]) for k, v in status_labels.items()], status or "")}
+                </select>
+            </div>
+            <div>
+                <label class="form-label">С даты</label>
+                <input type="date" name="date_from" class="form-control" style="padding: 8px;" value="{html.escape(date_from or '', quote=True)}">
+            </div>
+            <div>
+                <label class="form-label">По дату</label>
+                <input type="date" name="date_to" class="form-control" style="padding: 8px;" value="{html.escape(date_to or '', quote=True)}">
+            </div>
+        ''', [("new", "Сначала новые"), ("old", "Сначала старые"), ("total_desc", "Сумма ↓"), ("total_asc", "Сумма ↑")],
+            sort, limit)}
+
         <div class="card">
             <div class="table-container">
                 <table class="table">
@@ -2374,6 +2714,11 @@ async def admin_orders(request: Request):
             </div>
         </div>
 
+        {admin_pager("/admin/orders", {"status": status, "date_from": date_from, "date_to": date_to, "sort": sort},
+                     cursor, page['next_cursor'])}
+
+        {export_links("/admin/export/orders", {"status": status, "date_from": date_from, "date_to": date_to})}
+
         <script>
             async function updateOrderStatus(orderId, status) {{
                 await fetch('/api/admin/orders/' + orderId + '/status', {{
@@ -2386,6 +2731,18 @@ async def admin_orders(request: Request):
         </script>
         """
 
+
+@app.get("/admin/orders", response_class=HTMLResponse)
+async def admin_orders(request: Request, status: str = None, date_from: str = None, date_to: str = None,
+                       sort: str = "new", cursor: str = None, per_page: int = None):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    limit = admin_page_size(request, per_page)
+    page = await get_orders_page(status, date_from, date_to, sort, cursor, limit)
+    content = render_admin_orders(page, status, date_from, date_to, sort, cursor, limit)
+
     return HTMLResponse(base_template(content, "Заказы", request, user, 0, 0))
 
 
@@ -2403,13 +2760,83 @@ async def api_update_order_status(request: Request, order_id: int):
     return JSONResponse({"success": True})
 
 
-@app.get("/admin/products", response_class=HTMLResponse)
-async def admin_products(request: Request):
+def validate_product_update(item) -> Optional[str]:
+    """Текст ошибки для записи массового обновления или None"""
+    if not isinstance(item, dict):
+        return "ожидается объект"
+    # bool в Python — подкласс int: true не должно стать id 1 или остатком 1
+    product_id = item.get("id")
+    if product_id is not None and (not isinstance(product_id, int) or isinstance(product_id, bool)):
+        return "id: ожидается целое число"
+    slug = item.get("slug")
+    if slug is not None and not isinstance(slug, str):
+        return "slug: ожидается строка"
+    if product_id is None and not slug:
+        return "нужен id или slug"
+    if not any(k in item for k in ("price", "old_price", "stock")):
+        return "нет полей price, old_price или stock"
+    for key in ("price", "old_price"):
+        value = item.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)
+                                  or not math.isfinite(value) or value < 0):
+            return f"{key}: ожидается неотрицательное число"
+    stock = item.get("stock")
+    if stock is not None and (not isinstance(stock, int) or isinstance(stock, bool) or stock < 0):
+        return "stock: ожидается неотрицательное целое"
+    if "price" in item and item["price"] is None:
+        return "price не может быть null"
+    return None
+
+
+@app.post("/api/admin/products/bulk-update")
+async def api_bulk_update_products(request: Request):
+    """Цены и остатки пачкой: {"items": [{"id" | "slug", "price", "old_price", "stock"}, ...]}"""
     user = await get_current_user(request)
     if not user or not user.get('is_admin'):
-        return RedirectResponse("/login", status_code=302)
+        return JSONResponse({"success": False}, status_code=403)
+
+    data = await request.json()
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return JSONResponse({"success": False, "error": "Ожидается список items"}, status_code=400)
+
+    for i, item in enumerate(items):
+        error = validate_product_update(item)
+        if error:
+            return JSONResponse({"success": False, "error": f"items[{i}]: {error}"}, status_code=400)
+
+    result = await bulk_update_products(items)
+    await inventory.reload(result['updated'])
+
+    return JSONResponse({"success": True, "updated": len(result['updated']), "not_found": result['not_found']})
+
+
+@app.get("/api/admin/jobs")
+async def api_admin_jobs(request: Request):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return JSONResponse({"success": False}, status_code=403)
+
+    return JSONResponse({"success": True, "jobs": await job_queue.stats()})
+
 
-    products = await get_all_products_admin()
+@app.post("/api/admin/jobs/retry")
+async def api_admin_jobs_retry(request: Request):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return JSONResponse({"success": False}, status_code=403)
+
+    data = await request.json()
+    retried = await job_queue.retry_dead(data.get("job_id"))
+
+    return JSONResponse({"success": True, "retried": retried})
+
+
+@timed("render")
+def render_admin_products(page: dict, categories: list, category: int = None, low_stock: bool = False,
+                          q: str = None, sort: str = "new", cursor: str = None,
+                          limit: int = ADMIN_PAGE_SIZES[0]) -> str:
+    products = page['items']
 
     rows_html = ""
     for p in products:
@@ -2433,9 +2860,10 @@ async def admin_products(request: Request):
             </tr>
             """
 
-    content = f"""
+    return f"""
         <div class="page-header">
             <h1 class="page-title">🏷️ Управление товарами</h1>
+            <a href="/admin/import" class="btn btn-secondary">📥 Импорт</a>
         </div>
 
         <div class="admin-nav">
@@ -2443,8 +2871,29 @@ async def admin_products(request: Request):
             <a href="/admin/orders">📦 Заказы</a>
             <a href="/admin/products" class="active">🏷️ Товары</a>
             <a href="/admin/users">👥 Пользователи</a>
+            <a href="/admin/queries">🐢 Запросы</a>
+            <a href="/admin/memory">🧠 Память</a>
         </div>
 
+        {admin_filters_form("/admin/products", f'''
+            <div>
+                <label class="form-label">Поиск</label>
+                <input type="text" name="q" class="form-control" style="padding: 8px;" value="{html.escape(q or '')}"
+                       placeholder="Название или slug">
+            </div>
+            <div>
+                <label class="form-label">Категория</label>
+                <select name="category" class="form-control" style="padding: 10px;">
+                    {select_options([("", "Все")] + [(c['id'], c['name']) for c in categories], category or "")}
+                </select>
+            </div>
+            <label style="display: flex; gap: 8px; align-items: center; padding: 10px 0;">
+                <input type="checkbox" name="low_stock" value="true" {'checked' if low_stock else ''}> Мало на складе
+            </label>
+        ''', [("new", "Сначала новые"), ("price_asc", "Цена ↑"), ("price_desc", "Цена ↓"),
+              ("stock_asc", "Остаток ↑"), ("name", "По названию")],
+            sort, limit)}
+
         <div class="card">
             <div class="table-container">
                 <table class="table">
@@ -2459,23 +2908,202 @@ async def admin_products(request: Request):
                         </tr>
                     </thead>
                     <tbody>
-                        {rows_html}
+                        {rows_html if rows_html else '<tr><td colspan="6" style="text-align: center; padding: 40px;">Товары не найдены</td></tr>'}
                     </tbody>
                 </table>
             </div>
         </div>
+
+        {admin_pager("/admin/products", {"category": category, "low_stock": low_stock, "q": q, "sort": sort},
+                     cursor, page['next_cursor'])}
+
+        {export_links("/admin/export/products", {"category": category, "low_stock": low_stock})}
         """
 
+
+@app.get("/admin/products", response_class=HTMLResponse)
+async def admin_products(request: Request, category: int = None, low_stock: bool = False, q: str = None,
+                         sort: str = "new", cursor: str = None, per_page: int = None):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    limit = admin_page_size(request, per_page)
+    page = await get_products_page(category, low_stock, q, sort, cursor, limit)
+    categories = await get_categories()
+
+    content = render_admin_products(page, categories, category, low_stock, q, sort, cursor, limit)
+
     return HTMLResponse(base_template(content, "Товары", request, user, 0, 0))
 
 
-@app.get("/admin/users", response_class=HTMLResponse)
-async def admin_users(request: Request):
+# ═══════════════════════════════════════════════════════════════
+# ВЫГРУЗКИ
+# ═══════════════════════════════════════════════════════════════
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",                                # charset добавит Response
+    "jsonl": "application/x-ndjson; charset=utf-8",   # не text/* — Response charset не добавит
+}
+
+
+async def export_chunks(rows, columns: list, fmt: str):
+    """Кодирует строки в CSV/JSONL и отдаёт порциями — память не растёт с объёмом"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        buffer.write("\ufeff")  # BOM, чтобы Excel открыл UTF-8
+        writer.writerow(columns)
+
+    count = 0
+    async for row in rows:
+        if fmt == "csv":
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+        count += 1
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def export_response(rows, columns: list, fmt: str, name: str) -> StreamingResponse:
+    filename = f"{name}-{datetime.now():%Y%m%d-%H%M}.{fmt}"
+    return StreamingResponse(
+        export_chunks(rows, columns, fmt),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@app.get("/admin/export/orders")
+async def admin_export_orders(request: Request, format: str = "csv", status: str = None,
+                              date_from: str = None, date_to: str = None):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Формат: csv или jsonl")
+
+    rows = iter_orders_export(status, date_from, date_to)
+    return export_response(rows, ORDER_EXPORT_COLUMNS, format, "orders")
+
+
+@app.get("/admin/export/products")
+async def admin_export_products(request: Request, format: str = "csv", category: int = None,
+                                low_stock: bool = False):
     user = await get_current_user(request)
     if not user or not user.get('is_admin'):
         return RedirectResponse("/login", status_code=302)
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Формат: csv или jsonl")
+
+    rows = iter_products_export(category, low_stock)
+    return export_response(rows, PRODUCT_EXPORT_COLUMNS, format, "products")
+
+
+# ═══════════════════════════════════════════════════════════════
+# ИМПОРТ ТОВАРОВ
+# ═══════════════════════════════════════════════════════════════
+
+@timed("render")
+def import_page(report: dict = None, error: str = None) -> str:
+    result_html = ""
+    if error:
+        result_html = f'<div class="alert alert-error">{html.escape(error)}</div>'
+    elif report:
+        errors_html = "".join(
+            f"<tr><td>{e['row']}</td><td>{html.escape(e['error'])}</td></tr>" for e in report['error_samples']
+        )
+        if errors_html:
+            errors_html = f"""
+            <div class="table-container" style="margin-top: 16px;">
+                <table class="table">
+                    <thead><tr><th>Строка</th><th>Ошибка</th></tr></thead>
+                    <tbody>{errors_html}</tbody>
+                </table>
+            </div>
+            """
+        result_html = f"""
+        <div class="card" style="margin-bottom: 24px;">
+            <h3 style="margin-bottom: 16px;">✅ Загружено {report['imported']} из {report['rows']} строк</h3>
+            <p style="color: var(--gray);">
+                {report['seconds']} с, {report['rows_per_second']:.0f} строк/с, ошибок: {report['errors']}
+            </p>
+            {errors_html}
+        </div>
+        """
 
-    users = await get_all_users()
+    return f"""
+        <div class="page-header">
+            <h1 class="page-title">📥 Импорт товаров</h1>
+        </div>
+
+        <div class="admin-nav">
+            <a href="/admin">📊 Дашборд</a>
+            <a href="/admin/orders">📦 Заказы</a>
+            <a href="/admin/products" class="active">🏷️ Товары</a>
+            <a href="/admin/users">👥 Пользователи</a>
+            <a href="/admin/queries">🐢 Запросы</a>
+            <a href="/admin/memory">🧠 Память</a>
+        </div>
+
+        {result_html}
+
+        <div class="card">
+            <form method="POST" action="/admin/import" enctype="multipart/form-data">
+                <div class="form-group">
+                    <label class="form-label">Файл CSV или JSONL</label>
+                    <input type="file" name="file" class="form-control" accept=".csv,.jsonl,.ndjson" required>
+                </div>
+                <p style="color: var(--gray); font-size: 14px; margin-bottom: 16px;">
+                    Поля: name, slug, price, old_price, category (slug) или category_id, description,
+                    image, stock, is_featured, is_active. Товары с существующим slug обновляются.
+                </p>
+                <button type="submit" class="btn btn-primary">Загрузить</button>
+            </form>
+        </div>
+        """
+
+
+@app.get("/admin/import", response_class=HTMLResponse)
+async def admin_import_page(request: Request):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    return HTMLResponse(base_template(import_page(), "Импорт товаров", request, user, 0, 0))
+
+
+@app.post("/admin/import", response_class=HTMLResponse)
+async def admin_import(request: Request, file: UploadFile = File(...)):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    lines = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        report = await import_products(lines, detect_format(file.filename or ""))
+    except UnicodeDecodeError:
+        content = import_page(error="Файл должен быть в кодировке UTF-8")
+        # Часть товаров могла загрузиться до ошибки — их остатки перечитаются при обращении
+        inventory.invalidate()
+    else:
+        content = import_page(report)
+        await inventory.reload(report['product_ids'])
+    finally:
+        lines.detach()
+
+    return HTMLResponse(base_template(content, "Импорт товаров", request, user, 0, 0))
+
+
+@timed("render")
+def render_admin_users(page: dict, registered_from: str = None, registered_to: str = None, q: str = None,
+                       sort: str = "new", cursor: str = None, limit: int = ADMIN_PAGE_SIZES[0]) -> str:
+    users = page['items']
 
     rows_html = ""
     for u in users:
@@ -2492,7 +3120,7 @@ async def admin_users(request: Request):
             </tr>
             """
 
-    content = f"""
+    return f"""
         <div class="page-header">
             <h1 class="page-title">👥 Пользователи</h1>
         </div>
@@ -2502,8 +3130,27 @@ async def admin_users(request: Request):
             <a href="/admin/orders">📦 Заказы</a>
             <a href="/admin/products">🏷️ Товары</a>
             <a href="/admin/users" class="active">👥 Пользователи</a>
+            <a href="/admin/queries">🐢 Запросы</a>
+            <a href="/admin/memory">🧠 Память</a>
         </div>
 
+        {admin_filters_form("/admin/users", f'''
+            <div>
+                <label class="form-label">Поиск</label>
+                <input type="text" name="q" class="form-control" style="padding: 8px;" value="{html.escape(q or '')}"
+                       placeholder="Имя или email">
+            </div>
+            <div>
+                <label class="form-label">Зарегистрирован с</label>
+                <input type="date" name="registered_from" class="form-control" style="padding: 8px;" value="{html.escape(registered_from or '', quote=True)}">
+            </div>
+            <div>
+                <label class="form-label">по</label>
+                <input type="date" name="registered_to" class="form-control" style="padding: 8px;" value="{html.escape(registered_to or '', quote=True)}">
+            </div>
+        ''', [("new", "Сначала новые"), ("old", "Сначала старые"), ("name", "По имени")],
+            sort, limit)}
+
         <div class="card">
             <div class="table-container">
                 <table class="table">
@@ -2517,19 +3164,487 @@ async def admin_users(request: Request):
                         </tr>
                     </thead>
                     <tbody>
-                        {rows_html}
+                        {rows_html if rows_html else '<tr><td colspan="5" style="text-align: center; padding: 40px;">Пользователи не найдены</td></tr>'}
                     </tbody>
                 </table>
             </div>
         </div>
+
+        {admin_pager("/admin/users", {"registered_from": registered_from, "registered_to": registered_to, "q": q,
+                                      "sort": sort}, cursor, page['next_cursor'])}
         """
 
+
+@app.get("/admin/users", response_class=HTMLResponse)
+async def admin_users(request: Request, registered_from: str = None, registered_to: str = None, q: str = None,
+                      sort: str = "new", cursor: str = None, per_page: int = None):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    limit = admin_page_size(request, per_page)
+    page = await get_users_page(registered_from, registered_to, q, sort, cursor, limit)
+    content = render_admin_users(page, registered_from, registered_to, q, sort, cursor, limit)
+
     return HTMLResponse(base_template(content, "Пользователи", request, user, 0, 0))
 
 
+# ═══════════════════════════════════════════════════════════════
+# СТАТИСТИКА ЗАПРОСОВ
+# ═══════════════════════════════════════════════════════════════
+
+QUERY_SORTS = {
+    "total_ms": "Общее время",
+    "avg_ms": "Среднее время",
+    "max_ms": "Максимум",
+    "calls": "Вызовы",
+    "rows": "Строки",
+}
+QUERY_TOP_N = 50
+
+
+@timed("render")
+def render_admin_queries(top: list, recent_slow: list, sort: str = "total_ms", since: str = "",
+                         slow_ms: float = 0) -> str:
+    rows_html = ""
+    for q in top:
+        rows_html += f"""
+            <tr>
+                <td><code style="font-size: 12px; white-space: pre-wrap;">{html.escape(q['fingerprint'])}</code></td>
+                <td>{html.escape(q['function'] or '—')}</td>
+                <td>{q['calls']}</td>
+                <td>{q['total_ms']:.1f}</td>
+                <td>{q['avg_ms']:.2f}</td>
+                <td>{q['max_ms']:.1f}</td>
+                <td>{q['rows']}</td>
+            </tr>
+            """
+
+    slow_html = ""
+    for q in reversed(recent_slow):
+        plan = "<br>".join(html.escape(line) for line in q['plan'])
+        slow_html += f"""
+            <tr>
+                <td>{q['ts']}</td>
+                <td>{html.escape(q['function'] or '—')}</td>
+                <td>{q['ms']:.1f}</td>
+                <td>{q['rows']}</td>
+                <td><code style="font-size: 12px; white-space: pre-wrap;">{html.escape(q['sql'])}</code></td>
+                <td style="font-size: 12px; color: var(--gray);">{plan or '—'}</td>
+            </tr>
+            """
+
+    sort_links = " ".join(
+        f'<a href="/admin/queries?sort={key}" class="btn {"btn-primary" if key == sort else "btn-outline"}" '
+        f'style="padding: 6px 12px; font-size: 13px;">{label}</a>'
+        for key, label in QUERY_SORTS.items()
+    )
+
+    return f"""
+        <div class="page-header">
+            <h1 class="page-title">🐢 SQL-запросы</h1>
+            <form method="POST" action="/admin/queries/reset">
+                <button type="submit" class="btn btn-outline">Сбросить статистику</button>
+            </form>
+        </div>
+
+        <div class="admin-nav">
+            <a href="/admin">📊 Дашборд</a>
+            <a href="/admin/orders">📦 Заказы</a>
+            <a href="/admin/products">🏷️ Товары</a>
+            <a href="/admin/users">👥 Пользователи</a>
+            <a href="/admin/queries" class="active">🐢 Запросы</a>
+            <a href="/admin/memory">🧠 Память</a>
+        </div>
+
+        <div class="card" style="margin-bottom: 24px;">
+            <p style="color: var(--gray); margin-bottom: 16px;">
+                Статистика этого процесса с {since}. Литералы в запросах заменены на ?, списки IN — на (...).
+            </p>
+            <div style="display: flex; gap: 8px; flex-wrap: wrap; margin-bottom: 16px;">{sort_links}</div>
+            <div class="table-container">
+                <table class="table">
+                    <thead>
+                        <tr>
+                            <th>Запрос</th>
+                            <th>Функция</th>
+                            <th>Вызовы</th>
+                            <th>Всего, мс</th>
+                            <th>Среднее, мс</th>
+                            <th>Макс, мс</th>
+                            <th>Строк</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {rows_html if rows_html else '<tr><td colspan="7" style="text-align: center; padding: 40px;">Запросов ещё не было</td></tr>'}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+
+        <div class="card">
+            <h3 style="margin-bottom: 16px;">Медленные запросы (от {slow_ms:g} мс)</h3>
+            <div class="table-container">
+                <table class="table">
+                    <thead>
+                        <tr>
+                            <th>Время</th>
+                            <th>Функция</th>
+                            <th>мс</th>
+                            <th>Строк</th>
+                            <th>SQL</th>
+                            <th>План</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {slow_html if slow_html else '<tr><td colspan="6" style="text-align: center; padding: 40px;">Медленных запросов нет</td></tr>'}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+        """
+
+
+@app.get("/admin/queries", response_class=HTMLResponse)
+async def admin_queries(request: Request, sort: str = "total_ms"):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    if sort not in QUERY_SORTS:
+        sort = "total_ms"
+    content = render_admin_queries(
+        query_stats.top(QUERY_TOP_N, sort), list(query_stats.recent_slow), sort,
+        datetime.fromtimestamp(query_stats.since).strftime("%d.%m.%Y %H:%M"), query_stats.slow_ms
+    )
+    return HTMLResponse(base_template(content, "SQL-запросы", request, user, 0, 0))
+
+
+@app.post("/admin/queries/reset")
+async def admin_queries_reset(request: Request):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    query_stats.reset()
+    return RedirectResponse("/admin/queries", status_code=302)
+
+
+# ═══════════════════════════════════════════════════════════════
+# ПАМЯТЬ
+# ═══════════════════════════════════════════════════════════════
+
+MEMORY_GROUP_LABELS = {"lineno": "По строкам", "filename": "По модулям"}
+
+
+@memory_tracker.cache_source
+def service_caches() -> dict:
+    return {
+        **inventory.caches(),
+        **query_stats.caches(),
+        **checkout_admission.caches(),
+        **job_queue.caches(),
+        **loop_monitor.caches(),
+        **metrics_registry.caches(),
+    }
+
+
+def format_size(size: int, signed: bool = False) -> str:
+    sign = "+" if signed and size > 0 else "−" if size < 0 else ""
+    size = abs(size)
+    if size < 1024:
+        return f"{sign}{size} Б"
+    if size < 1024 * 1024:
+        return f"{sign}{size / 1024:.1f} КБ"
+    return f"{sign}{size / 1024 / 1024:.1f} МБ"
+
+
+@timed("render")
+def render_admin_memory(status: dict, caches: list, sites: list, snapshot_id: int = None, base_id: int = None,
+                        group: str = "lineno") -> str:
+    if status['tracing']:
+        tracing_html = f"""
+            <p>Трассировка включена ({status['frames']} кадр.): отслежено {format_size(status['traced'])},
+               пик {format_size(status['traced_peak'])}, расход самого tracemalloc {format_size(status['overhead'])}.</p>
+            <div style="display: flex; gap: 8px; margin-top: 16px;">
+                <form method="POST" action="/admin/memory/snapshot">
+                    <button type="submit" class="btn btn-primary">Снимок</button>
+                </form>
+                <form method="POST" action="/admin/memory/stop">
+                    <button type="submit" class="btn btn-outline">Остановить</button>
+                </form>
+            </div>
+            """
+    else:
+        tracing_html = f"""
+            <p style="color: var(--gray);">Трассировка аллокаций выключена: она замедляет работу процесса,
+               включайте на время диагностики.</p>
+            <form method="POST" action="/admin/memory/start" style="display: flex; gap: 8px; margin-top: 16px;">
+                <input type="number" name="frames" value="{MEMORY_TRACE_FRAMES}" min="1" max="50" class="form-control"
+                       style="width: 100px;" title="Кадров стека на аллокацию">
+                <button type="submit" class="btn btn-primary">Включить tracemalloc</button>
+            </form>
+            """
+
+    snapshots_html = ""
+    for snap in reversed(status['snapshots']):
+        links = f'<a href="/admin/memory?snapshot={snap["id"]}&group={group}">топ</a>'
+        if snapshot_id and snap['id'] < snapshot_id:
+            links += f' · <a href="/admin/memory?snapshot={snapshot_id}&base={snap["id"]}&group={group}">разница с #{snapshot_id}</a>'
+        snapshots_html += f"""
+            <tr>
+                <td>#{snap['id']}{' ←' if snap['id'] == snapshot_id else ''}</td>
+                <td>{snap['ts']}</td>
+                <td>{format_size(snap['size'])}</td>
+                <td>{format_size(snap['rss'])}</td>
+                <td>{links}</td>
+            </tr>
+            """
+
+    snapshots_card = ""
+    if snapshots_html:
+        snapshots_card = f"""
+        <div class="card" style="margin-bottom: 24px;">
+            <h3 style="margin-bottom: 16px;">Снимки</h3>
+            <div class="table-container">
+                <table class="table">
+                    <thead>
+                        <tr><th>№</th><th>Время</th><th>Отслежено</th><th>RSS</th><th></th></tr>
+                    </thead>
+                    <tbody>{snapshots_html}</tbody>
+                </table>
+            </div>
+        </div>
+        """
+
+    sites_html = ""
+    for site in sites:
+        diff_cells = ""
+        if base_id:
+            diff_cells = f"<td>{format_size(site['size_diff'], signed=True)}</td><td>{site['count_diff']:+d}</td>"
+        sites_html += f"""
+            <tr>
+                <td><code style="font-size: 12px;">{html.escape(site['site'])}</code></td>
+                {diff_cells}
+                <td>{format_size(site['size'])}</td>
+                <td>{site['count']}</td>
+            </tr>
+            """
+
+    sites_card = ""
+    if snapshot_id:
+        title = f"Прирост от #{base_id} к #{snapshot_id}" if base_id else f"Топ мест аллокации в #{snapshot_id}"
+        group_links = " ".join(
+            f'<a href="/admin/memory?snapshot={snapshot_id}{f"&base={base_id}" if base_id else ""}&group={key}" '
+            f'class="btn {"btn-primary" if key == group else "btn-outline"}" style="padding: 6px 12px; font-size: 13px;">'
+            f'{label}</a>'
+            for key, label in MEMORY_GROUP_LABELS.items()
+        )
+        diff_headers = "<th>Прирост</th><th>Блоков +/−</th>" if base_id else ""
+        sites_card = f"""
+        <div class="card" style="margin-bottom: 24px;">
+            <h3 style="margin-bottom: 16px;">{title}</h3>
+            <div style="display: flex; gap: 8px; flex-wrap: wrap; margin-bottom: 16px;">{group_links}</div>
+            <div class="table-container">
+                <table class="table">
+                    <thead>
+                        <tr><th>Место</th>{diff_headers}<th>Размер</th><th>Блоков</th></tr>
+                    </thead>
+                    <tbody>
+                        {sites_html if sites_html else '<tr><td colspan="5" style="text-align: center; padding: 40px;">Пусто</td></tr>'}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+        """
+
+    caches_html = ""
+    for cache in caches:
+        caches_html += f"""
+            <tr>
+                <td><code style="font-size: 12px;">{html.escape(cache['name'])}</code></td>
+                <td>{cache['entries']}</td>
+                <td>{format_size(cache['bytes'])}</td>
+            </tr>
+            """
+
+    return f"""
+        <div class="page-header">
+            <h1 class="page-title">🧠 Память</h1>
+        </div>
+
+        <div class="admin-nav">
+            <a href="/admin">📊 Дашборд</a>
+            <a href="/admin/orders">📦 Заказы</a>
+            <a href="/admin/products">🏷️ Товары</a>
+            <a href="/admin/users">👥 Пользователи</a>
+            <a href="/admin/queries">🐢 Запросы</a>
+            <a href="/admin/memory" class="active">🧠 Память</a>
+        </div>
+
+        <div class="card" style="margin-bottom: 24px;">
+            <h3 style="margin-bottom: 16px;">Процесс {os.getpid()}: RSS {format_size(status['rss'])}</h3>
+            {tracing_html}
+        </div>
+
+        {snapshots_card}
+
+        {sites_card}
+
+        <div class="card">
+            <h3 style="margin-bottom: 16px;">Кэши в памяти</h3>
+            <p style="color: var(--gray); margin-bottom: 16px;">Размер приблизительный: объект и всё содержимое контейнеров.</p>
+            <div class="table-container">
+                <table class="table">
+                    <thead>
+                        <tr><th>Кэш</th><th>Записей</th><th>Размер</th></tr>
+                    </thead>
+                    <tbody>{caches_html}</tbody>
+                </table>
+            </div>
+        </div>
+        """
+
+
+@app.get("/admin/memory", response_class=HTMLResponse)
+async def admin_memory(request: Request, snapshot: int = None, base: int = None, group: str = "lineno"):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    if group not in MEMORY_GROUPS:
+        group = "lineno"
+    if snapshot not in memory_tracker.snapshots:
+        snapshot = None
+    if snapshot is None or base not in memory_tracker.snapshots or base == snapshot:
+        base = None
+
+    if snapshot is None:
+        sites = []
+    elif base is None:
+        sites = memory_tracker.top(snapshot, group)
+    else:
+        sites = memory_tracker.diff(base, snapshot, group)
+
+    content = render_admin_memory(memory_tracker.status(), memory_tracker.cache_report(), sites, snapshot, base, group)
+    return HTMLResponse(base_template(content, "Память", request, user, 0, 0))
+
+
+@app.post("/admin/memory/start")
+async def admin_memory_start(request: Request, frames: int = Form(MEMORY_TRACE_FRAMES)):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    memory_tracker.start(frames)
+    return RedirectResponse("/admin/memory", status_code=302)
+
+
+@app.post("/admin/memory/stop")
+async def admin_memory_stop(request: Request):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+
+    memory_tracker.stop()
+    return RedirectResponse("/admin/memory", status_code=302)
+
+
+@app.post("/admin/memory/snapshot")
+async def admin_memory_snapshot(request: Request):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+    if not memory_tracker.tracing:
+        return RedirectResponse("/admin/memory", status_code=302)
+
+    previous = next(reversed(memory_tracker.snapshots), None)
+    snapshot_id = memory_tracker.take_snapshot()
+    url = f"/admin/memory?snapshot={snapshot_id}" + (f"&base={previous}" if previous else "")
+    return RedirectResponse(url, status_code=302)
+
+
+# ═══════════════════════════════════════════════════════════════
+# МЕТРИКИ
+# ═══════════════════════════════════════════════════════════════
+
+@metrics_registry.collector
+def collect_service_metrics():
+    for function, (calls, seconds) in query_stats.by_function.items():
+        db_queries.set(calls, function)
+        db_query_seconds.set(seconds, function)
+    db_connections_open.set(query_stats.connections_open)
+    db_connections.set(query_stats.connections_total)
+    cache_requests.set(inventory.hits, "inventory", "hit")
+    cache_requests.set(inventory.misses, "inventory", "miss")
+    cache_requests.set(query_stats.fingerprint_hits, "sql_fingerprint", "hit")
+    cache_requests.set(query_stats.fingerprint_misses, "sql_fingerprint", "miss")
+    checkout_active.set(checkout_admission.active)
+    checkout_waiting.set(checkout_admission.waiting)
+    for name, entries in memory_tracker.cache_entries().items():
+        cache_entries.set(entries, name)
+    process_resident_memory.set(rss_bytes())
+    access_log_records.set(access_log.written, "written")
+    access_log_records.set(access_log.dropped, "dropped")
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    # Время функций БД, задержки маршрутов и бизнес-счётчики — только сборщику с токеном или админу
+    if not METRICS_PUBLIC:
+        authorization = request.headers.get("authorization", "")
+        if not (METRICS_TOKEN and secrets.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode())):
+            user = await get_current_user(request)
+            if not user or not user.get('is_admin'):
+                return Response(status_code=401)
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/api/admin/loop")
+async def api_admin_loop(request: Request):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return JSONResponse({"success": False}, status_code=403)
+
+    return JSONResponse({"success": True, **loop_monitor.report()})
+
+
+# ═══════════════════════════════════════════════════════════════
+# ПРОФИЛИРОВАНИЕ
+# ═══════════════════════════════════════════════════════════════
+
+PROFILE_FORMATS = {
+    "collapsed": ("text/plain", "txt"),                  # charset добавит Response
+    "speedscope": ("application/json", "speedscope.json"),
+}
+
+
+@app.get("/admin/profile")
+async def admin_profile(request: Request, seconds: float = 30, format: str = "collapsed"):
+    user = await get_current_user(request)
+    if not user or not user.get('is_admin'):
+        return RedirectResponse("/login", status_code=302)
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail="Формат: collapsed или speedscope")
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise HTTPException(status_code=400, detail="seconds: положительное число")
+
+    try:
+        profile = await stack_sampler.profile(seconds)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Профиль уже снимается")
+
+    media_type, extension = PROFILE_FORMATS[format]
+    body = profile.collapsed() if format == "collapsed" else json.dumps(profile.speedscope())
+    filename = f"profile-{datetime.now():%Y%m%d-%H%M%S}.{extension}"
+    return Response(body, media_type=media_type,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 # ═══════════════════════════════════════════════════════════════
 # ЗАПУСК
 # ═══════════════════════════════════════════════════════════════
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # При ACCESS_LOG стандартный журнал uvicorn (синхронный, текстовый) не нужен
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, access_log=not ACCESS_LOG)
@@ -0,0 +1,267 @@
+"""
+Служебные команды: python manage.py <команда>
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from datetime import date
+
+import database
+from datagen import DATAGEN_DEFAULTS, generate_dataset
+
+
+async def backfill_rollups(args):
+    await database.init_database()
+    await database.backfill_order_rollups()
+    print("✅ Итоги по заказам пересчитаны")
+
+
+async def reconcile_stats(args):
+    await database.init_database()
+    counters = await database.reconcile_stats()
+    for name, value in sorted(counters.items()):
+        print(f"{name:24} {value}")
+
+
+async def import_products(args):
+    from importer import detect_format, import_products
+
+    def progress(report):
+        print(f"\r  {report['rows']:>10} строк, {report['rows_per_second']:>10.0f} строк/с, "
+              f"ошибок: {report['errors']}", end="", file=sys.stderr)
+
+    await database.init_database()
+    with open(args.file, encoding="utf-8-sig", newline="") as f:
+        report = await import_products(f, args.format or detect_format(args.file), progress)
+    print(file=sys.stderr)
+
+    print(f"✅ Загружено {report['imported']} из {report['rows']} строк за {report['seconds']} с "
+          f"({report['rows_per_second']:.0f} строк/с)")
+    for sample in report['error_samples']:
+        print(f"  строка {sample['row']}: {sample['error']}")
+    if report['errors'] > len(report['error_samples']):
+        print(f"  ... всего ошибок: {report['errors']}")
+
+
+async def generate_data(args):
+    def progress(table, rows):
+        print(f"\r  {table:<12} {rows:>12}", end="", file=sys.stderr)
+
+    await database.init_database()
+    volumes = {key: getattr(args, key) for key in DATAGEN_DEFAULTS}
+    report = await generate_dataset(args.seed, args.until, progress, **volumes)
+    print(file=sys.stderr)
+
+    seconds = report.pop("seconds")
+    for table, rows in report.items():
+        print(f"  {table:<12} {rows:>12}")
+    print(f"✅ Данные сгенерированы за {seconds} с")
+
+
+async def run_loadtest(args):
+    import loadtest
+
+    result = await loadtest.run(
+        args.mode, args.url, concurrency=args.concurrency, duration=args.duration,
+        warmup=args.warmup, seed=args.seed, user_pool=args.user_pool,
+    )
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Сравнение с {baseline.get('commit')} ({baseline.get('started_at')}):", file=sys.stderr)
+        for line in loadtest.compare_reports(baseline, result):
+            print(line, file=sys.stderr)
+
+
+async def run_replay(args):
+    import loadtest
+    import replay
+
+    result = await replay.run(args.capture, args.mode, args.url, speed=args.speed,
+                              max_inflight=args.max_inflight, limit=args.limit)
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    replayed = result["replayed"]
+    print(f"Воспроизведено {result['requests']} запросов (пропущено {result['skipped']}) "
+          f"за {replayed['seconds']} с, максимальное отставание {replayed['max_lag_ms']} мс", file=sys.stderr)
+    print("Сравнение с записью (rps записи — с учётом доли выборки):", file=sys.stderr)
+    for line in loadtest.compare_reports(result["captured"], replayed):
+        print(line, file=sys.stderr)
+    print(f"Ошибок: при записи {result['captured']['total']['errors']}, "
+          f"при воспроизведении {replayed['total']['errors']}", file=sys.stderr)
+    for route, count in replayed["status_mismatches"].items():
+        print(f"  статус отличается от записи: {route} — {count}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Сравнение с {baseline.get('commit')} ({baseline.get('started_at')}):", file=sys.stderr)
+        for line in loadtest.compare_reports(baseline["replayed"], replayed):
+            print(line, file=sys.stderr)
+
+
+async def run_bench(args):
+    import bench
+
+    def progress(name, result):
+        flags = " ".join(flag for flag, key in (("SCAN", "full_scan"), ("TEMP-SORT", "temp_sort"))
+                         if any(plan[key] for plan in result['plans']))
+        print(f"  {name:<40} p50 {result['p50_ms']:>9} мс  p95 {result['p95_ms']:>9} мс  "
+              f"запросов {result['queries']:>3}  {flags}", file=sys.stderr)
+
+    await database.init_database()
+    report = await bench.run_benchmarks(args.iterations, args.only, not args.no_writes, progress)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(bench.make_baseline(report), f, ensure_ascii=False, indent=2)
+        print(f"✅ Пороги сохранены в {args.save_baseline}", file=sys.stderr)
+
+    if args.baseline:
+        baseline = bench.load_baseline(args.baseline)
+        if baseline.get("dataset") != report["dataset"]:
+            print("⚠️ Объём данных отличается от того, на котором снимался baseline", file=sys.stderr)
+        failures = bench.check_baseline(report, baseline)
+        for failure in failures:
+            print(f"❌ {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+def bench_render(args):
+    import bench_render
+
+    def progress(name, result):
+        print(f"  {name:<36} {result['us_per_render']:>12} мкс  {result['peak_bytes']:>12} байт  "
+              f"HTML {result['html_bytes']:>10} байт", file=sys.stderr)
+
+    report = bench_render.run_render_benchmarks(args.only, args.rounds, progress)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        print("Изменение относительно прошлого прогона:", file=sys.stderr)
+        for name, result in report["results"].items():
+            old = baseline.get(name)
+            if old:
+                change = (result['us_per_render'] - old['us_per_render']) / old['us_per_render'] * 100
+                print(f"  {name:<36} {old['us_per_render']:>10} → {result['us_per_render']:>10} мкс "
+                      f"({change:+.0f}%)", file=sys.stderr)
+
+
+def serve(args):
+    import launcher
+
+    if args.worker_fd is not None:
+        sys.exit(launcher.run_worker(args.worker_fd, args.ready_fd))
+    sys.exit(launcher.Launcher(args.host, args.port).run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Служебные команды ShopMax")
+    parser.add_argument("--db", default=database.DATABASE_PATH, help="путь к файлу БД")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("backfill-rollups", help="пересчитать почасовые и суточные итоги по заказам") \
+        .set_defaults(func=backfill_rollups)
+    commands.add_parser("reconcile-stats", help="сверить счётчики админ-панели с таблицами") \
+        .set_defaults(func=reconcile_stats)
+
+    command = commands.add_parser("import-products", help="загрузить товары из CSV/JSONL (upsert по slug)")
+    command.add_argument("file")
+    command.add_argument("--format", choices=["csv", "jsonl"], help="по умолчанию — по расширению файла")
+    command.set_defaults(func=import_products)
+
+    command = commands.add_parser("generate-data", help="заполнить БД синтетическими данными для нагрузочных тестов")
+    command.add_argument("--seed", type=int, default=42)
+    command.add_argument("--until", type=date.fromisoformat, help="конец истории заказов, YYYY-MM-DD (по умолчанию сегодня)")
+    for key, value in DATAGEN_DEFAULTS.items():
+        command.add_argument("--" + key.replace("_", "-"), type=int, help=f"по умолчанию {value}")
+    command.set_defaults(func=generate_data)
+
+    command = commands.add_parser("loadtest", help="нагрузочный прогон сценариев, результат в JSON")
+    command.add_argument("--mode", choices=["asgi", "http"], default="asgi",
+                         help="asgi — в процессе, http — через uvicorn или --url")
+    command.add_argument("--url", help="адрес запущенного сервера для режима http")
+    command.add_argument("--concurrency", type=int, default=20)
+    command.add_argument("--duration", type=float, default=30.0, help="секунд")
+    command.add_argument("--warmup", type=float, default=3.0, help="секунд без учёта в статистике")
+    command.add_argument("--seed", type=int, default=1)
+    command.add_argument("--user-pool", type=int, default=1000, help="сколько пользователей generate-data задействовать")
+    command.add_argument("--out", help="файл для JSON (по умолчанию stdout)")
+    command.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    command.set_defaults(func=run_loadtest)
+
+    command = commands.add_parser("replay", help="воспроизвести записанный трафик (CAPTURE_PATH) и сравнить задержки")
+    command.add_argument("capture", help="JSONL, записанный TrafficCaptureMiddleware")
+    command.add_argument("--mode", choices=["asgi", "http"], default="asgi",
+                         help="asgi — в процессе, http — через uvicorn или --url")
+    command.add_argument("--url", help="адрес запущенного сервера для режима http")
+    command.add_argument("--speed", type=float, default=1.0, help="ускорение относительно записи, 0 — без пауз")
+    command.add_argument("--max-inflight", type=int, default=50, help="одновременных запросов")
+    command.add_argument("--limit", type=int, help="только первые N запросов")
+    command.add_argument("--out", help="файл для JSON (по умолчанию stdout)")
+    command.add_argument("--compare", help="JSON прошлого воспроизведения для сравнения")
+    command.set_defaults(func=run_replay)
+
+    command = commands.add_parser("bench", help="микробенчмарки функций database.py с планами запросов")
+    command.add_argument("--iterations", type=int, default=50)
+    command.add_argument("--only", help="только случаи, в имени которых есть подстрока")
+    command.add_argument("--no-writes", action="store_true", help="пропустить create_order (пишет в БД)")
+    command.add_argument("--out", help="файл для JSON (по умолчанию stdout)")
+    command.add_argument("--baseline", help="JSON с порогами: код возврата 1, если p50 выше порога")
+    command.add_argument("--save-baseline", help="сохранить пороги (p50 × 1.5) по текущему прогону")
+    command.set_defaults(func=run_bench)
+
+    command = commands.add_parser("bench-render", help="микробенчмарки построения HTML-страниц без БД")
+    command.add_argument("--only", help="только случаи, в имени которых есть подстрока")
+    command.add_argument("--rounds", type=int, default=7)
+    command.add_argument("--out", help="файл для JSON (по умолчанию stdout)")
+    command.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    command.set_defaults(func=bench_render)
+
+    command = commands.add_parser("serve", help="production: предзагрузка, надзор и плавный перезапуск воркера")
+    command.add_argument("--host", default="0.0.0.0")
+    command.add_argument("--port", type=int, default=8000)
+    # Для воркера, которого мастер запускает заново через exec при плавном перезапуске
+    command.add_argument("--worker-fd", type=int, help=argparse.SUPPRESS)
+    command.add_argument("--ready-fd", type=int, help=argparse.SUPPRESS)
+    command.set_defaults(func=serve)
+
+    args = parser.parse_args()
+    database.DATABASE_PATH = args.db
+    result = args.func(args)
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+
+
+if __name__ == "__main__":
+    main()
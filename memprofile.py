@@ -0,0 +1,174 @@
+"""
+Память процесса: tracemalloc по команде из админ-панели и размеры кэшей
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List
+
+from stacks import APP_DIR
+
+MEMORY_TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", "1"))   # кадров на аллокацию; 1 — место создания
+MEMORY_SNAPSHOTS_KEEP = 5        # снимков в памяти (каждый — копия всех трасс)
+MEMORY_TOP_N = 30
+MEMORY_GROUPS = ("lineno", "filename")   # строка или модуль
+
+# Аллокации самого tracemalloc и импорта модулей — не интересны
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+_CONTAINERS = (dict, list, tuple, set, frozenset, deque)
+
+
+def deep_sizeof(obj, seen: set = None) -> int:
+    """Приблизительный размер объекта с содержимым контейнеров; общие объекты считаются один раз"""
+    seen = set() if seen is None else seen
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, _CONTAINERS):
+            stack.extend(item)
+    return total
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса (Linux); 0, если /proc недоступен"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def site_name(filename: str) -> str:
+    if filename.startswith(APP_DIR):
+        return os.path.relpath(filename, APP_DIR)
+    parts = filename.split(os.sep)
+    # .../site-packages/starlette/routing.py → starlette/routing.py
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            return "/".join(parts[parts.index(marker) + 1:])
+    return os.path.basename(filename)
+
+
+class MemoryTracker:
+    """
+    Трассировка аллокаций включается только из админ-панели: tracemalloc
+    замедляет каждую аллокацию и держит по записи на живой блок, поэтому
+    в обычной работе выключен. Снимки хранятся в памяти по номерам, топ
+    мест аллокации и разница между снимками группируются по строке или модулю.
+    """
+
+    def __init__(self):
+        self.snapshots: "OrderedDict[int, Dict]" = OrderedDict()
+        self.cache_sources: List[Callable[[], Dict[str, object]]] = []
+        self._next_id = 1
+
+    def cache_source(self, func: Callable[[], Dict[str, object]]) -> Callable[[], Dict[str, object]]:
+        """Декоратор: функция возвращает кэши в памяти по именам (сами контейнеры)"""
+        self.cache_sources.append(func)
+        return func
+
+    # ─── tracemalloc ───
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = MEMORY_TRACE_FRAMES):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, frames))
+
+    def stop(self):
+        """Останавливает трассировку и освобождает снимки"""
+        tracemalloc.stop()
+        self.snapshots.clear()
+
+    def take_snapshot(self) -> int:
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        snapshot_id = self._next_id
+        self._next_id += 1
+        self.snapshots[snapshot_id] = {
+            "id": snapshot_id,
+            "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "snapshot": snapshot,
+            "size": sum(stat.size for stat in snapshot.statistics("filename")),
+            "rss": rss_bytes(),
+        }
+        while len(self.snapshots) > MEMORY_SNAPSHOTS_KEEP:
+            self.snapshots.popitem(last=False)
+        return snapshot_id
+
+    def top(self, snapshot_id: int, group: str = "lineno", limit: int = MEMORY_TOP_N) -> List[Dict]:
+        stats = self.snapshots[snapshot_id]["snapshot"].statistics(group)
+        return [{
+            "site": self._site(stat.traceback, group),
+            "size": stat.size,
+            "count": stat.count,
+        } for stat in stats[:limit]]
+
+    def diff(self, base_id: int, snapshot_id: int, group: str = "lineno", limit: int = MEMORY_TOP_N) -> List[Dict]:
+        """Места с наибольшим приростом от снимка base_id к snapshot_id"""
+        snapshot = self.snapshots[snapshot_id]["snapshot"]
+        stats = snapshot.compare_to(self.snapshots[base_id]["snapshot"], group)
+        return [{
+            "site": self._site(stat.traceback, group),
+            "size": stat.size,
+            "size_diff": stat.size_diff,
+            "count": stat.count,
+            "count_diff": stat.count_diff,
+        } for stat in stats[:limit]]
+
+    @staticmethod
+    def _site(traceback: tracemalloc.Traceback, group: str) -> str:
+        frame = traceback[0]
+        name = site_name(frame.filename)
+        return name if group == "filename" else f"{name}:{frame.lineno}"
+
+    def status(self) -> Dict:
+        current, peak = tracemalloc.get_traced_memory() if self.tracing else (0, 0)
+        return {
+            "tracing": self.tracing,
+            "frames": tracemalloc.get_traceback_limit() if self.tracing else 0,
+            "traced": current,
+            "traced_peak": peak,
+            "overhead": tracemalloc.get_tracemalloc_memory() if self.tracing else 0,
+            "rss": rss_bytes(),
+            "snapshots": [{k: v for k, v in s.items() if k != "snapshot"} for s in self.snapshots.values()],
+        }
+
+    # ─── Кэши ───
+
+    def caches(self) -> Dict[str, object]:
+        caches = {}
+        for source in self.cache_sources:
+            caches.update(source())
+        return caches
+
+    def cache_entries(self) -> Dict[str, int]:
+        """Число записей в каждом кэше — дёшево, для /metrics"""
+        return {name: len(cache) for name, cache in self.caches().items()}
+
+    def cache_report(self) -> List[Dict]:
+        """Записи и приблизительный размер в байтах — обходит содержимое, только по запросу"""
+        report = [{"name": name, "entries": len(cache), "bytes": deep_sizeof(cache)}
+                  for name, cache in self.caches().items()]
+        return sorted(report, key=lambda item: -item["bytes"])
+
+
+memory_tracker = MemoryTracker()
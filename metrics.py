@@ -0,0 +1,315 @@
+"""
+Метрики в формате Prometheus: HTTP, SQL, event loop и бизнес-счётчики
+"""
+
+import asyncio
+import json
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+METRICS_MULTIPROC_DIR = os.environ.get("METRICS_MULTIPROC_DIR", "")   # пусто — один процесс
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")                   # Bearer-токен для сборщика метрик
+METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "") == "1"          # 1 — /metrics без авторизации
+METRICS_FLUSH_INTERVAL = 5.0     # период записи снимка процесса в METRICS_MULTIPROC_DIR
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"   # charset добавит Response
+
+
+class Metric:
+    """
+    Семейство метрик: значения по кортежам меток в обычном dict.
+
+    Обновляются только из потока event loop, поэтому без блокировок;
+    в многопроцессном режиме каждый процесс пишет свой снимок в файл,
+    а /metrics складывает снимки всех процессов.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), registry: "Registry" = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[tuple, object] = {}
+        (registry or metrics_registry).register(self)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, value: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + value
+
+    def set(self, value: float, *labels):
+        """Для счётчиков, которые уже ведёт сам сервис: значение переносится при сборе"""
+        self.values[labels] = value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), registry: "Registry" = None,
+                 multiprocess: str = "sum"):
+        super().__init__(name, help, labels, registry)
+        self.multiprocess = multiprocess   # как сводить живые процессы: sum или max
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def inc(self, *labels, value: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + value
+
+    def dec(self, *labels, value: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) - value
+
+
+class Histogram(Metric):
+    """Значение по меткам — [число в каждой корзине (последняя — +Inf)..., сумма]"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), registry: "Registry" = None,
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels, registry)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def collector(self, func: Callable[[], None]) -> Callable[[], None]:
+        """Декоратор: функция переносит состояние сервисов в метрики перед каждым снимком"""
+        self.collectors.append(func)
+        return func
+
+    # ─── Снимки ───
+
+    def snapshot(self) -> Dict:
+        for collect in self.collectors:
+            collect()
+        return {
+            "pid": os.getpid(),
+            "metrics": {m.name: [[list(labels), value] for labels, value in m.values.items()]
+                        for m in self.metrics},
+        }
+
+    def write_snapshot(self, directory: str = None):
+        directory = directory or METRICS_MULTIPROC_DIR
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def _read_snapshots(self, directory: str) -> List[Dict]:
+        """Снимки остальных процессов; свой берётся свежим из памяти"""
+        snapshots = []
+        for name in os.listdir(directory):
+            if not name.endswith(".json") or name == f"{os.getpid()}.json":
+                continue
+            try:
+                with open(os.path.join(directory, name), encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def merged(self, directory: str = None) -> Dict[str, Dict[tuple, object]]:
+        """
+        Значения всех процессов: счётчики и гистограммы складываются (включая
+        завершившиеся процессы — иначе счётчики уменьшатся), gauge — сумма
+        или максимум по живым процессам.
+        """
+        directory = directory if directory is not None else METRICS_MULTIPROC_DIR
+        snapshots = [self.snapshot()]
+        if directory:
+            snapshots += self._read_snapshots(directory)
+
+        by_name = {m.name: m for m in self.metrics}
+        merged: Dict[str, Dict[tuple, object]] = {name: {} for name in by_name}
+        for snapshot in snapshots:
+            alive = snapshot["pid"] == os.getpid() or _pid_alive(snapshot["pid"])
+            for name, values in snapshot["metrics"].items():
+                metric = by_name.get(name)
+                if metric is None or (metric.type == "gauge" and not alive):
+                    continue
+                target = merged[name]
+                for labels, value in values:
+                    key = tuple(labels)
+                    current = target.get(key)
+                    if current is None:
+                        target[key] = list(value) if isinstance(value, list) else value
+                    elif metric.type == "histogram":
+                        target[key] = [a + b for a, b in zip(current, value)]
+                    elif metric.type == "gauge" and metric.multiprocess == "max":
+                        target[key] = max(current, value)
+                    else:
+                        target[key] = current + value
+        return merged
+
+    def caches(self) -> Dict[str, object]:
+        # Растут только метрики с метками
+        caches: Dict[str, object] = {f"metrics.{m.name}": m.values for m in self.metrics if m.labels}
+        caches["metrics.routes"] = _routes
+        return caches
+
+    # ─── Формат Prometheus ───
+
+    def render(self, directory: str = None) -> str:
+        merged = self.merged(directory)
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for labels, value in sorted(merged[metric.name].items()):
+                pairs = list(zip(metric.labels, labels))
+                if metric.type == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), value[:-1]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{metric.name}_bucket{_labels(pairs + [('le', le)])} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_labels(pairs)} {value[-1]}")
+                    lines.append(f"{metric.name}_count{_labels(pairs)} {cumulative}")
+                else:
+                    lines.append(f"{metric.name}{_labels(pairs)} {value}")
+        return "\n".join(lines) + "\n"
+
+    # ─── Жизненный цикл ───
+
+    async def start(self):
+        if METRICS_MULTIPROC_DIR:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if METRICS_MULTIPROC_DIR:
+            self.write_snapshot()
+
+    async def _run(self):
+        """Периодическая запись снимка процесса для многопроцессного режима"""
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                print(f"⚠️ Ошибка записи метрик: {e}")
+
+
+def _labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def route_template(scope) -> Optional[str]:
+    """Шаблон пути сработавшего маршрута (/product/{product_id}); роутер кладёт endpoint в scope"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return None
+    route = _routes.get(endpoint)
+    if route is None:
+        app = scope.get("app")
+        route = _routes[endpoint] = next(
+            (r.path for r in getattr(app, "routes", []) if getattr(r, "endpoint", None) is endpoint), ""
+        )
+    return route or None
+
+
+_routes: Dict[Callable, str] = {}
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: запросы в работе, число и длительность ответов по маршрутам"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        requests_in_progress.inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            requests_in_progress.dec()
+            # Пути без маршрута (404) не размножают метки
+            route = route_template(scope) or "unmatched"
+            http_requests.inc(scope["method"], route, str(status))
+            http_request_seconds.observe(time.perf_counter() - started, scope["method"], route)
+
+
+metrics_registry = Registry()
+
+http_requests = Counter("shop_http_requests_total", "HTTP-запросы", ("method", "route", "status"))
+http_request_seconds = Histogram("shop_http_request_duration_seconds", "Длительность HTTP-запросов",
+                                 ("method", "route"))
+requests_in_progress = Gauge("shop_http_requests_in_progress", "HTTP-запросы в работе")
+
+db_queries = Counter("shop_db_queries_total", "SQL-запросы", ("function",))
+db_query_seconds = Counter("shop_db_query_seconds_total", "Время SQL-запросов с выборкой строк", ("function",))
+db_connections_open = Gauge("shop_db_connections_open", "Открытые соединения с SQLite")
+db_connections = Counter("shop_db_connections_total", "Открытия соединений с SQLite")
+
+cache_requests = Counter("shop_cache_requests_total", "Обращения к кэшам в памяти", ("cache", "result"))
+cache_entries = Gauge("shop_cache_entries", "Записей в кэшах и буферах в памяти", ("cache",))
+process_resident_memory = Gauge("shop_process_resident_memory_bytes", "RSS процессов")
+access_log_records = Counter("shop_access_log_records_total", "Записи журнала запросов: записанные и потерянные",
+                             ("result",))
+
+loop_lag = Histogram("shop_event_loop_lag_seconds", "Опоздание пробуждения по таймеру в event loop",
+                     buckets=LOOP_LAG_BUCKETS)
+loop_lag_quantiles = Gauge("shop_event_loop_lag_quantile_seconds", "Перцентили задержки event loop за минуту",
+                           ("quantile",), multiprocess="max")
+loop_blocks = Counter("shop_event_loop_blocks_total", "Блокировки event loop дольше порога по функциям",
+                      ("function",))
+
+orders_created = Counter("shop_orders_created_total", "Созданные заказы")
+cart_adds = Counter("shop_cart_adds_total", "Добавления в корзину")
+checkout_active = Gauge("shop_checkout_active", "Оформления заказа в работе")
+checkout_waiting = Gauge("shop_checkout_waiting", "Ожидающие слота оформления")
@@ -0,0 +1,272 @@
+"""
+Отправка email-уведомлений из outbox пачками через одно SMTP-соединение
+"""
+
+import asyncio
+import json
+import os
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from email.utils import formatdate
+from typing import Callable, Dict, List, Optional, Tuple
+
+from database import get_db
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "")      # пусто — отправка выключена
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "25"))
+SMTP_USER = os.environ.get("SMTP_USER", "")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "") == "1"
+SMTP_FROM = os.environ.get("SMTP_FROM", "ShopMax <info@shopmax.ru>")
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_POLL_INTERVAL = 2.0
+OUTBOX_RATE_LIMIT = 10.0         # писем в секунду
+OUTBOX_CLAIM_SECONDS = 120.0     # зависшая пачка снова становится доступной
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BASE = 30.0         # пауза перед повтором: base * 2^(attempt-1) секунд
+OUTBOX_RETRY_MAX = 3600.0
+SMTP_IDLE_TIMEOUT = 60.0         # простаивающее соединение проверяется NOOP
+
+STATUS_LABELS = {
+    'pending': 'Ожидает оплаты',
+    'processing': 'В обработке',
+    'shipped': 'Отправлен',
+    'delivered': 'Доставлен',
+    'cancelled': 'Отменён',
+}
+
+
+def render_message(kind: str, payload: Dict) -> Tuple[str, str]:
+    """Тема и текст письма по типу уведомления"""
+    order_id = payload.get('order_id')
+    if kind == "order_created":
+        total = f"{payload['total']:,.0f}".replace(",", " ")
+        return (
+            f"Заказ #{order_id} оформлен",
+            f"{payload['name']}, спасибо за заказ!\n\n"
+            f"Номер заказа: #{order_id}\n"
+            f"Товаров: {payload['items_count']}\n"
+            f"Сумма: {total} ₽\n\n"
+            f"Статус заказа можно отслеживать в разделе «Мои заказы».\n\n"
+            f"ShopMax"
+        )
+    if kind == "order_status":
+        label = STATUS_LABELS.get(payload['status'], payload['status'])
+        return (
+            f"Заказ #{order_id}: {label}",
+            f"{payload['name']}, статус вашего заказа #{order_id} изменён: {label}.\n\nShopMax"
+        )
+    raise ValueError(f"Неизвестный тип уведомления: {kind}")
+
+
+def server_unavailable(error: Exception) -> bool:
+    """Ошибка соединения, а не конкретного письма — остальные письма пачки тоже не уйдут"""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+class RateLimiter:
+    """Token bucket: не больше rate событий в секунду с запасом burst"""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SMTPConnection:
+    """
+    Переиспользуемое SMTP-соединение. smtplib блокирующий, поэтому все
+    вызовы идут через один поток — соединение не делится между потоками.
+    """
+
+    def __init__(self, factory: Callable[[], smtplib.SMTP] = None):
+        self.factory = factory or self._connect
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smtp")
+
+    @staticmethod
+    def _connect() -> smtplib.SMTP:
+        smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        return smtp
+
+    def _ensure(self) -> smtplib.SMTP:
+        if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+            try:
+                self._smtp.noop()
+            except smtplib.SMTPException:
+                self._smtp = None
+        if self._smtp is None:
+            self._smtp = self.factory()
+        return self._smtp
+
+    def _send(self, message: EmailMessage):
+        try:
+            self._ensure().send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            self._smtp = None
+            self._ensure().send_message(message)
+        self._last_used = time.monotonic()
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self._smtp = None
+
+    async def send(self, message: EmailMessage):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._send, message)
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=False)
+
+
+class NotificationDispatcher:
+    """
+    Разбирает outbox: забирает пачку pending-писем (status = sending с
+    таймаутом захвата), отправляет их с ограничением скорости и помечает
+    отправленными. Неотправленное письмо возвращается в pending с
+    экспоненциальной паузой (next_attempt_at), после OUTBOX_MAX_ATTEMPTS
+    попыток — failed; при недоступном сервере пачка не перебирается до
+    конца. Message-ID письма выводится из id строки outbox, так что
+    повторная отправка после падения между SMTP и отметкой в БД
+    распознаётся получателем как то же самое письмо.
+    """
+
+    def __init__(self, connection: SMTPConnection = None, batch_size: int = OUTBOX_BATCH_SIZE,
+                 rate_limit: float = OUTBOX_RATE_LIMIT, poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(rate_limit)
+        self.poll_interval = poll_interval
+        self._task: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.failed = 0
+
+    async def start(self):
+        if self.connection is None:
+            if not SMTP_HOST:
+                print("ℹ️ SMTP_HOST не задан — письма копятся в outbox без отправки")
+                return
+            self.connection = SMTPConnection()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.connection:
+            await self.connection.close()
+
+    async def _run(self):
+        while True:
+            try:
+                sent = await self.dispatch_batch()
+            except Exception as e:
+                print(f"⚠️ Ошибка отправки уведомлений: {e}")
+                sent = 0
+            if sent < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def dispatch_batch(self) -> int:
+        """Отправляет одну пачку; возвращает число обработанных писем"""
+        batch = await self._claim()
+        if not batch:
+            return 0
+
+        sent_ids: List[int] = []
+        failures = []
+        for index, row in enumerate(batch):
+            await self.limiter.acquire()
+            try:
+                await self.connection.send(self._build(row))
+            except (smtplib.SMTPException, OSError, ValueError) as e:
+                failures.append((row, str(e)))
+                if server_unavailable(e):
+                    failures.extend((rest, str(e)) for rest in batch[index + 1:])
+                    break
+                continue
+            sent_ids.append(row['id'])
+
+        await self._finish(sent_ids, failures)
+        self.sent += len(sent_ids)
+        return len(batch)
+
+    def _build(self, row: Dict) -> EmailMessage:
+        subject, body = render_message(row['kind'], json.loads(row['payload']))
+        message = EmailMessage()
+        message['From'] = SMTP_FROM
+        message['To'] = row['recipient']
+        message['Subject'] = subject
+        message['Date'] = formatdate(localtime=True)
+        message['Message-ID'] = f"<outbox-{row['id']}@shopmax>"
+        message.set_content(body)
+        return message
+
+    async def _claim(self) -> List[Dict]:
+        now = time.time()
+        async with get_db() as db:
+            cursor = await db.execute("""
+                UPDATE outbox
+                SET status = 'sending', claimed_until = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE (status = 'pending' AND (next_attempt_at IS NULL OR next_attempt_at <= ?))
+                       OR (status = 'sending' AND claimed_until <= ?)
+                    ORDER BY id
+                    LIMIT ?
+                )
+                RETURNING id, kind, recipient, payload, attempts
+            """, (now + OUTBOX_CLAIM_SECONDS, now, now, self.batch_size))
+            rows = sorted((dict(row) for row in await cursor.fetchall()), key=lambda r: r['id'])
+            await db.commit()
+        return rows
+
+    async def _finish(self, sent_ids: List[int], failures: List):
+        async with get_db() as db:
+            await db.executemany(
+                "UPDATE outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP, claimed_until = NULL WHERE id = ?",
+                [(i,) for i in sent_ids]
+            )
+            for row, error in failures:
+                status = 'failed' if row['attempts'] >= OUTBOX_MAX_ATTEMPTS else 'pending'
+                delay = min(OUTBOX_RETRY_BASE * 2 ** (row['attempts'] - 1), OUTBOX_RETRY_MAX)
+                await db.execute(
+                    "UPDATE outbox SET status = ?, last_error = ?, claimed_until = NULL, next_attempt_at = ? "
+                    "WHERE id = ?",
+                    (status, error, time.time() + delay, row['id'])
+                )
+                if status == 'failed':
+                    self.failed += 1
+            await db.commit()
+
+
+notification_dispatcher = NotificationDispatcher()
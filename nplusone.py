@@ -0,0 +1,176 @@
+"""
+Поиск N+1: одинаковые по форме SQL-запросы в пределах одного HTTP-запроса и бюджеты запросов по маршрутам
+"""
+
+import os
+import traceback
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from metrics import route_template
+from stacks import app_frames, format_frame
+
+NPLUSONE_MODE = os.environ.get("NPLUSONE_MODE", "off")   # off | warn — печатать подозрения со стеком
+NPLUSONE_THRESHOLD = 3           # столько одинаковых запросов за HTTP-запрос — подозрение на N+1
+NPLUSONE_STACK_DEPTH = 8         # кадров кода приложения в стеке
+
+# Максимум SQL-запросов на маршрут: замер для авторизованного пользователя с холодным кэшем
+# остатков (первое обращение к товару подгружает его из БД) и один запрос запаса
+QUERY_BUDGETS = {
+    "GET /": 7,
+    "GET /catalog": 7,
+    "GET /product/{product_id}": 8,
+    "GET /cart": 4,
+    "GET /favorites": 4,
+    "GET /checkout": 5,
+    "GET /orders": 6,
+    "GET /profile": 6,
+    "POST /api/cart/add": 4,
+    "POST /checkout": 10,
+    "GET /admin": 4,
+    "GET /admin/orders": 3,
+    "GET /admin/products": 4,
+    "GET /admin/users": 3,
+}
+
+
+class RequestQueries:
+    """SQL-запросы одного HTTP-запроса: число по отпечаткам и стек на пороге"""
+
+    def __init__(self, method: str, path: str, capture_stacks: bool = False,
+                 threshold: int = NPLUSONE_THRESHOLD):
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.total = 0
+        self.counts: Dict[str, int] = {}
+        self.stacks: Dict[str, List[str]] = {}
+        self.capture_stacks = capture_stacks
+        self.threshold = threshold
+
+    @property
+    def key(self) -> str:
+        return f"{self.method} {self.route or self.path}"
+
+    def repeated(self) -> Dict[str, int]:
+        return {fp: n for fp, n in self.counts.items() if n >= self.threshold}
+
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("request_queries", default=None)
+
+# Получают RequestQueries каждого завершённого запроса (фикстура query_budget)
+listeners: List[Callable[[RequestQueries], None]] = []
+
+
+def record(fp: str):
+    """Вызывается из InstrumentedConnection на каждый execute"""
+    queries = _current.get()
+    if queries is None:
+        return
+    queries.total += 1
+    count = queries.counts[fp] = queries.counts.get(fp, 0) + 1
+    if count == queries.threshold and queries.capture_stacks:
+        queries.stacks[fp] = app_stack()
+
+
+def app_stack() -> List[str]:
+    """Стек кода приложения в месте запроса, от внешнего кадра к внутреннему"""
+    return [format_frame(f) for f in app_frames(traceback.extract_stack())[-NPLUSONE_STACK_DEPTH:]]
+
+
+def describe(queries: RequestQueries) -> List[str]:
+    lines = []
+    for fp, count in sorted(queries.repeated().items(), key=lambda item: -item[1]):
+        lines.append(f"  {count}× {fp}")
+        lines.extend(f"      {frame}" for frame in queries.stacks.get(fp, []))
+    return lines
+
+
+class QueryCounterMiddleware:
+    """
+    ASGI-middleware: считает SQL-запросы каждого HTTP-запроса. В режиме
+    warn печатает повторяющиеся формы запросов со стеком (один раз на
+    маршрут и форму); при выключенном режиме и без слушателей ничего не делает.
+    """
+
+    def __init__(self, app, mode: str = NPLUSONE_MODE, threshold: int = NPLUSONE_THRESHOLD):
+        self.app = app
+        self.mode = mode
+        self.threshold = threshold
+        self._reported: Set[Tuple[str, str]] = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.mode == "off" and not listeners):
+            await self.app(scope, receive, send)
+            return
+
+        queries = RequestQueries(scope["method"], scope["path"], capture_stacks=True, threshold=self.threshold)
+        token = _current.set(queries)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            queries.route = route_template(scope)
+            if self.mode == "warn":
+                self._warn(queries)
+            for listener in listeners:
+                listener(queries)
+
+    def _warn(self, queries: RequestQueries):
+        fresh = {fp for fp in queries.repeated() if (queries.key, fp) not in self._reported}
+        if not fresh:
+            return
+        self._reported.update((queries.key, fp) for fp in fresh)
+        print(f"⚠️ Возможный N+1 в {queries.key}: {queries.total} SQL-запросов")
+        print("\n".join(describe(queries)))
+
+
+class QueryBudget:
+    """Запросы, прошедшие за тест, и проверка бюджетов (см. фикстуру query_budget)"""
+
+    def __init__(self, budgets: Dict[str, int] = None):
+        self.budgets = dict(QUERY_BUDGETS if budgets is None else budgets)
+        self.requests: List[RequestQueries] = []
+
+    def __call__(self, queries: RequestQueries):
+        self.requests.append(queries)
+
+    def limit(self, route: str, max_queries: int):
+        """Бюджет для маршрута в этом тесте: budget.limit("GET /catalog", 3)"""
+        self.budgets[route] = max_queries
+
+    def violations(self) -> List[str]:
+        problems = []
+        for queries in self.requests:
+            budget = self.budgets.get(queries.key)
+            if budget is not None and queries.total > budget:
+                problems.append(f"{queries.key} ({queries.path}): {queries.total} SQL-запросов при бюджете {budget}")
+            if queries.repeated():
+                problems.append(f"{queries.key} ({queries.path}): повторяющиеся запросы (N+1)")
+                problems.extend(describe(queries))
+        return problems
+
+    def check(self):
+        problems = self.violations()
+        assert not problems, "\n".join(problems)
+
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+    @pytest.fixture
+    def query_budget():
+        """
+        Все HTTP-запросы теста проверяются по QUERY_BUDGETS и на N+1 при
+        завершении теста. Подключение в conftest.py: pytest_plugins = ["nplusone"]
+        """
+        budget = QueryBudget()
+        listeners.append(budget)
+        try:
+            yield budget
+        finally:
+            listeners.remove(budget)
+        budget.check()
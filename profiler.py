@@ -0,0 +1,138 @@
+"""
+Профилирование работающего процесса по запросу: выборка стеков потока event loop
+"""
+
+import asyncio
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType
+from typing import Dict, List, Optional, Tuple
+
+from stacks import APP_DIR
+
+PROFILE_INTERVAL = 0.005         # период выборки стека (200 раз в секунду)
+PROFILE_MAX_SECONDS = 120
+
+
+class ProfilerBusy(Exception):
+    """Профиль уже снимается — одновременно только один"""
+
+
+def frame_name(code: CodeType) -> str:
+    """Имя кадра: функция и место её определения (путь от корня приложения или имя файла библиотеки)"""
+    path = code.co_filename
+    if path.startswith(APP_DIR):
+        path = os.path.relpath(path, APP_DIR)
+    else:
+        path = os.path.basename(path)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class Profile:
+    """Выборки стеков по порядку: кортежи объектов кода от корня к вершине и длительность каждой"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.started = time.time()
+        self.duration = 0.0
+        self.samples: List[Tuple[CodeType, ...]] = []
+        self.weights: List[float] = []
+
+    def collapsed(self) -> str:
+        """Формат flamegraph.pl / speedscope / inferno: «корень;...;вершина число_выборок»"""
+        counts = Counter(self.samples)
+        names: Dict[CodeType, str] = {}
+        lines = []
+        for stack, count in counts.most_common():
+            lines.append(";".join(names.get(c) or names.setdefault(c, frame_name(c)) for c in stack) + f" {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self) -> Dict:
+        """Формат speedscope (sampled): выборки в порядке времени, вес — секунды"""
+        frames: List[Dict] = []
+        index: Dict[CodeType, int] = {}
+        samples = []
+        for stack in self.samples:
+            for code in stack:
+                if code not in index:
+                    index[code] = len(frames)
+                    frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+            samples.append([index[code] for code in stack])
+        name = f"pid {os.getpid()} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started))}"
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(self.duration, 6),
+                "samples": samples,
+                "weights": [round(w, 6) for w in self.weights],
+            }],
+            "name": name,
+            "activeProfileIndex": 0,
+            "exporter": "shopmax profiler",
+        }
+
+
+class StackSampler:
+    """
+    Пока идёт профилирование, отдельный поток каждые interval секунд
+    берёт стек потока event loop из sys._current_frames(). В остальное
+    время потока нет и ничего не замеряется. Простой loop виден как кадры
+    select() — доля простоя прямо на графике.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float, thread_id: Optional[int] = None) -> Profile:
+        """Профиль потока thread_id (по умолчанию — текущего, т.е. event loop) за seconds секунд"""
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise ValueError(f"Длительность профиля: {seconds}")  # nan не ограничивается min/max
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            seconds = min(max(seconds, self.interval), PROFILE_MAX_SECONDS)
+            thread_id = thread_id or threading.get_ident()
+            return await asyncio.get_running_loop().run_in_executor(None, self.sample, thread_id, seconds)
+        finally:
+            self._lock.release()
+
+    def sample(self, thread_id: int, seconds: float) -> Profile:
+        profile = Profile(thread_id, self.interval)
+        started = last = time.perf_counter()
+        deadline = started + seconds
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack.reverse()
+            profile.samples.append(tuple(stack))
+            profile.weights.append(now - last)
+            last = now
+            if now >= deadline:
+                break
+        profile.duration = last - started
+        return profile
+
+
+stack_sampler = StackSampler()
@@ -0,0 +1,282 @@
+"""
+Статистика SQL-запросов: отпечатки, время, строки и журнал медленных запросов
+"""
+
+import contextlib
+import os
+import re
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import nplusone
+import timing
+from accesslog import JsonLogWriter
+from tracing import tracer, KIND_CLIENT
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "")   # пусто — только в памяти
+SLOW_QUERY_RECENT = 100          # последних медленных запросов для админ-панели
+SLOW_PLAN_TTL = 300.0            # план одного отпечатка пересчитывается не чаще, секунд
+FINGERPRINT_CACHE_SIZE = 4096
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_LIST = re.compile(r"(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+")
+_SPACES = re.compile(r"\s+")
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def fingerprint(sql: str) -> str:
+    """Текст запроса без литералов и переменной длины списков: IN (?, ?, ?) → IN (...)"""
+    text = _SPACES.sub(" ", sql).strip()
+    text = _STRING.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _IN_LIST.sub("(...)", text)
+    return _VALUES_LIST.sub(r"\1", text)
+
+
+def operation(fp: str) -> str:
+    """Первое слово запроса (SELECT, INSERT...) — имя спана"""
+    return fp.split(" ", 1)[0].upper()
+
+
+class QueryStats:
+    """
+    Агрегаты по отпечаткам запросов в памяти процесса.
+
+    Обновляются из одного потока event loop без блокировок; время
+    выполнения и выборки строк одного запроса складывается, вызов
+    считается один раз — при execute.
+    """
+
+    def __init__(self, slow_ms: float = SLOW_QUERY_MS, log_path: str = SLOW_QUERY_LOG):
+        self.slow_ms = slow_ms
+        self.log = JsonLogWriter(log_path, name="slow-query-log")   # пишет свой поток, запрос не ждёт диска
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._fingerprints: Dict[str, str] = {}
+        self._plans: Dict[str, tuple] = {}
+        self.recent_slow: deque = deque(maxlen=SLOW_QUERY_RECENT)
+        self.since = time.time()
+
+        # Монотонные счётчики для /metrics, reset() их не трогает
+        self.by_function: Dict[str, List[float]] = {}    # функция -> [вызовы, секунды]
+        self.fingerprint_hits = 0
+        self.fingerprint_misses = 0
+        self.connections_open = 0
+        self.connections_total = 0
+
+    def fingerprint(self, sql: str) -> str:
+        fp = self._fingerprints.get(sql)
+        if fp is not None:
+            self.fingerprint_hits += 1
+        else:
+            self.fingerprint_misses += 1
+            if len(self._fingerprints) >= FINGERPRINT_CACHE_SIZE:
+                self._fingerprints.clear()
+            fp = self._fingerprints[sql] = fingerprint(sql)
+        return fp
+
+    def record(self, fp: str, function: str, seconds: float, rows: int = 0, calls: int = 1):
+        entry = self._stats.get(fp)
+        if entry is None:
+            entry = self._stats[fp] = {"fingerprint": fp, "function": function, "calls": 0,
+                                       "total_ms": 0.0, "max_ms": 0.0, "rows": 0}
+        ms = seconds * 1000
+        entry["calls"] += calls
+        entry["total_ms"] += ms
+        entry["rows"] += rows
+        if ms > entry["max_ms"]:
+            entry["max_ms"] = ms
+
+        timing.add("db", seconds, calls)
+
+        totals = self.by_function.get(function)
+        if totals is None:
+            totals = self.by_function[function] = [0, 0.0]
+        totals[0] += calls
+        totals[1] += seconds
+
+    def connection_opened(self, seconds: float):
+        """Открытие соединения (отдельный поток aiosqlite) — тоже время БД в Server-Timing"""
+        self.connections_open += 1
+        self.connections_total += 1
+        timing.add("db", seconds, 0)
+
+    def connection_closed(self, seconds: float):
+        self.connections_open -= 1
+        timing.add("db", seconds, 0)
+
+    def is_slow(self, seconds: float) -> bool:
+        return seconds * 1000 >= self.slow_ms
+
+    def needs_plan(self, fp: str) -> bool:
+        cached = self._plans.get(fp)
+        return cached is None or time.monotonic() - cached[0] >= SLOW_PLAN_TTL
+
+    def set_plan(self, fp: str, plan: List[str]):
+        self._plans[fp] = (time.monotonic(), plan)
+
+    def log_slow(self, fp: str, sql: str, function: str, seconds: float, rows: int):
+        """Медленный запрос — в recent_slow и строкой JSON в журнал (без параметров: там бывают персональные данные)"""
+        record = {
+            "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "function": function,
+            "ms": round(seconds * 1000, 3),
+            "rows": rows,
+            "fingerprint": fp,
+            "sql": _SPACES.sub(" ", sql).strip(),
+            "plan": self._plans.get(fp, (0, []))[1],
+        }
+        self.recent_slow.append(record)
+        if self.log.enabled:
+            self.log.write(record)
+
+    def top(self, n: int = 50, sort: str = "total_ms") -> List[Dict]:
+        entries = [dict(e, avg_ms=e["total_ms"] / e["calls"] if e["calls"] else 0.0) for e in self._stats.values()]
+        entries.sort(key=lambda e: e[sort], reverse=True)
+        return entries[:n]
+
+    def caches(self) -> Dict[str, object]:
+        return {
+            "query_stats.stats": self._stats,
+            "query_stats.fingerprints": self._fingerprints,
+            "query_stats.plans": self._plans,
+            "query_stats.recent_slow": self.recent_slow,
+            "query_stats.by_function": self.by_function,
+        }
+
+    def reset(self):
+        self._stats.clear()
+        self.recent_slow.clear()
+        self.since = time.time()
+
+
+class InstrumentedCursor:
+    """Курсор aiosqlite, добавляющий время и число выбранных строк к своему запросу"""
+
+    def __init__(self, cursor, connection: "InstrumentedConnection", fp: str, sql: str, params,
+                 seconds: float, explainable: bool = True):
+        self._cursor = cursor
+        self._connection = connection
+        self._fp = fp
+        self._sql = sql
+        self._params = params
+        self._seconds = seconds
+        self._rows = 0
+        self._logged = False
+        self._explainable = explainable and sql.lstrip().upper().startswith(_EXPLAINABLE)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+    async def _fetch(self, method, *args):
+        started = time.perf_counter()
+        result = await method(*args)
+        seconds = time.perf_counter() - started
+        rows = len(result) if isinstance(result, list) else int(result is not None)
+        self._seconds += seconds
+        self._rows += rows
+        self._connection.stats.record(self._fp, self._connection.function, seconds, rows, calls=0)
+        await self._connection.check_slow(self)
+        return result
+
+    async def fetchone(self):
+        return await self._fetch(self._cursor.fetchone)
+
+    async def fetchmany(self, size: int = None):
+        return await self._fetch(self._cursor.fetchmany, size or self._cursor.arraysize)
+
+    async def fetchall(self):
+        return await self._fetch(self._cursor.fetchall)
+
+    async def __aiter__(self):
+        while True:
+            rows = await self.fetchmany(self._cursor.iter_chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+
+class InstrumentedConnection:
+    """
+    Обёртка соединения aiosqlite: каждый execute/executemany замеряется и
+    попадает в QueryStats под именем функции database.py, открывшей get_db().
+    Остальные атрибуты (commit, row_factory, total_changes...) проксируются.
+    """
+
+    def __init__(self, connection, stats: QueryStats, function: str):
+        self._connection = connection
+        self.stats = stats
+        self.function = function
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        if name in ("_connection", "stats", "function"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._connection, name, value)
+
+    async def execute(self, sql: str, parameters=None) -> InstrumentedCursor:
+        fp = self.stats.fingerprint(sql)
+        with tracer.span(operation(fp), KIND_CLIENT, {"db.system": "sqlite", "db.statement": fp}):
+            started = time.perf_counter()
+            cursor = await self._connection.execute(sql, parameters)
+            seconds = time.perf_counter() - started
+        self.stats.record(fp, self.function, seconds)
+        nplusone.record(fp)
+        wrapped = InstrumentedCursor(cursor, self, fp, sql, parameters, seconds)
+        await self.check_slow(wrapped)
+        return wrapped
+
+    async def executemany(self, sql: str, parameters) -> InstrumentedCursor:
+        fp = self.stats.fingerprint(sql)
+        with tracer.span(operation(fp), KIND_CLIENT, {"db.system": "sqlite", "db.statement": fp}):
+            started = time.perf_counter()
+            cursor = await self._connection.executemany(sql, parameters)
+            seconds = time.perf_counter() - started
+        self.stats.record(fp, self.function, seconds)
+        nplusone.record(fp)
+        # План для executemany не строим: наборов параметров много
+        wrapped = InstrumentedCursor(cursor, self, fp, sql, None, seconds, explainable=False)
+        await self.check_slow(wrapped)
+        return wrapped
+
+    async def check_slow(self, cursor: InstrumentedCursor):
+        """Пишет запрос в журнал медленных один раз, как только его суммарное время превысит порог"""
+        if cursor._logged or not self.stats.is_slow(cursor._seconds):
+            return
+        cursor._logged = True
+        fp = cursor._fp
+        if cursor._explainable and self.stats.needs_plan(fp):
+            self.stats.set_plan(fp, await self._explain(cursor._sql, cursor._params))
+        self.stats.log_slow(fp, cursor._sql, self.function, cursor._seconds, cursor._rows)
+
+    async def _explain(self, sql: str, parameters) -> List[str]:
+        try:
+            cursor = await self._connection.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+            return [row[3] for row in await cursor.fetchall()]
+        except Exception as e:
+            return [f"EXPLAIN не удался: {e}"]
+
+
+def caller_name(frame) -> Optional[str]:
+    """Модуль и имя функции, вызвавшей get_db() (database.get_cart), минуя кадры contextlib"""
+    while frame is not None and frame.f_code.co_filename == contextlib.__file__:
+        frame = frame.f_back
+    if frame is None:
+        return None
+    return f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}"
+
+
+query_stats = QueryStats()
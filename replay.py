@@ -0,0 +1,183 @@
+"""
+Воспроизведение записанного трафика (см. capture.py) против main:app со сравнением задержек
+"""
+
+import asyncio
+import json
+import time
+from base64 import b64encode
+from datetime import datetime
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
+import itsdangerous
+
+from loadtest import asgi_clients, http_clients, summarize, git_commit
+
+REPLAY_SPEED = 1.0               # 2.0 — вдвое быстрее записи, 0 — без пауз
+REPLAY_MAX_INFLIGHT = 50         # одновременных запросов; при упоре растёт lag
+SESSION_COOKIE = "session"
+
+
+class _NoCookies(DefaultCookiePolicy):
+    """Клиент не запоминает Set-Cookie: сессия каждого запроса берётся из записи"""
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+def load_capture(path: str, limit: int = None) -> Tuple[List[Dict], int]:
+    """Записи, пригодные для воспроизведения, по времени прихода, и число пропущенных"""
+    records = []
+    skipped = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += 1  # недописанная строка
+                continue
+            if "body_skipped" in record:
+                skipped += 1
+                continue
+            records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    if limit:
+        records = records[:limit]
+    return records, skipped
+
+
+def session_cookie(session: Dict, secret_key: str) -> str:
+    """Подписанная cookie сессии в формате starlette SessionMiddleware"""
+    data = b64encode(json.dumps(session).encode("utf-8"))
+    return itsdangerous.TimestampSigner(str(secret_key)).sign(data).decode("utf-8")
+
+
+def route_of(record: Dict) -> str:
+    return f"{record['method']} {record.get('route') or record['path']}"
+
+
+def _report(samples: Dict[str, List[float]], errors: Dict[str, int], elapsed: float) -> Dict:
+    """Отчёт в формате loadtest: total и routes — годится для loadtest.compare_reports"""
+    everything = [s for values in samples.values() for s in values]
+    return {
+        "seconds": round(elapsed, 3),
+        "total": summarize(everything, sum(errors.values()), elapsed),
+        "routes": {route: summarize(values, errors.get(route, 0), elapsed)
+                   for route, values in sorted(samples.items())},
+    }
+
+
+def captured_report(records: List[Dict]) -> Dict:
+    """Задержки и ошибки в том виде, в каком они были при записи"""
+    samples: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    for record in records:
+        route = route_of(record)
+        samples.setdefault(route, []).append(record["duration_ms"] / 1000)
+        if record["status"] >= 400:
+            errors[route] = errors.get(route, 0) + 1
+    elapsed = records[-1]["ts"] - records[0]["ts"] if records else 0.0
+    return _report(samples, errors, elapsed)
+
+
+async def replay_records(client_factory, records: List[Dict], speed: float = REPLAY_SPEED,
+                         max_inflight: int = REPLAY_MAX_INFLIGHT) -> Dict:
+    """
+    Отправляет записи с исходными интервалами, делёнными на speed.
+    Авторизация восстанавливается по сохранённому user_id: сессия
+    собирается и подписывается ключом приложения. Запросы входа (с
+    вырезанным паролем) поэтому ответят иначе — это видно в mismatches.
+    """
+    from main import SESSION_SECRET_KEY
+
+    samples: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    mismatches: Dict[str, int] = {}
+    max_lag = 0.0
+    inflight = asyncio.Semaphore(max_inflight)
+    client = client_factory(cookies=CookieJar(policy=_NoCookies()))
+
+    async def send(record: Dict):
+        try:
+            status, seconds = await request(record)
+        finally:
+            inflight.release()
+        route = route_of(record)
+        samples.setdefault(route, []).append(seconds)
+        if status is None or status >= 400:
+            errors[route] = errors.get(route, 0) + 1
+        if status != record["status"]:
+            mismatches[route] = mismatches.get(route, 0) + 1
+
+    async def request(record: Dict) -> Tuple[Optional[int], float]:
+        headers = {}
+        # Запись хранит только user_id; в записях прежних версий — сессия целиком
+        session = {"user_id": record["user_id"]} if record.get("user_id") else record.get("session")
+        if session:
+            headers["cookie"] = f"{SESSION_COOKIE}={session_cookie(session, SESSION_SECRET_KEY)}"
+        url = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+        kwargs = {}
+        if "form" in record:
+            # Пары, а не dict: повторяющиеся поля формы сохраняются
+            kwargs["content"] = urlencode([tuple(pair) for pair in record["form"]]).encode("utf-8")
+            headers["content-type"] = "application/x-www-form-urlencoded"
+        elif "json" in record:
+            kwargs["json"] = record["json"]
+
+        started = time.perf_counter()
+        try:
+            response = await client.request(record["method"], url, headers=headers, **kwargs)
+        except httpx.HTTPError:
+            return None, time.perf_counter() - started
+        return response.status_code, time.perf_counter() - started
+
+    start = time.monotonic()
+    tasks = []
+    try:
+        t0 = records[0]["ts"] if records else 0.0
+        for record in records:
+            due = start + ((record["ts"] - t0) / speed if speed > 0 else 0.0)
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await inflight.acquire()
+            max_lag = max(max_lag, time.monotonic() - due)
+            tasks.append(asyncio.create_task(send(record)))
+        await asyncio.gather(*tasks)
+    finally:
+        await client.aclose()
+
+    report = _report(samples, errors, time.monotonic() - start)
+    report["status_mismatches"] = dict(sorted(mismatches.items()))
+    report["max_lag_ms"] = round(max_lag * 1000, 2) if speed > 0 else None
+    return report
+
+
+async def run(path: str, mode: str = "asgi", url: str = None, speed: float = REPLAY_SPEED,
+              max_inflight: int = REPLAY_MAX_INFLIGHT, limit: int = None) -> Dict:
+    """Воспроизведение записи: задержки при записи (captured) и при воспроизведении (replayed)"""
+    records, skipped = load_capture(path, limit)
+    if mode == "asgi":
+        clients = asgi_clients()
+    elif mode == "http":
+        clients = http_clients(url)
+    else:
+        raise ValueError(f"Режим: asgi или http, получено {mode!r}")
+
+    async with clients as client_factory:
+        replayed = await replay_records(client_factory, records, speed, max_inflight)
+
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "mode": mode,
+        "options": {"capture": path, "speed": speed, "max_inflight": max_inflight, "limit": limit},
+        "requests": len(records),
+        "skipped": skipped,
+        "captured": captured_report(records),
+        "replayed": replayed,
+    }
+
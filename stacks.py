@@ -0,0 +1,24 @@
+"""
+Стеки вызовов для диагностики: только кадры кода приложения
+"""
+
+import os
+import traceback
+from typing import List
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Модули самой диагностики — их кадры в отчётах не нужны
+DIAGNOSTIC_FILES = {os.path.join(APP_DIR, name) for name in (
+    "stacks.py", "querystats.py", "nplusone.py", "loopmonitor.py",
+)}
+
+
+def app_frames(stack: traceback.StackSummary) -> List[traceback.FrameSummary]:
+    """Кадры кода приложения, без библиотек, ASGI-middleware и модулей диагностики"""
+    return [f for f in stack
+            if f.filename.startswith(APP_DIR) and f.filename not in DIAGNOSTIC_FILES and f.name != "__call__"]
+
+
+def format_frame(frame: traceback.FrameSummary) -> str:
+    return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}: {frame.line}"
@@ -0,0 +1,133 @@
+"""
+Складской учёт: резерв, истечение резерва, сброс списаний в БД и восстановление журнала после падения
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from database import get_db
+from inventory import InsufficientStock, InventoryService
+
+PRODUCT = 7
+OTHER = 8
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def stock(product_id: int) -> int:
+    async with get_db() as db:
+        cursor = await db.execute("SELECT stock FROM products WHERE id = ?", (product_id,))
+        return (await cursor.fetchone())[0]
+
+
+async def journal_size() -> int:
+    async with get_db() as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM inventory_journal")
+        return (await cursor.fetchone())[0]
+
+
+async def commit_order(service: InventoryService, key: str):
+    """Как create_order: списание пишется в журнал в транзакции заказа"""
+    async with get_db() as db:
+        assert await service.journal(db, key)
+        await db.commit()
+
+
+@pytest.fixture
+def service(client):
+    service = InventoryService(ttl=60)
+    run(service.ensure_loaded([PRODUCT, OTHER]))
+    return service
+
+
+def test_reserve(service):
+    available = service.available(PRODUCT)
+
+    service.reserve("a", {PRODUCT: 2})
+    assert service.available(PRODUCT) == available - 2
+
+    with pytest.raises(InsufficientStock) as error:
+        service.reserve("b", {PRODUCT: available - 1})
+    assert error.value.available == available - 2
+    assert service.available(PRODUCT) == available - 2  # неудачный резерв ничего не занял
+
+    service.reserve("a", {PRODUCT: 1, OTHER: 1})  # тот же ключ заменяет резерв
+    assert service.available(PRODUCT) == available - 1
+
+    assert service.release("a")
+    assert service.available(PRODUCT) == available
+    assert not service.release("a")
+
+
+def test_expiry(service):
+    available = service.available(PRODUCT)
+    service.reserve("stale", {PRODUCT: 1})
+    service.reserve("ordering", {PRODUCT: 1})
+
+    async def journal_without_commit():
+        async with get_db() as db:
+            await service.journal(db, "ordering")
+
+    run(journal_without_commit())
+
+    # Резерв, записанный в журнал заказа, ждёт коммита и не истекает
+    assert service.expire(now=float("inf")) == 1
+    assert service.available(PRODUCT) == available - 1
+
+    service.release("ordering")
+    assert service.available(PRODUCT) == available
+    assert run(journal_size()) == 0
+
+
+def test_flush(service):
+    before = run(stock(PRODUCT))
+    service.reserve("order", {PRODUCT: 3})
+    run(commit_order(service, "order"))
+    assert service.confirm("order")
+
+    assert service.available(PRODUCT) == before - 3
+    assert run(stock(PRODUCT)) == before  # в БД — после сброса
+    assert run(journal_size()) == 1
+
+    run(service.flush())
+    assert run(stock(PRODUCT)) == before - 3
+    assert run(journal_size()) == 0
+
+
+def test_recovery(service):
+    before = run(stock(PRODUCT))
+    service.reserve("order", {PRODUCT: 2, OTHER: 1})
+    run(commit_order(service, "order"))
+    # Процесс упал после коммита заказа, до confirm и сброса
+
+    restarted = InventoryService()
+    run(restarted._recover())
+    assert run(stock(PRODUCT)) == before - 2
+    assert run(journal_size()) == 0
+
+    run(restarted.ensure_loaded([PRODUCT]))
+    assert restarted.available(PRODUCT) == before - 2
+
+
+def test_legacy_journal_import(service, tmp_path):
+    before = run(stock(PRODUCT))
+    path = tmp_path / "inventory.journal"
+    records = [{"seq": 1, "deltas": {str(PRODUCT): -5}}, {"seq": 2, "deltas": {str(PRODUCT): -1}}]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records) + '{"seq": 3', encoding="utf-8")
+
+    async def legacy_position():
+        async with get_db() as db:
+            await db.execute("CREATE TABLE inventory_slots (slot INTEGER PRIMARY KEY, last_seq INTEGER NOT NULL)")
+            await db.execute("INSERT INTO inventory_slots VALUES (0, 1)")  # запись 1 уже сброшена
+            await db.commit()
+
+    run(legacy_position())
+    run(service._import_legacy_journal(str(path)))
+    run(service._recover())
+
+    assert not path.exists()
+    assert run(stock(PRODUCT)) == before - 1
@@ -0,0 +1,85 @@
+"""
+Отправка писем из outbox: письма переживают недоступность SMTP-сервера и уходят, когда он вернулся
+"""
+
+import asyncio
+import time
+
+from database import add_outbox_message, get_db
+from notifications import NotificationDispatcher, SMTPConnection
+
+
+class FakeSMTP:
+    """SMTP-сервер, который можно выключить: пока он выключен, соединиться нельзя"""
+
+    def __init__(self):
+        self.down = False
+        self.connects = 0
+        self.received = []
+
+    def connect(self):
+        self.connects += 1
+        if self.down:
+            raise ConnectionRefusedError(111, "Connection refused")
+        return self
+
+    def send_message(self, message):
+        self.received.append(message['Message-ID'])
+
+    def noop(self):
+        pass
+
+    def quit(self):
+        pass
+
+
+async def add_messages(count: int):
+    async with get_db() as db:
+        for i in range(count):
+            await add_outbox_message(db, "order_status", f"buyer{i}@test.com",
+                                     {"order_id": 1000 + i, "name": "Тест", "status": "shipped"})
+        await db.commit()
+
+
+async def outbox_rows():
+    async with get_db() as db:
+        cursor = await db.execute("SELECT id, status, attempts, next_attempt_at FROM outbox ORDER BY id")
+        return [dict(row) for row in await cursor.fetchall()]
+
+
+async def backoff_expires():
+    async with get_db() as db:
+        await db.execute("UPDATE outbox SET next_attempt_at = ? WHERE status = 'pending'", (time.time() - 1,))
+        await db.commit()
+
+
+async def smtp_outage(server: FakeSMTP):
+    dispatcher = NotificationDispatcher(connection=SMTPConnection(factory=server.connect),
+                                        batch_size=100, rate_limit=1000)
+    try:
+        await add_messages(3)
+        server.down = True
+        assert await dispatcher.dispatch_batch() > 0
+
+        rows = await outbox_rows()
+        assert all(row['status'] == 'pending' and row['attempts'] == 1 for row in rows)
+        assert all(row['next_attempt_at'] > time.time() for row in rows)
+        assert server.connects == 1  # после отказа соединения пачка не перебирается дальше
+
+        # Пауза перед повтором ещё не прошла — письма не забираются
+        assert await dispatcher.dispatch_batch() == 0
+
+        server.down = False
+        await backoff_expires()
+        sent = await dispatcher.dispatch_batch()
+        assert sent == len(rows)
+        assert dispatcher.sent == sent
+
+        assert all(row['status'] == 'sent' for row in await outbox_rows())
+        assert sorted(server.received) == sorted(f"<outbox-{row['id']}@shopmax>" for row in rows)
+    finally:
+        await dispatcher.stop()
+
+
+def test_smtp_outage(client):
+    asyncio.run(smtp_outage(FakeSMTP()))
@@ -0,0 +1,57 @@
+"""
+Страницы магазина и админ-панели: отвечают 200 и укладываются в бюджеты SQL-запросов без N+1
+"""
+
+from inventory import inventory
+
+PUBLIC_PAGES = ["/", "/catalog", "/catalog?category=1&sort=price_asc", "/catalog?q=iphone", "/product/1",
+                "/login", "/register"]
+USER_PAGES = ["/", "/catalog", "/product/2", "/cart", "/favorites", "/checkout", "/orders", "/profile"]
+ADMIN_PAGES = ["/admin", "/admin/orders", "/admin/orders?status=pending", "/admin/products", "/admin/users"]
+
+
+def get_ok(client, path: str):
+    response = client.get(path)
+    assert response.status_code == 200, f"{path}: {response.status_code}"
+    return response
+
+
+def test_public_pages(guest_client, query_budget):
+    for path in PUBLIC_PAGES:
+        get_ok(guest_client, path)
+
+
+def test_user_pages(user_client, query_budget):
+    for path in USER_PAGES:
+        get_ok(user_client, path)
+
+
+def test_product_page_cold_inventory(user_client, query_budget):
+    # Остаток товара ещё не в памяти — страница подгружает его из БД
+    inventory.invalidate()
+    get_ok(user_client, "/product/1")
+
+
+def test_checkout(user_client, query_budget):
+    for product_id, quantity in ((1, 2), (3, 1), (5, 1)):
+        response = user_client.post("/api/cart/add", json={"product_id": product_id, "quantity": quantity})
+        assert response.json()["success"]
+
+    response = user_client.post("/checkout", data={"name": "Тест", "email": "user@test.com",
+                                                   "phone": "+7 900 000-00-00", "address": "Москва"})
+    assert response.status_code == 200
+    assert "успешно" in response.text
+    get_ok(user_client, "/orders")
+
+
+def test_admin_pages(admin_client, query_budget):
+    for path in ADMIN_PAGES:
+        get_ok(admin_client, path)
+
+
+def test_budget_violation_is_reported(guest_client, query_budget):
+    query_budget.limit("GET /catalog", 0)
+    get_ok(guest_client, "/catalog")
+
+    assert any(problem.startswith("GET /catalog") for problem in query_budget.violations())
+    query_budget.requests.clear()  # нарушение ожидаемое — проверка фикстуры при завершении теста пройдёт
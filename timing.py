@@ -0,0 +1,122 @@
+"""
+Разбивка времени запроса: SQL, построение HTML и сериализация JSON (заголовок Server-Timing)
+"""
+
+import os
+import random
+import time
+from contextvars import ContextVar, Token
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+from starlette.responses import JSONResponse as _JSONResponse
+
+import tracing
+from tracing import tracer
+
+SERVER_TIMING_SAMPLE_RATE = float(os.environ.get("SERVER_TIMING_SAMPLE_RATE", "1.0"))
+
+# Составляющие в порядке вывода; app — остаток: код обработчиков, middleware, ожидание
+TIMING_PARTS = ("db", "render", "serialize")
+
+# Время и число операций по составляющим текущего запроса; None — запрос не в выборке.
+# Кроме TIMING_PARTS здесь же считаются попадания в кэш остатков (cache_hit, cache_miss)
+_timings: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_timings", default=None)
+
+
+def current() -> Optional[Dict[str, List[float]]]:
+    return _timings.get()
+
+
+def begin() -> Tuple[Dict[str, List[float]], Token]:
+    """Начинает сбор составляющих для текущего запроса; завершать через end(token)"""
+    timings: Dict[str, List[float]] = {}
+    return timings, _timings.set(timings)
+
+
+def end(token: Token):
+    _timings.reset(token)
+
+
+def add(part: str, seconds: float, count: int = 1):
+    timings = _timings.get()
+    if timings is None:
+        return
+    entry = timings.get(part)
+    if entry is None:
+        timings[part] = [seconds, count]
+    else:
+        entry[0] += seconds
+        entry[1] += count
+
+
+def timed(part: str):
+    """Декоратор синхронной функции: её время добавляется к составляющей part, в трассе — спан"""
+    def decorator(func):
+        name = f"{part} {func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _timings.get() is None and tracing.current() is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                with tracer.span(name):
+                    return func(*args, **kwargs)
+            finally:
+                add(part, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class JSONResponse(_JSONResponse):
+    """JSONResponse, у которого время json.dumps попадает в serialize"""
+
+    @timed("serialize")
+    def render(self, content) -> bytes:
+        return super().render(content)
+
+
+def server_timing_header(timings: Dict[str, List[float]], total: float) -> str:
+    parts = []
+    accounted = 0.0
+    for part in TIMING_PARTS:
+        if part in timings:
+            seconds, count = timings[part]
+            accounted += seconds
+            desc = f';desc="{count} queries"' if part == "db" else ""
+            parts.append(f"{part};dur={seconds * 1000:.2f}{desc}")
+    parts.append(f"app;dur={max(0.0, total - accounted) * 1000:.2f}")
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI-middleware: для запросов из выборки собирает время по составляющим
+    в contextvar и отдаёт его заголовком Server-Timing (видно во вкладке
+    Network в devtools).
+    """
+
+    def __init__(self, app, sample_rate: float = SERVER_TIMING_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            await self.app(scope, receive, send)
+            return
+
+        timings, token = begin()
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                header = server_timing_header(timings, time.perf_counter() - started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end(token)
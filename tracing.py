@@ -0,0 +1,321 @@
+"""
+Трассировка запросов: спаны в духе OpenTelemetry, W3C traceparent и выгрузка пачками в OTLP/JSON
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Set
+
+from metrics import route_template
+
+TRACE_EXPORT = os.environ.get("TRACE_EXPORT", "")      # пусто — выключено; путь к файлу или http://…/v1/traces
+TRACE_SAMPLE_RATIO = float(os.environ.get("TRACE_SAMPLE_RATIO", "0.01"))
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "shopmax")
+# Адреса, чьему traceparent доверяется решение о выборке (свой балансировщик, сервисы); через запятую
+TRACE_TRUSTED_PROXIES = {ip.strip() for ip in os.environ.get("TRACE_TRUSTED_PROXIES", "").split(",") if ip.strip()}
+TRACE_BATCH_SIZE = 512           # спанов в одной выгрузке
+TRACE_EXPORT_INTERVAL = 2.0      # период выгрузки неполной пачки, секунд
+TRACE_QUEUE_SIZE = 20000         # сверх этого старые спаны отбрасываются
+
+# Виды спанов OTLP
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+KIND_CONSUMER = 5
+
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+_NO_SPAN = nullcontext()         # вне трассы: with отдаёт None
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes",
+                 "error")
+
+    def __init__(self, name: str, kind: int, trace_id: str, parent_id: str = "", attributes: Dict = None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items() if v is not None],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error is not None:
+            span["status"] = {"code": STATUS_ERROR, "message": self.error}
+        return span
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+# Текущий спан; None — трассировка выключена или запрос не попал в выборку
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current() -> Optional[Span]:
+    return _current.get()
+
+
+def parse_traceparent(header: str) -> Optional[tuple]:
+    """(trace_id, parent_id, sampled) из заголовка W3C traceparent; None — заголовка нет или он битый"""
+    match = _TRACEPARENT.match(header.strip().lower()) if header else None
+    if match is None:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    if trace_id == _INVALID_TRACE_ID or parent_id == _INVALID_SPAN_ID:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+class _SpanScope:
+    """Делает спан текущим на время блока with и отдаёт его экспортёру по завершении"""
+
+    __slots__ = ("span", "_token")
+
+    def __init__(self, span: Span):
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end_ns = time.time_ns()
+        if exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        _current.reset(self._token)
+        tracer.export(self.span)
+        return False
+
+
+class Tracer:
+    """
+    Спаны создаются только внутри трассы, попавшей в выборку: вне её
+    span() возвращает пустой контекст и ничего не стоит. Решение о выборке
+    принимается в корне — по флагу sampled из доверенного traceparent, а без
+    него по доле TRACE_SAMPLE_RATIO от trace id. От недоверенного источника
+    берётся только trace id, а выборка — та же доля, но случайно: trace id
+    выбирает клиент и мог бы подобрать его под выборку. Законченные спаны копятся
+    в очереди, поток выгрузки пачками пишет их строками OTLP/JSON в файл
+    (формат otlpjsonfile у OpenTelemetry Collector) или POST-ит на
+    OTLP/HTTP-приёмник.
+    """
+
+    def __init__(self, export: str = TRACE_EXPORT, ratio: float = TRACE_SAMPLE_RATIO,
+                 service_name: str = TRACE_SERVICE_NAME):
+        self.export_to = export
+        self.ratio = ratio
+        self.service_name = service_name
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._queue: deque = deque()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.export_to)
+
+    # ─── Спаны ───
+
+    def trace(self, name: str, kind: int = KIND_INTERNAL, traceparent: str = None, attributes: Dict = None,
+              trusted: bool = True):
+        """Корневой спан (или продолжение внешней трассы из traceparent), если трасса попала в выборку"""
+        if not self.export_to:
+            return _NO_SPAN
+        parent = parse_traceparent(traceparent)
+        if parent is not None and trusted:
+            trace_id, parent_id, sampled = parent
+        elif parent is not None:
+            trace_id, parent_id = parent[0], ""
+            sampled = random.random() < self.ratio
+        else:
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", ""
+            sampled = self.should_sample(trace_id)
+        if not sampled:
+            return _NO_SPAN
+        return _SpanScope(Span(name, kind, trace_id, parent_id, attributes))
+
+    def span(self, name: str, kind: int = KIND_INTERNAL, attributes: Dict = None):
+        """Дочерний спан текущего; вне трассы — пустой контекст"""
+        parent = _current.get()
+        if parent is None:
+            return _NO_SPAN
+        return _SpanScope(Span(name, kind, parent.trace_id, parent.span_id, attributes))
+
+    def should_sample(self, trace_id: str) -> bool:
+        # Как TraceIdRatioBased: решение зависит только от trace id
+        return int(trace_id[16:], 16) < self.ratio * (1 << 64)
+
+    def export(self, span: Span):
+        if len(self._queue) >= TRACE_QUEUE_SIZE:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(span)
+        if len(self._queue) >= TRACE_BATCH_SIZE:
+            self._wakeup.set()
+
+    # ─── Выгрузка ───
+
+    async def start(self):
+        if not self.export_to:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout=5.0)
+        self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(TRACE_EXPORT_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        while self._queue:
+            batch: List[Span] = []
+            while self._queue and len(batch) < TRACE_BATCH_SIZE:
+                batch.append(self._queue.popleft())
+            try:
+                self._send(self.encode(batch))
+                self.exported += len(batch)
+            except (OSError, ValueError) as e:
+                self.failed += len(batch)
+                print(f"⚠️ Ошибка выгрузки трасс: {e}")
+
+    def encode(self, batch: List[Span]) -> bytes:
+        """ExportTraceServiceRequest в JSON-кодировке OTLP"""
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": self.service_name}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": "shopmax.tracing"},
+                "spans": [span.to_otlp() for span in batch],
+            }],
+        }]}
+        return json.dumps(request, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def _send(self, body: bytes):
+        if self.export_to.startswith(("http://", "https://")):
+            request = urllib.request.Request(self.export_to, data=body, method="POST",
+                                             headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+            return
+        if self._file is None:
+            self._file = open(self.export_to, "ab")
+        self._file.write(body + b"\n")
+        self._file.flush()
+
+
+class TracingMiddleware:
+    """
+    ASGI-middleware: серверный спан на HTTP-запрос, продолжает трассу из
+    входящего traceparent (решение о выборке — только от адресов из
+    TRACE_TRUSTED_PROXIES). Имя спана — метод и шаблон маршрута; пользователь
+    берётся из сессии, поэтому middleware стоит снаружи SessionMiddleware.
+    """
+
+    def __init__(self, app, trusted_proxies: Set[str] = None):
+        self.app = app
+        self.trusted_proxies = TRACE_TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope.get("headers", []):
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        client = scope.get("client")
+        trusted = client is not None and client[0] in self.trusted_proxies
+        with tracer.trace(scope["method"], KIND_SERVER, traceparent, {
+            "http.request.method": scope["method"],
+            "url.path": scope["path"],
+        }, trusted=trusted) as span:
+            if span is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    span.set("http.response.status_code", status)
+                    if status >= 500:
+                        span.error = f"HTTP {status}"
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = route_template(scope)
+                if route:
+                    span.name = f"{scope['method']} {route}"
+                    span.set("http.route", route)
+                session = scope.get("session")
+                if session and session.get("user_id"):
+                    span.set("enduser.id", session["user_id"])
+
+
+tracer = Tracer()